@@ -0,0 +1,194 @@
+# -*- coding:utf-8 -*-
+"""
+故障切换开销基准：把 main.py 的贴吧接口指向本地桩（tieba_stub.py），
+在各种故障场景下跑一遍“tbs -> 关注列表 -> 签到 -> 回帖”，输出：
+墙钟时间、每个贴吧的签到请求数、各接口请求数，以及花在休眠上的时间（限速 / 重试退避 / 熔断冷却）。
+
+用法：
+    python bench_failover.py                       # 全部场景
+    python bench_failover.py -s baseline -s 5xx    # 指定场景
+    python bench_failover.py --forums 30 --sync    # 30 个贴吧，走同步 client_sign
+    python bench_failover.py --list                # 列出场景
+不访问外网：首选代理为本地假 SOCKS5，备用代理列表不从 ProxyScrape 拉取。
+限速、重试、熔断等参数照常从环境变量读取，下面仅给出便于基准的默认值。
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+# 基准默认值：不落盘台账/缓存/线路记忆，熔断冷却缩短到 3 秒；可用环境变量覆盖
+for _k, _v in {
+    'PROXY_ENABLE': 'true',
+    'SIGN_LEDGER_ENABLE': 'false',
+    'FAVORITES_CACHE_ENABLE': 'false',
+    'ROUTE_MEMORY_ENABLE': 'false',
+    'BREAKER_COOLDOWN': '3',
+}.items():
+    os.environ.setdefault(_k, _v)
+
+import main  # noqa: E402
+from tieba_stub import TiebaStub, FakeSocksProxy, Fault  # noqa: E402
+
+# -----------------------------
+# 场景：{名称: (说明, {接口: Fault}, 首选代理配置)}
+# -----------------------------
+FAST = Fault(latency=0.02)
+
+SCENARIOS = {
+    'baseline': ("全部正常（20ms 延迟）", {}, {}),
+    'slow': ("签到 300~800ms 延迟", {'sign': Fault(latency=0.3, jitter=0.5)}, {}),
+    '5xx': ("签到 30% 返回 503", {'sign': Fault(latency=0.02, error_5xx=0.3)}, {}),
+    'drop': ("签到 20% 直接断连", {'sign': Fault(latency=0.02, drop=0.2)}, {}),
+    'timeout': ("签到 10% 挂起至客户端超时", {'sign': Fault(latency=0.02, timeout=0.1, hang=12)}, {}),
+    'tbs-5xx': ("tbs / 关注列表 50% 返回 503",
+                {'tbs': Fault(latency=0.02, error_5xx=0.5), 'like': Fault(latency=0.02, error_5xx=0.5)}, {}),
+    'code-110': ("签到 10% 返回 110 风控", {'sign': Fault(latency=0.02, codes={'110': 0.1})}, {}),
+    'code-1102': ("签到 30% 返回 1102 过快", {'sign': Fault(latency=0.02, codes={'1102': 0.3})}, {}),
+    'code-1107': ("签到 5 个后返回 1107 日上限", {'sign': Fault(latency=0.02, daily_cap=5)}, {}),
+    'code-160002': ("签到 50% 返回 160002 已签到", {'sign': Fault(latency=0.02, codes={'160002': 0.5})}, {}),
+    'reply-5xx': ("回帖 50% 返回 503", {'reply': Fault(latency=0.02, error_5xx=0.5)}, {}),
+    'proxy-refuse': ("首选代理拒绝连接，退到备用代理/直连", {}, {'mode': 'refuse'}),
+    'proxy-stall': ("首选代理握手挂起", {}, {'mode': 'stall'}),
+    'proxy-slow': ("首选代理每个连接握手延迟 300ms", {}, {'delay': 0.3}),
+}
+
+
+# -----------------------------
+# 单个场景
+# -----------------------------
+def reset_main_state(user_proxy, backups):
+    """每个场景使用全新的熔断/限速/重试预算/连接池，避免场景间互相影响"""
+    main.breakers = main.BreakerBoard()
+    main.sign_scheduler = main.SignScheduler(main.SIGN_DAILY_CAP)
+    main.pacer = main.Pacer()
+    main.latency_tracker = main.LatencyTracker()
+    main.RETRY_POLICY.budget = main.RetryBudget(main.RETRY_BUDGET)
+    main.profiler = main.PhaseProfiler(True)  # 借用剖析器按类别统计休眠
+    main.transport.close()
+    main.transport = main.TransportPool(main.POOL_MAXSIZE)
+    main.aio_sessions = main.AioSessionPool(main.POOL_MAXSIZE)
+
+    pm = main.proxy_manager
+    pm.enable = True
+    pm.user_proxy = user_proxy
+    pm.backup_proxies = list(backups)
+    pm.stats = {}
+    pm._fetch_attempted = True      # 不访问 ProxyScrape
+    pm.first_success_logged = True  # 不访问 ipinfo.io
+    main.SOCKS_PROXY = user_proxy or ''
+
+
+async def run_pipeline(bduss, replies, sync_sign):
+    tbs = await asyncio.to_thread(main.get_tbs_sync, bduss)
+    favorites = await asyncio.to_thread(main.get_favorite_fast, bduss)
+    if sync_sign:
+        results = []
+        for f in favorites:
+            await main.pacer.acquire(bduss, 'sign')
+            results.append(await asyncio.to_thread(main.client_sign, bduss, tbs, f['id'], f['name']))
+    else:
+        results = await main.sign_forums_async(bduss, tbs, favorites)
+    reply_ok = 0
+    for i in range(replies):
+        ok, _ = await asyncio.to_thread(main.client_reply, bduss, '1000', 'stub0', 100 + i, f'bench {i}', tbs)
+        reply_ok += bool(ok)
+    await main.aio_sessions.close()
+    return favorites, results, reply_ok
+
+
+def run_scenario(name, stub, forums, replies, sync_sign):
+    desc, faults, proxy_cfg = SCENARIOS[name]
+    stub.reset(seed=hash(name) & 0xffff)
+    stub.forums = forums
+    for endpoint in ('sign', 'msign', 'tbs', 'like', 'reply'):
+        stub.set_fault(endpoint, faults.get(endpoint, FAST))
+
+    user_proxy = FakeSocksProxy(**proxy_cfg).start()
+    backup_proxy = FakeSocksProxy().start()
+    reset_main_state(user_proxy.url, [backup_proxy.url])
+    for const, url in stub.urls().items():
+        setattr(main, const, url)
+
+    bduss = f"bench-{name}"
+    t0 = time.perf_counter()
+    try:
+        favorites, results, reply_ok = asyncio.run(run_pipeline(bduss, replies, sync_sign))
+    finally:
+        wall = time.perf_counter() - t0
+        main.transport.close()
+        user_proxy.stop()
+        backup_proxy.stop()
+
+    signed = sum(1 for r in results if main._is_sign_ok(r))
+    sign_requests = stub.hits['sign'] + stub.hits['msign']
+    faults_hit = {f'{k[0]}:{k[1]}': v for k, v in stub.hits.items() if isinstance(k, tuple)}
+    return {
+        'name': name,
+        'desc': desc,
+        'wall': wall,
+        'forums': len(favorites),
+        'signed': signed,
+        'sign_requests': sign_requests,
+        'per_forum': sign_requests / len(favorites) if favorites else 0.0,
+        'tbs': stub.hits['tbs'],
+        'like': stub.hits['like'],
+        'reply': stub.hits['reply'],
+        'reply_ok': reply_ok,
+        'sleep': main.profiler.sleep_totals(),
+        'faults': faults_hit,
+        'proxy_conns': user_proxy.connections,
+        'backup_conns': backup_proxy.connections,
+        'breakers': main.breakers.summary(bduss),
+    }
+
+
+def print_report(rows):
+    header = (f"{'场景':<14}{'墙钟(s)':>8}{'签到':>8}{'请求/吧':>8}{'tbs':>5}{'like':>5}{'回帖':>6}"
+              f"{'限速(s)':>9}{'退避(s)':>9}{'熔断(s)':>9}{'代理连接':>10}")
+    print(header)
+    for r in rows:
+        sl = r['sleep']
+        print(f"{r['name']:<14}{r['wall']:>8.2f}{r['signed']:>4}/{r['forums']:<3}{r['per_forum']:>8.2f}"
+              f"{r['tbs']:>5}{r['like']:>5}{r['reply_ok']:>3}/{r['reply']:<2}"
+              f"{sl.get('pacing', 0):>9.2f}{sl.get('retry', 0):>9.2f}{sl.get('breaker', 0):>9.2f}"
+              f"{r['proxy_conns']:>5}/{r['backup_conns']:<4}")
+    print()
+    for r in rows:
+        extra = f"，注入故障 {r['faults']}" if r['faults'] else ""
+        brk = f"，熔断 {r['breakers']}" if r['breakers'] else ""
+        print(f"- {r['name']}：{r['desc']}{extra}{brk}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="贴吧签到故障切换开销基准（本地桩，不访问百度）")
+    parser.add_argument('-s', '--scenario', action='append', choices=sorted(SCENARIOS), help="要运行的场景，可重复")
+    parser.add_argument('--forums', type=int, default=12, help="关注贴吧数量（默认 12）")
+    parser.add_argument('--replies', type=int, default=1, help="每个场景的回帖次数（默认 1）")
+    parser.add_argument('--sync', action='store_true', help="用同步 client_sign 逐个签到（默认并发 client_sign_async）")
+    parser.add_argument('--list', action='store_true', help="列出场景后退出")
+    parser.add_argument('-v', '--verbose', action='store_true', help="显示 main.py 的日志")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, (desc, _, _) in SCENARIOS.items():
+            print(f"{name:<14}{desc}")
+        return
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.ERROR)
+
+    stub = TiebaStub().start()
+    rows = []
+    try:
+        for name in args.scenario or list(SCENARIOS):
+            print(f"运行场景 {name} ...", file=sys.stderr)
+            rows.append(run_scenario(name, stub, args.forums, args.replies, args.sync))
+    finally:
+        stub.stop()
+    print_report(rows)
+
+
+if __name__ == '__main__':
+    main_cli()
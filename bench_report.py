@@ -0,0 +1,92 @@
+# -*- coding:utf-8 -*-
+"""
+邮件报告基准：对比旧版（保留全部关注列表，逐个贴吧 `body +=` 拼接正文）与流式 SignReport
+（逐条写入 gzip 附件，正文只含汇总）在不同贴吧数量下的耗时、正文大小、附件大小和内存峰值。
+“记录”为签到过程中逐个贴吧写入结果的累计耗时（分散在整次运行中），“生成”为运行结束时生成邮件的耗时；
+内存峰值用 tracemalloc 统计，会拖慢计时，耗时以未开启 tracemalloc 的一轮为准。
+
+用法：python bench_report.py [贴吧数量 ...]     # 默认 1000 10000 50000
+不发送邮件，只生成 MIME 消息。
+"""
+import random
+import sys
+import time
+import tracemalloc
+
+import main
+
+ACCOUNTS = 5
+
+
+def fake_forums(n, seed=0):
+    rng = random.Random(seed)
+    for i in range(n):
+        forum = {'id': str(100000 + i), 'name': f'测试吧{i}', 'slogan': '这是一个用于基准测试的贴吧简介' * 2,
+                 'level_id': str(rng.randint(1, 18)), 'cur_score': str(rng.randint(0, 50000))}
+        r = rng.random()
+        if r < 0.9:
+            res = {'error_code': '0', 'user_info': {'user_sign_rank': i}}
+        elif r < 0.97:
+            res = {'error_code': '160002', 'error_msg': '亲，你之前已经签过了'}
+        else:
+            res = {'error_code': '340006', 'error_msg': '贴吧目录出问题啦'}
+        yield i % ACCOUNTS, forum, res, rng.uniform(0.05, 2.0)
+
+
+def legacy_body(sign_list):
+    """旧版正文：逐个账号、逐个贴吧 `body +=`"""
+    body = ""
+    for idx, user_favorites in enumerate(sign_list, start=1):
+        body += f"<br><b>账号{idx}的签到信息：</b><br><br>"
+        for i in user_favorites:
+            body += (
+                f"<div class=\"child\">"
+                f"<div class=\"name\">贴吧名称: {i['name']}</div>"
+                f"<div class=\"slogan\">贴吧简介: {i.get('slogan','无')}</div>"
+                f"</div><hr>"
+            )
+    return body
+
+
+def run_legacy(rows):
+    t0 = time.perf_counter()
+    sign_list = [[] for _ in range(ACCOUNTS)]
+    for acc, forum, _, _ in rows:
+        sign_list[acc].append(forum)
+    t1 = time.perf_counter()
+    body = legacy_body(sign_list)
+    return t1 - t0, time.perf_counter() - t1, len(body.encode('utf-8')), 0
+
+
+def run_stream(rows):
+    t0 = time.perf_counter()
+    report = main.SignReport(main.REPORT_SLOWEST, main.REPORT_MAX_FAILURES)
+    for acc in range(ACCOUNTS):
+        report.account(acc + 1, f'bench-{acc}')
+    for acc, forum, res, seconds in rows:
+        report.record(f'bench-{acc}', forum, res, seconds)
+    t1 = time.perf_counter()
+    msg = main.build_report_message(ACCOUNTS, 0, [], report=report)
+    html_part, *attachments = msg.get_payload()
+    body = html_part.get_payload(decode=True)
+    attach = attachments[0].get_payload(decode=True) if attachments else b''
+    return t1 - t0, time.perf_counter() - t1, len(body), len(attach)
+
+
+def measure(fn, n):
+    record, build, body, attach = fn(fake_forums(n))
+    tracemalloc.start()
+    fn(fake_forums(n))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return record, build, body, attach, peak
+
+
+if __name__ == '__main__':
+    sizes = [int(x) for x in sys.argv[1:]] or [1000, 10000, 50000]
+    print(f"{'贴吧数':>8}{'方式':>6}{'记录(ms)':>10}{'生成(ms)':>10}{'正文(KB)':>10}{'附件(KB)':>10}{'内存峰值(MB)':>14}")
+    for n in sizes:
+        for name, fn in (('旧版', run_legacy), ('流式', run_stream)):
+            record, build, body, attach, peak = measure(fn, n)
+            print(f"{n:>8}{name:>6}{record * 1000:>10.1f}{build * 1000:>10.1f}{body / 1024:>10.1f}"
+                  f"{attach / 1024:>10.1f}{peak / 1024 / 1024:>14.1f}")
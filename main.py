@@ -1,13 +1,19 @@
 # -*- coding:utf-8 -*-
+import time
+_MODULE_T0 = time.perf_counter()  # 模块加载起点（启动耗时统计）
 import os
-import requests
 import hashlib
-import time
 import copy
 import logging
 import random
-import smtplib
-from email.mime.text import MIMEText
+import threading
+import contextvars
+import contextlib
+import itertools
+import heapq
+import html
+import importlib
+from collections.abc import Mapping
 from urllib.parse import quote
 from json import JSONDecodeError
 import json
@@ -18,6 +24,60 @@ import json
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# -----------------------------
+# 延迟导入（requests / aiohttp / aiotieba 等较重的依赖在首次使用时才导入，缩短冷启动）
+# -----------------------------
+LAZY_IMPORT_TIMES = {}  # {模块名: 首次导入耗时(秒)}
+
+class _LazyModule:
+    """模块代理：首次访问属性时才真正导入，导入耗时记入 LAZY_IMPORT_TIMES"""
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            t0 = time.perf_counter()
+            module = importlib.import_module(self._name)
+            LAZY_IMPORT_TIMES.setdefault(self._name, time.perf_counter() - t0)
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return f"<lazy module {self._name!r} ({state})>"
+
+class _LazyMapping(Mapping):
+    """只读字典代理：首次读取时才调用 factory 生成内容（设备指纹等）"""
+    def __init__(self, factory):
+        self._factory = factory
+        self._data = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    self._data = self._factory()
+        return self._data
+
+    def __getitem__(self, key):
+        return self._get()[key]
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def __len__(self):
+        return len(self._get())
+
+requests = _LazyModule('requests')
+aiohttp = _LazyModule('aiohttp')
+aiotieba = _LazyModule('aiotieba')
+
 # -----------------------------
 # 设备指纹生成 (持久化)
 # -----------------------------
@@ -108,8 +168,12 @@ def get_persistent_device(filename="device_profile.json"):
             logger.error(f"保存设备指纹失败: {e}")
         return device
 
-DEVICE = get_persistent_device()
-logger.info(f"当前设备指纹: {DEVICE['brand']} {DEVICE['model']}, IMEI={DEVICE['imei'][:4]}****, CUID={DEVICE['cuid']}")
+def _load_device():
+    device = get_persistent_device()
+    logger.info(f"当前设备指纹: {device['brand']} {device['model']}, IMEI={device['imei'][:4]}****, CUID={device['cuid']}")
+    return device
+
+DEVICE = _LazyMapping(_load_device)  # 首次用到时才加载/生成
 
 # 高级UA生成器
 def generate_realistic_ua(device_info):
@@ -136,7 +200,7 @@ USER_AGENTS_DESKTOP = [
 
 # 动态UA管理
 UA_REFRESH_CYCLE = 10
-_current_mobile_ua = generate_realistic_ua(DEVICE)
+_current_mobile_ua = None  # 首次需要移动端 UA 时生成
 _ua_counter = 0
 
 def get_headers(is_mobile=False):
@@ -144,7 +208,7 @@ def get_headers(is_mobile=False):
     global _ua_counter, _current_mobile_ua
     if is_mobile:
         _ua_counter += 1
-        if _ua_counter % UA_REFRESH_CYCLE == 0:
+        if _current_mobile_ua is None or _ua_counter % UA_REFRESH_CYCLE == 0:
             _current_mobile_ua = generate_realistic_ua(DEVICE)
         ua = _current_mobile_ua
         
@@ -169,7 +233,7 @@ def get_headers(is_mobile=False):
 # -----------------------------
 # API 地址
 # -----------------------------
-REPLY_URL   = "http://c.tieba.baidu.com/c/c/post/add"            # 回帖接口（移动端）
+REPLY_URL   = "https://c.tieba.baidu.com/c/c/post/add"           # 回帖接口（移动端，走 HTTPS）
 VIEW_POST_URL = "http://c.tieba.baidu.com/c/c/post/thread"       # 查看帖子接口（移动端）
 DELETE_URL  = "http://c.tieba.baidu.com/c/u/comment/postDel"     # 删除回复接口
 SET_TOP_URL = "http://tieba.baidu.com/mo/q"                      # 置顶/取消置顶接口
@@ -191,6 +255,9 @@ MODERATED_BARS          = ENV.get('MODERATED_BARS', '')
 TARGET_POST_IDS         = ENV.get('TARGET_POST_IDS', '')
 PROXY_ENABLE            = ENV.get('PROXY_ENABLE', 'false').lower() == 'true'        # 是否使用代理
 SOCKS_PROXY             = ENV.get('SOCKS_PROXY', '')                                # 首选代理
+ACCOUNT_CONCURRENCY     = max(1, int(ENV.get('ACCOUNT_CONCURRENCY', '1') or 1))      # 同时运行的账号数（1 为逐个执行）
+SIGN_CONCURRENCY        = max(1, int(ENV.get('SIGN_CONCURRENCY', '3') or 1))         # 单账号同时签到的贴吧数
+PRECHECK_CONCURRENCY    = max(1, int(ENV.get('PRECHECK_CONCURRENCY', '10') or 1))    # 登录态预检的最大并发连接数
 
 # -----------------------------
 # 请求签名 & 常量
@@ -204,7 +271,7 @@ SIGN_KEY     = 'tiebaclient!!!'
 UTF8         = "utf-8"
 
 # 基础签名数据（使用高级设备指纹）
-SIGN_DATA    = {
+SIGN_DATA    = _LazyMapping(lambda: {
     '_client_type': '2',
     '_client_version': '12.18.1.0',
     '_phone_imei': DEVICE['imei'],
@@ -212,14 +279,473 @@ SIGN_DATA    = {
     'net_type': '1',
     '_client_id': DEVICE['client_id'],
     'cuid': DEVICE['cuid'],
-}
+})
+
+# -----------------------------
+# 分阶段性能剖析（PROFILE=true 或 --profile）：各账号各阶段的墙钟 / 休眠 / 网络 / CPU 时间
+# -----------------------------
+PROFILE_ENABLE        = ENV.get('PROFILE', 'false').lower() == 'true'
+PROFILE_CPROFILE      = ENV.get('PROFILE_CPROFILE', 'false').lower() == 'true'  # 额外用 cProfile 统计热点函数
+PROFILE_REPORT_FILE   = ENV.get('PROFILE_REPORT_FILE', 'profile_report.json')
+PROFILE_TRACE_FILE    = ENV.get('PROFILE_TRACE_FILE', 'profile_trace.json')     # Chrome trace（chrome://tracing / Perfetto）
+PROFILE_HOTSPOTS_FILE = ENV.get('PROFILE_HOTSPOTS_FILE', 'profile_hotspots.txt')
+
+# 当前所处的阶段（随 asyncio 任务 / to_thread 传递，休眠与网络耗时记到所在阶段及其上层阶段）
+_current_span = contextvars.ContextVar('profile_span', default=None)
+
+class PhaseProfiler:
+    """
+    记录阶段区间（span）：墙钟、休眠（按 retry / pacing / breaker 分类）、网络等待、CPU。
+    并发时休眠与网络为各任务累计值，可能超过墙钟；CPU 为进程级，仅在逐个账号运行时可按阶段解读
+    """
+    def __init__(self, enable=False):
+        self.enable = enable
+        self.spans = []
+        self.sleeps = []    # [(类别, 开始, 秒, 账号)]
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name, account=None):
+        if not self.enable:
+            yield None
+            return
+        parent = _current_span.get()
+        span = {
+            'name': name,
+            'account': account if account is not None else (parent['account'] if parent else None),
+            'parent': parent,
+            'start': time.perf_counter(),
+            'cpu': time.process_time(),
+            'sleep': {},
+            'network': 0.0,
+        }
+        token = _current_span.set(span)
+        try:
+            yield span
+        finally:
+            _current_span.reset(token)
+            span['wall'] = time.perf_counter() - span['start']
+            span['cpu'] = time.process_time() - span['cpu']
+            with self._lock:
+                self.spans.append(span)
+
+    def _chain(self):
+        span = _current_span.get()
+        while span is not None:
+            yield span
+            span = span['parent']
+
+    def add_sleep(self, kind, start, seconds):
+        if not self.enable:
+            return
+        with self._lock:
+            for span in self._chain():
+                span['sleep'][kind] = span['sleep'].get(kind, 0.0) + seconds
+            cur = _current_span.get()
+            self.sleeps.append((kind, start, seconds, cur['account'] if cur else None))
+
+    def add_network(self, seconds):
+        if not self.enable:
+            return
+        with self._lock:
+            for span in self._chain():
+                span['network'] += seconds
+
+    def sleep_totals(self):
+        totals = {}
+        with self._lock:
+            for kind, _, seconds, _ in self.sleeps:
+                totals[kind] = totals.get(kind, 0.0) + seconds
+        return totals
+
+    # ---------- 导出 ----------
+    def rows(self):
+        rows = []
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s['start'])
+        for s in spans:
+            sleep = sum(s['sleep'].values())
+            rows.append({
+                'phase': s['name'],
+                'account': s['account'],
+                'start': round(s['start'] - self._t0, 4),
+                'wall': round(s['wall'], 4),
+                'sleep': round(sleep, 4),
+                'sleep_by_kind': {k: round(v, 4) for k, v in s['sleep'].items()},
+                'network': round(s['network'], 4),
+                'cpu': round(s['cpu'], 4),
+                'other': round(max(0.0, s['wall'] - sleep - s['network'] - s['cpu']), 4),
+            })
+        return rows
+
+    def chrome_trace(self):
+        """Chrome trace 事件：每个账号一条轨道（tid），阶段与休眠均为完整事件（ph=X）"""
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': 'TBSign'}}]
+        for r in self.rows():
+            events.append({
+                'name': r['phase'], 'cat': 'phase', 'ph': 'X', 'pid': 1, 'tid': r['account'] or 0,
+                'ts': int(r['start'] * 1e6), 'dur': int(r['wall'] * 1e6),
+                'args': {k: r[k] for k in ('sleep', 'network', 'cpu', 'other', 'sleep_by_kind')},
+            })
+        with self._lock:
+            sleeps = list(self.sleeps)
+        for kind, start, seconds, account in sleeps:
+            events.append({
+                'name': f'sleep:{kind}', 'cat': 'sleep', 'ph': 'X', 'pid': 1, 'tid': account or 0,
+                'ts': int((start - self._t0) * 1e6), 'dur': int(seconds * 1e6),
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, report_file=PROFILE_REPORT_FILE, trace_file=PROFILE_TRACE_FILE):
+        if not self.enable:
+            return
+        rows = self.rows()
+        logger.info("[profile] 阶段耗时（秒）：账号 阶段 墙钟 休眠 网络 CPU 其他")
+        for r in rows:
+            logger.info(f"[profile]   #{r['account'] or '-'} {r['phase']}: {r['wall']:.2f} {r['sleep']:.2f} "
+                        f"{r['network']:.2f} {r['cpu']:.2f} {r['other']:.2f}")
+        try:
+            with open(report_file, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'phases': rows,
+                    'sleep_totals': self.sleep_totals(),
+                    'imports': {'module_load': _MODULE_LOAD_SECONDS, 'lazy': dict(LAZY_IMPORT_TIMES)},
+                }, f, ensure_ascii=False, indent=2)
+            with open(trace_file, 'w', encoding='utf-8') as f:
+                json.dump(self.chrome_trace(), f)
+            logger.info(f"[profile] 已写入 {report_file} / {trace_file}")
+        except Exception as e:
+            logger.warning(f"[profile] 写入剖析结果失败: {e}")
+
+profiler = PhaseProfiler(PROFILE_ENABLE)
+
+def profiled_sleep(seconds, kind):
+    """同步休眠并计入当前阶段的休眠时间"""
+    t0 = time.perf_counter()
+    time.sleep(seconds)
+    profiler.add_sleep(kind, t0, time.perf_counter() - t0)
+
+async def profiled_sleep_async(seconds, kind):
+    """异步休眠并计入当前阶段的休眠时间"""
+    t0 = time.perf_counter()
+    await asyncio.sleep(seconds)
+    profiler.add_sleep(kind, t0, time.perf_counter() - t0)
+
+# -----------------------------
+# 请求指标（按接口 / 线路 / 账号的延迟直方图、重试、错误码、流量），运行结束时导出
+# -----------------------------
+METRICS_ENABLE    = ENV.get('METRICS_ENABLE', 'true').lower() == 'true'
+METRICS_JSON_FILE = ENV.get('METRICS_JSON_FILE', 'metrics.json')
+METRICS_PROM_FILE = ENV.get('METRICS_PROM_FILE', 'metrics.prom')
+METRICS_BUCKETS   = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # 延迟直方图上界（秒）
+
+class Histogram:
+    """固定分桶的延迟直方图（Prometheus 风格，桶计数不累加，导出时再累加）"""
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        for i, upper in enumerate(self.buckets):
+            if seconds <= upper:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q):
+        """按桶上界估算分位数；落在 +Inf 桶时返回最大上界"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return self.buckets[min(i, len(self.buckets) - 1)]
+        return self.buckets[-1]
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 4),
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts)),
+        }
+
+class RequestMetrics:
+    """
+    所有 HTTP / aiotieba 调用的指标：
+    latency[(接口, 线路类别, 账号)] 延迟直方图；requests[(接口, 线路类别, 结果)] 请求数；
+    retries[调用名] 重试次数；codes[(接口, 错误码)] 贴吧返回码；traffic[(接口, 方向)] 字节数。
+    账号只记 _account_key，线路只记类别（user/backup/direct），不落盘 BDUSS 与代理地址
+    """
+    def __init__(self, enable=True):
+        self.enable = enable
+        self.latency = {}
+        self.requests = {}
+        self.retries = {}
+        self.codes = {}
+        self.traffic = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _inc(table, key, n=1):
+        table[key] = table.get(key, 0) + n
 
-# 全局 Session
-s = requests.Session()
+    def observe(self, endpoint, proxy, account, seconds, outcome='ok', sent=0, received=0):
+        profiler.add_network(seconds)
+        if not self.enable:
+            return
+        endpoint = endpoint or 'other'
+        route = _route_kind(proxy)
+        acc = _account_key(account) if account else '-'
+        with self._lock:
+            hist = self.latency.get((endpoint, route, acc))
+            if hist is None:
+                hist = self.latency[(endpoint, route, acc)] = Histogram()
+            hist.observe(seconds)
+            self._inc(self.requests, (endpoint, route, outcome))
+            if sent:
+                self._inc(self.traffic, (endpoint, 'sent'), sent)
+            if received:
+                self._inc(self.traffic, (endpoint, 'received'), received)
+
+    def add_bytes(self, endpoint, direction, n):
+        if self.enable and n:
+            with self._lock:
+                self._inc(self.traffic, (endpoint or 'other', direction), n)
+
+    def retry(self, name):
+        if self.enable:
+            with self._lock:
+                self._inc(self.retries, name or 'other')
+
+    def code(self, endpoint, resp_json):
+        """记录贴吧接口返回的 error_code（含 0）"""
+        if not self.enable or not isinstance(resp_json, dict):
+            return
+        code = str(resp_json.get('error_code', resp_json.get('errno', '')))
+        with self._lock:
+            self._inc(self.codes, (endpoint, code or '-'))
+
+    # ---------- 汇总 ----------
+    def _grouped(self, idx):
+        """按 (接口, 线路类别, 账号) 中的某一维合并直方图"""
+        out = {}
+        for key, hist in self.latency.items():
+            name = key[idx] if isinstance(idx, int) else tuple(key[i] for i in idx)
+            out.setdefault(name, Histogram()).merge(hist)
+        return out
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'generated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'by_endpoint': {k: h.to_dict() for k, h in sorted(self._grouped(0).items())},
+                'by_route': {k: h.to_dict() for k, h in sorted(self._grouped(1).items())},
+                'by_endpoint_route': {f"{e}|{r}": h.to_dict() for (e, r), h in sorted(self._grouped((0, 1)).items())},
+                'by_endpoint_account': {f"{e}|{a}": h.to_dict() for (e, a), h in sorted(self._grouped((0, 2)).items())},
+                'requests': [{'endpoint': e, 'route': r, 'outcome': o, 'count': n}
+                             for (e, r, o), n in sorted(self.requests.items())],
+                'retries': dict(sorted(self.retries.items())),
+                'error_codes': [{'endpoint': e, 'code': c, 'count': n} for (e, c), n in sorted(self.codes.items())],
+                'bytes': [{'endpoint': e, 'direction': d, 'bytes': n} for (e, d), n in sorted(self.traffic.items())],
+            }
+
+    def to_prometheus(self):
+        def _labels(**kv):
+            return '{' + ','.join(f'{k}="{v}"' for k, v in kv.items()) + '}'
+
+        lines = [
+            '# HELP tbsign_request_duration_seconds Request latency by endpoint, route and account.',
+            '# TYPE tbsign_request_duration_seconds histogram',
+        ]
+        with self._lock:
+            for (e, r, a), h in sorted(self.latency.items()):
+                cumulative = 0
+                for upper, n in zip([str(b) for b in h.buckets] + ['+Inf'], h.counts):
+                    cumulative += n
+                    lines.append(f"tbsign_request_duration_seconds_bucket{_labels(endpoint=e, route=r, account=a, le=upper)} {cumulative}")
+                lines.append(f"tbsign_request_duration_seconds_sum{_labels(endpoint=e, route=r, account=a)} {h.sum:.6f}")
+                lines.append(f"tbsign_request_duration_seconds_count{_labels(endpoint=e, route=r, account=a)} {h.count}")
+            lines += ['# HELP tbsign_requests_total Requests by endpoint, route and outcome.',
+                      '# TYPE tbsign_requests_total counter']
+            lines += [f"tbsign_requests_total{_labels(endpoint=e, route=r, outcome=o)} {n}"
+                      for (e, r, o), n in sorted(self.requests.items())]
+            lines += ['# HELP tbsign_retries_total Retries scheduled by the retry policy.',
+                      '# TYPE tbsign_retries_total counter']
+            lines += [f"tbsign_retries_total{_labels(name=k)} {n}" for k, n in sorted(self.retries.items())]
+            lines += ['# HELP tbsign_error_codes_total Tieba error_code values returned by endpoint.',
+                      '# TYPE tbsign_error_codes_total counter']
+            lines += [f"tbsign_error_codes_total{_labels(endpoint=e, code=c)} {n}"
+                      for (e, c), n in sorted(self.codes.items())]
+            lines += ['# HELP tbsign_bytes_total Bytes transferred by endpoint and direction.',
+                      '# TYPE tbsign_bytes_total counter']
+            lines += [f"tbsign_bytes_total{_labels(endpoint=e, direction=d)} {n}"
+                      for (e, d), n in sorted(self.traffic.items())]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, json_file=METRICS_JSON_FILE, prom_file=METRICS_PROM_FILE):
+        if not self.enable:
+            return
+        try:
+            with open(json_file, 'w', encoding='utf-8') as f:
+                json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+            with open(prom_file, 'w', encoding='utf-8') as f:
+                f.write(self.to_prometheus())
+            logger.info(f"[metrics] 请求指标已写入 {json_file} / {prom_file}")
+        except Exception as e:
+            logger.warning(f"[metrics] 写入请求指标失败: {e}")
+
+    def summary(self):
+        """邮件用的简要统计：各接口请求数、失败数、p50/p90、重试与流量"""
+        snap = self.snapshot()
+        failures, traffic = {}, {}
+        for r in snap['requests']:
+            if r['outcome'] != 'ok':
+                failures[r['endpoint']] = failures.get(r['endpoint'], 0) + r['count']
+        for b in snap['bytes']:
+            traffic[b['endpoint']] = traffic.get(b['endpoint'], 0) + b['bytes']
+        rows = []
+        for endpoint, h in snap['by_endpoint'].items():
+            rows.append({
+                'endpoint': endpoint,
+                'count': h['count'],
+                'failures': failures.get(endpoint, 0),
+                'p50': h['p50'],
+                'p90': h['p90'],
+                'retries': snap['retries'].get(endpoint, 0),
+                'kb': round(traffic.get(endpoint, 0) / 1024, 1),
+            })
+        return rows
+
+metrics = RequestMetrics(METRICS_ENABLE)
+
+def _body_len(body):
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode(UTF8))
+    try:
+        return len(body)
+    except TypeError:
+        return 0
+
+# -----------------------------
+# 传输层：按 (线路, 主机) 复用 requests 连接池
+# -----------------------------
+POOL_MAXSIZE = int(ENV.get('POOL_MAXSIZE', '0')) or max(10, ACCOUNT_CONCURRENCY * SIGN_CONCURRENCY)
+
+class TransportPool:
+    """
+    每个 (代理, 主机) 对应一个独立的 requests.Session（固定 proxies + 定长连接池 + keep-alive），
+    切换线路不会打断其他线路的长连接；Session 不保存服务端下发的 Cookie，避免多账号串号
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._sessions = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _new_session(self, proxy):
+        from http.cookiejar import DefaultCookiePolicy
+        from requests.adapters import HTTPAdapter
+        sess = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.maxsize, pool_block=False)
+        sess.mount('http://', adapter)
+        sess.mount('https://', adapter)
+        sess.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        if proxy:
+            sess.proxies = {'http': proxy, 'https': proxy}
+        return sess
+
+    def session_for(self, proxy, url):
+        from urllib.parse import urlsplit
+        key = (proxy, urlsplit(url).netloc)
+        with self._lock:
+            sess = self._sessions.get(key)
+            if sess is not None:
+                self.hits += 1
+                return sess
+            self.misses += 1
+            sess = self._sessions[key] = self._new_session(proxy)
+            return sess
+
+    def request(self, method, url, proxy=None, endpoint=None, account=None, **kwargs):
+        """发送请求并记录指标；endpoint / account 仅用于指标标签"""
+        kwargs.pop('proxies', None)  # 线路由 Session 决定
+        t0 = time.monotonic()
+        try:
+            resp = self.session_for(proxy, url).request(method.upper(), url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            metrics.observe(endpoint, proxy, account, time.monotonic() - t0, outcome=type(e).__name__,
+                            sent=_body_len(e.request.body if e.request is not None else None))
+            raise
+        metrics.observe(endpoint, proxy, account, time.monotonic() - t0,
+                        outcome='ok' if resp.status_code < 400 else f'http_{resp.status_code}',
+                        sent=_body_len(resp.request.body), received=len(resp.content))
+        return resp
+
+    def stats(self):
+        """汇总各连接池：Session 命中/新建次数，以及底层 urllib3 的请求数与新建连接数"""
+        pools = []
+        with self._lock:
+            items = list(self._sessions.items())
+        for (proxy, host), sess in items:
+            requests_n = conns_n = 0
+            for adapter in set(sess.adapters.values()):
+                managers = [adapter.poolmanager] + list(adapter.proxy_manager.values())
+                for pm in managers:
+                    for key in list(pm.pools.keys()):
+                        pool = pm.pools.get(key)
+                        if pool is not None:
+                            requests_n += pool.num_requests
+                            conns_n += pool.num_connections
+            pools.append({
+                'route': _route_kind(proxy),
+                'host': host,
+                'requests': requests_n,
+                'connections': conns_n,
+            })
+        return {'hits': self.hits, 'misses': self.misses, 'pools': pools}
+
+    def log_stats(self):
+        st = self.stats()
+        logger.info(f"[transport] requests 连接池：命中 {st['hits']} 次，新建 {st['misses']} 个")
+        for p in st['pools']:
+            reused = p['requests'] - p['connections']
+            logger.info(f"[transport]   {p['route']} {p['host']}: 请求 {p['requests']} 次，新建连接 {p['connections']} 个，复用 {max(reused, 0)} 次")
+
+    def close(self):
+        with self._lock:
+            for sess in self._sessions.values():
+                sess.close()
+            self._sessions.clear()
+
+transport = TransportPool(POOL_MAXSIZE)
 
 # -----------------------------
 # 代理管理器 (核心重构)
 # -----------------------------
+PROXY_PROBE_LIMIT       = int(ENV.get('PROXY_PROBE_LIMIT', '60'))        # 启动时最多探测的备用代理数
+PROXY_PROBE_CONCURRENCY = int(ENV.get('PROXY_PROBE_CONCURRENCY', '20'))  # 同时进行的探测数
+PROXY_PROBE_TIMEOUT     = float(ENV.get('PROXY_PROBE_TIMEOUT', '6'))     # 单个探测超时（秒）
+PROXY_PROBE_URL         = "http://tieba.baidu.com/dc/common/tbs"          # 探测地址（轻量且与业务同域）
+
 class ProxyManager:
     def __init__(self, enable, user_proxy):
         self.enable = enable
@@ -227,6 +753,12 @@ class ProxyManager:
         self.backup_proxies = []
         self.current_proxy_info = "无代理 (原始IP)"
         self.first_success_logged = False # 新增状态，用于控制日志只输出一次
+        # 代理健康度：{proxy: {'ok': 成功次数, 'fail': 失败次数, 'latency': 延迟EWMA(秒)}}
+        self.stats = {}
+        self._fetch_attempted = False
+        self._fetch_lock = threading.Lock()
+        self._probe_thread = None
+        self._lock = threading.Lock()
         if not self.enable:
             logger.info("代理功能已禁用")
 
@@ -262,7 +794,7 @@ class ProxyManager:
         return ip # 如果不是标准IPv4格式，直接返回
 
     def get_proxy_list(self):
-        """获取一个包含所有可用代理的列表，首选代理在前，最后是None（直连）"""
+        """获取一个包含所有可用代理的列表，首选代理在前，备用代理按健康度排序，最后是None（直连）"""
         if not self.enable:
             return [None]
 
@@ -270,29 +802,127 @@ class ProxyManager:
         if self.user_proxy:
             proxies.append(self.user_proxy)
 
-        if not self.backup_proxies:
-            self.fetch_backup_proxies()
-        proxies.extend(self.backup_proxies)
+        self._ensure_fetched()
+        proxies.extend(self.ranked_backups())
 
         proxies.append(None) # 添加None作为直连的最终选项
         return proxies
 
+    def _ensure_fetched(self):
+        """备用代理列表每次运行只获取一次（失败也不反复请求）"""
+        with self._fetch_lock:
+            if not self._fetch_attempted:
+                self.fetch_backup_proxies()
+
     def fetch_backup_proxies(self):
         """从 ProxyScrape 获取备用 SOCKS5 代理列表"""
+        self._fetch_attempted = True
         logger.info("正在从 ProxyScrape 获取备用代理...")
         url = "https://api.proxyscrape.com/v2/?request=getproxies&protocol=socks5&timeout=10000&country=all"
         try:
-            resp = requests.get(url, timeout=10)
+            resp = transport.request('GET', url, endpoint='proxyscrape', timeout=10)
             if resp.status_code == 200:
                 proxies = [f"socks5h://{p}" for p in resp.text.strip().split('\r\n') if p]
                 random.shuffle(proxies)
-                self.backup_proxies = proxies
+                with self._lock:
+                    self.backup_proxies = proxies
                 logger.info(f"成功获取 {len(self.backup_proxies)} 个备用代理")
             else:
                 logger.warning("获取备用代理失败，API 返回状态码非 200")
         except Exception as e:
             logger.error(f"获取备用代理时发生网络错误: {e}")
 
+    # ---------- 健康度评分 ----------
+    def _score(self, proxy):
+        """评分 = -期望耗时：成功按实测延迟计，失败按探测超时计；未探测的代理排在已验证可用的之后"""
+        st = self.stats.get(proxy)
+        if not st:
+            return -PROXY_PROBE_TIMEOUT
+        success_rate = (st['ok'] + 1) / (st['ok'] + st['fail'] + 2)
+        latency = st['latency'] if st['latency'] is not None else PROXY_PROBE_TIMEOUT
+        return -(success_rate * latency + (1 - success_rate) * PROXY_PROBE_TIMEOUT)
+
+    def ranked_backups(self):
+        """按评分从高到低返回备用代理"""
+        with self._lock:
+            return sorted(self.backup_proxies, key=self._score, reverse=True)
+
+    def best_backup(self, exclude=None, fetch=True):
+        """
+        返回评分最高的备用代理（无可用时返回 None）
+        fetch=False 时不等待备用代理列表的获取（事件循环中使用）：尚未获取时交给后台线程，本次只用已有的代理
+        """
+        if not self.enable:
+            return None
+        if fetch:
+            self._ensure_fetched()
+        elif not self._fetch_attempted:
+            self.start_background_probe()
+        for p in self.ranked_backups():
+            if p and p != exclude:
+                return p
+        return None
+
+    def report(self, proxy, ok, latency=None):
+        """根据真实请求结果更新代理评分；成功率过低的备用代理移出代理池"""
+        if not proxy:
+            return
+        with self._lock:
+            st = self.stats.setdefault(proxy, {'ok': 0, 'fail': 0, 'latency': None})
+            if ok:
+                st['ok'] += 1
+                if latency is not None:
+                    st['latency'] = latency if st['latency'] is None else 0.7 * st['latency'] + 0.3 * latency
+            else:
+                st['fail'] += 1
+                success_rate = (st['ok'] + 1) / (st['ok'] + st['fail'] + 2)
+                if st['fail'] >= 2 and success_rate < 0.3 and proxy in self.backup_proxies:
+                    self.backup_proxies.remove(proxy)
+                    logger.info(f"备用代理多次失败，已移出代理池: {self._sanitize_proxy_url(proxy)}")
+
+    # ---------- 并发探测 ----------
+    def _probe_one(self, proxy):
+        proxies = {'http': proxy, 'https': proxy}
+        t0 = time.monotonic()
+        try:
+            resp = requests.get(PROXY_PROBE_URL, proxies=proxies, timeout=PROXY_PROBE_TIMEOUT)
+            resp.raise_for_status()
+            metrics.observe('probe', proxy, None, time.monotonic() - t0, received=len(resp.content))
+            return proxy, True, time.monotonic() - t0
+        except Exception as e:
+            metrics.observe('probe', proxy, None, time.monotonic() - t0, outcome=type(e).__name__)
+            return proxy, False, None
+
+    def probe_backup_proxies(self):
+        """并发探测备用代理：保留可用代理并按延迟评分，探测失败的直接移出代理池"""
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        self._ensure_fetched()
+        with self._lock:
+            candidates = self.backup_proxies[:PROXY_PROBE_LIMIT]
+        if not candidates:
+            return
+        logger.info(f"开始并发探测 {len(candidates)} 个备用代理（并发 {PROXY_PROBE_CONCURRENCY}）")
+        alive = set()
+        with ThreadPoolExecutor(max_workers=max(1, PROXY_PROBE_CONCURRENCY)) as pool:
+            futures = [pool.submit(self._probe_one, p) for p in candidates]
+            for fut in as_completed(futures):
+                proxy, ok, latency = fut.result()
+                self.report(proxy, ok, latency)
+                if ok:
+                    alive.add(proxy)
+        with self._lock:
+            # 探测过的只保留可用的；未探测的（超出 PROXY_PROBE_LIMIT）保留在末尾备用
+            probed = set(candidates)
+            self.backup_proxies = [p for p in self.backup_proxies if p in alive or p not in probed]
+        logger.info(f"备用代理探测完成：可用 {len(alive)}/{len(candidates)} 个")
+
+    def start_background_probe(self):
+        """在后台线程中获取并探测备用代理，不阻塞启动"""
+        if not self.enable or self._probe_thread:
+            return
+        self._probe_thread = threading.Thread(target=self.probe_backup_proxies, name="proxy-probe", daemon=True)
+        self._probe_thread.start()
+
     def test_and_log_success(self, proxy_url):
         """测试代理并记录首次成功日志"""
         if self.first_success_logged:
@@ -302,9 +932,8 @@ class ProxyManager:
         logger.info(f"测试连接有效性: {safe_proxy_url}")
         try:
             import socks
-            proxies = {'http': proxy_url, 'https': proxy_url} if proxy_url else None
             test_url = "https://ipinfo.io/ip"
-            resp = requests.get(test_url, proxies=proxies, timeout=10)
+            resp = transport.request('GET', test_url, proxy=proxy_url, endpoint='ipinfo', timeout=10)
             if resp.status_code == 200:
                 sanitized_ip = self._sanitize_ip(resp.text.strip())
                 self.current_proxy_info = f"{safe_proxy_url} (出口IP: {sanitized_ip})"
@@ -322,68 +951,601 @@ class ProxyManager:
 # 初始化代理管理器
 proxy_manager = ProxyManager(PROXY_ENABLE, SOCKS_PROXY)
 
-def robust_request(method, url, **kwargs):
+# -----------------------------
+# 线路记忆（按账号 + 接口记住上次成功的线路，跨运行持久化）
+# -----------------------------
+ROUTE_MEMORY_ENABLE = ENV.get('ROUTE_MEMORY_ENABLE', 'true').lower() == 'true'
+ROUTE_MEMORY_FILE   = ENV.get('ROUTE_MEMORY_FILE', 'route_memory.json')
+
+def _route_kind(proxy):
+    """线路类别：user（首选代理）/ backup（免费代理）/ direct（直连）；只持久化类别，不落盘代理地址"""
+    if not proxy:
+        return 'direct'
+    if proxy == SOCKS_PROXY:
+        return 'user'
+    return 'backup'
+
+class RouteMemory:
     """
-    使用代理管理器进行健壮的网络请求，支持失败重试和代理切换。
+    结构：{账号标识: {接口: {"route": 线路类别, "ts": 更新时间}}}
+    线路成功时记住；记住的线路失败时清除，让下一次成功的线路接替
     """
-    max_retries = 3
-    proxy_list = proxy_manager.get_proxy_list()
-    last_exception = None
+    def __init__(self, filename, enable=True):
+        self.filename = filename
+        self.enable = enable
+        self.routes = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        if enable:
+            try:
+                with open(filename, 'r') as f:
+                    data = json.load(f)
+                if isinstance(data, dict):
+                    self.routes = data
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+            except Exception as e:
+                logger.warning(f"读取线路记忆失败: {e}")
 
-    for attempt in range(max_retries):
-        # 从代理列表中选择一个代理，如果列表耗尽则使用最后一个（应该是None）
-        proxy_index = min(attempt, len(proxy_list) - 1)
-        current_proxy = proxy_list[proxy_index]
-        
-        proxies = {'http': current_proxy, 'https': current_proxy} if current_proxy else None
-        
-        # 准备日志信息
-        proxy_info_for_log = proxy_manager._sanitize_proxy_url(current_proxy)
-        logger.info(f"请求尝试 ({attempt+1}/{max_retries}) 使用: {proxy_info_for_log}")
+    def preferred(self, bduss, endpoint):
+        if not self.enable or not bduss or not endpoint:
+            return None
+        with self._lock:
+            return self.routes.get(_account_key(bduss), {}).get(endpoint, {}).get('route')
+
+    def order(self, chain, bduss, endpoint):
+        """把记住的线路调到最前，其余保持原有顺序"""
+        kind = self.preferred(bduss, endpoint)
+        if not kind:
+            return chain
+        first = [p for p in chain if _route_kind(p) == kind][:1]
+        if not first:
+            return chain
+        return first + [p for p in chain if p is not first[0]]
+
+    def success(self, bduss, endpoint, proxy):
+        if not self.enable or not bduss or not endpoint:
+            return
+        kind = _route_kind(proxy)
+        with self._lock:
+            acct = self.routes.setdefault(_account_key(bduss), {})
+            if acct.get(endpoint, {}).get('route') != kind:
+                logger.info(f"[route] 记住线路: {endpoint} -> {kind}")
+                acct[endpoint] = {'route': kind, 'ts': int(time.time())}
+                self._dirty = True
 
-        kwargs['proxies'] = proxies
+    def failure(self, bduss, endpoint, proxy):
+        if not self.enable or not bduss or not endpoint:
+            return
+        with self._lock:
+            acct = self.routes.get(_account_key(bduss), {})
+            if acct.get(endpoint, {}).get('route') == _route_kind(proxy):
+                acct.pop(endpoint, None)
+                self._dirty = True
+
+    def save(self):
+        if not self.enable:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = json.dumps(self.routes, separators=(',', ':'))
+            self._dirty = False
+        tmp = f"{self.filename}.tmp"
         try:
-            if 'headers' not in kwargs:
-                kwargs['headers'] = get_headers()
-            
-            if method.upper() == 'GET':
-                resp = s.get(url, **kwargs)
-            else:
-                resp = s.post(url, **kwargs)
-            
-            resp.raise_for_status()
+            with open(tmp, 'w') as f:
+                f.write(payload)
+            os.replace(tmp, self.filename)
+        except Exception as e:
+            logger.warning(f"保存线路记忆失败: {e}")
 
-            # 请求成功后，进行一次性的连接测试和日志记录
-            proxy_manager.test_and_log_success(current_proxy)
-            
-            return resp
-        except requests.exceptions.RequestException as e:
-            last_exception = e
-            logger.warning(f"请求失败: {e}")
-            if attempt < max_retries - 1:
-                if proxy_index == len(proxy_list) - 1:
-                    logger.warning("所有代理已尝试完毕，最后一次重试将继续使用直连。")
-                time.sleep(2)
-            else:
-                logger.error("请求达到最大重试次数，彻底失败")
-                raise last_exception
+route_memory = RouteMemory(ROUTE_MEMORY_FILE, ROUTE_MEMORY_ENABLE)
+
+# -----------------------------
+# 统一重试策略（指数退避 + 全抖动 + 单次调用截止时间 + 全局重试预算）
+# -----------------------------
+RETRY_MAX_ATTEMPTS = int(ENV.get('RETRY_MAX_ATTEMPTS', '4'))     # 单次调用最多尝试次数（含首次）
+RETRY_BASE_DELAY   = float(ENV.get('RETRY_BASE_DELAY', '1.0'))   # 退避基数（秒）
+RETRY_MAX_DELAY    = float(ENV.get('RETRY_MAX_DELAY', '8.0'))    # 单次退避上限（秒）
+RETRY_DEADLINE     = float(ENV.get('RETRY_DEADLINE', '45'))      # 单次调用（含全部重试）的截止时间（秒）
+RETRY_BUDGET       = int(ENV.get('RETRY_BUDGET', '300'))         # 本次运行允许的重试总次数
+
+# 当前上下文中正在进行的重试（嵌套调用共享外层的次数与截止时间，避免重试层层相乘）
+_active_retry = contextvars.ContextVar('active_retry', default=None)
+
+class RetryDeadlineExceeded(TimeoutError):
+    """单次调用（含全部重试/对冲）超过 RETRY_DEADLINE 截止时间"""
+
+class RetryBudget:
+    """整次运行共享的重试预算，耗尽后所有调用只做首次尝试"""
+    def __init__(self, total):
+        self.total = total
+        self.used = 0
+        self._exhausted_logged = False
+        self._lock = threading.Lock()
+
+    def consume(self) -> bool:
+        with self._lock:
+            if self.used >= self.total:
+                if not self._exhausted_logged:
+                    logger.warning(f"[retry] 本次运行重试预算 {self.total} 次已用完，后续失败不再重试")
+                    self._exhausted_logged = True
+                return False
+            self.used += 1
+            return True
+
+class RetryState:
+    """一次调用的重试状态：已尝试次数、截止时间"""
+    def __init__(self, policy, name):
+        self.policy = policy
+        self.name = name
+        self.attempt = 0   # 已失败的次数，即下一次尝试的序号（从 0 开始）
+        self.deadline = time.monotonic() + policy.deadline
+
+    def remaining(self):
+        return self.deadline - time.monotonic()
+
+    def timeout(self, default):
+        """单个请求的超时：不超过剩余截止时间（至少 1 秒）"""
+        return max(1.0, min(default, self.remaining()))
+
+    def next_delay(self):
+        """记录一次失败并返回退避秒数；不应再重试时返回 None"""
+        self.attempt += 1
+        if self.attempt >= self.policy.max_attempts:
+            return None
+        delay = random.uniform(0, min(self.policy.cap, self.policy.base * (2 ** (self.attempt - 1))))
+        if delay >= self.remaining():
+            logger.warning(f"[retry] {self.name} 已接近截止时间，放弃重试")
+            return None
+        if not self.policy.budget.consume():
+            return None
+        metrics.retry(self.name)
+        return delay
+
+    def backoff(self) -> bool:
+        """同步退避；返回 False 表示不再重试"""
+        delay = self.next_delay()
+        if delay is None:
+            return False
+        profiled_sleep(delay, 'retry')
+        return True
+
+    async def backoff_async(self) -> bool:
+        """异步退避；返回 False 表示不再重试"""
+        delay = self.next_delay()
+        if delay is None:
+            return False
+        await profiled_sleep_async(delay, 'retry')
+        return True
+
+class RetryPolicy:
+    def __init__(self, max_attempts, base, cap, deadline, budget):
+        self.max_attempts = max(1, max_attempts)
+        self.base = base
+        self.cap = cap
+        self.deadline = deadline
+        self.budget = budget
+
+    def start(self, name):
+        """
+        开始一次调用的重试；若外层已有进行中的重试则直接复用外层状态，
+        使嵌套调用共享同一组尝试次数与截止时间
+        """
+        outer = _active_retry.get()
+        if outer is not None:
+            return outer, None
+        state = RetryState(self, name)
+        return state, _active_retry.set(state)
+
+    @staticmethod
+    def finish(token):
+        if token is not None:
+            _active_retry.reset(token)
+
+RETRY_POLICY = RetryPolicy(RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, RETRY_DEADLINE,
+                           RetryBudget(RETRY_BUDGET))
+
+# -----------------------------
+# 对冲请求（幂等接口：主线路超过历史延迟分位数仍未返回时，同时尝试下一线路）
+# -----------------------------
+HEDGE_ENABLE        = ENV.get('HEDGE_ENABLE', 'false').lower() == 'true'
+HEDGE_PERCENTILE    = float(ENV.get('HEDGE_PERCENTILE', '0.9'))     # 以该分位数延迟作为对冲等待时间
+HEDGE_DEFAULT_DELAY = float(ENV.get('HEDGE_DEFAULT_DELAY', '2.0'))  # 样本不足时的对冲等待时间（秒）
+HEDGE_MIN_SAMPLES   = 10
+HEDGE_MAX_ROUTES    = max(2, int(ENV.get('HEDGE_MAX_ROUTES', '3')))  # 同步对冲最多同时使用的线路数
+
+class LatencyTracker:
+    """记录各接口最近的成功请求延迟，用于计算对冲等待时间"""
+    def __init__(self, maxlen=200):
+        from collections import deque
+        self._samples = {}
+        self._maxlen = maxlen
+        self._deque = deque
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, seconds):
+        if not endpoint:
+            return
+        with self._lock:
+            self._samples.setdefault(endpoint, self._deque(maxlen=self._maxlen)).append(seconds)
+
+    def hedge_delay(self, endpoint):
+        with self._lock:
+            samples = sorted(self._samples.get(endpoint, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        idx = min(len(samples) - 1, int(len(samples) * HEDGE_PERCENTILE))
+        return max(0.05, samples[idx])
+
+latency_tracker = LatencyTracker()
+
+def hedged_call_sync(fns, endpoint, remaining=None):
+    """
+    同步对冲：依次启动 fns 中的调用（最多 HEDGE_MAX_ROUTES 个），前一个在对冲等待时间内未完成就启动下一个；
+    第一个成功返回的结果胜出（其余线程无法中断，结果直接丢弃），全部失败时抛出最后一个异常。
+    remaining 为重试策略剩余的截止时间（秒），用完时抛出 RetryDeadlineExceeded
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    fns = fns[:HEDGE_MAX_ROUTES]
+    delay = latency_tracker.hedge_delay(endpoint)
+    deadline = None if remaining is None else time.monotonic() + remaining
+    pool = ThreadPoolExecutor(max_workers=len(fns))
+    pending = set()
+    last_exception = None
+    try:
+        for i, fn in enumerate(fns):
+            pending.add(pool.submit(fn))
+            is_last = i == len(fns) - 1
+            while pending:
+                timeout = None if is_last else delay
+                if deadline is not None:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        raise RetryDeadlineExceeded(f"{endpoint} 对冲请求超过截止时间")
+                    timeout = left if timeout is None else min(timeout, left)
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    if is_last or (deadline is not None and time.monotonic() >= deadline):
+                        raise RetryDeadlineExceeded(f"{endpoint} 对冲请求超过截止时间")
+                    logger.info(f"[hedge] {endpoint} 超过 {delay:.2f}s 未返回，启动对冲线路 ({i+2}/{len(fns)})")
+                    break
+                for fut in done:
+                    try:
+                        return fut.result()
+                    except Exception as e:
+                        last_exception = e
+                if not is_last:
+                    break  # 当前线路已失败，立即启动下一条
+        raise last_exception or RuntimeError(f"{endpoint} 所有对冲线路均失败")
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+async def hedged_race(factories, endpoint):
+    """
+    异步对冲：factories 为返回协程的无参函数，协程返回结果或 None（该线路失败）；
+    第一个非 None 结果胜出并取消其余请求，全部失败时返回 None
+    """
+    delay = latency_tracker.hedge_delay(endpoint)
+    pending = set()
+    try:
+        for i, factory in enumerate(factories):
+            pending.add(asyncio.ensure_future(factory()))
+            is_last = i == len(factories) - 1
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=None if is_last else delay,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    logger.info(f"[hedge] {endpoint} 超过 {delay:.2f}s 未返回，启动对冲线路 ({i+2}/{len(factories)})")
+                    break
+                for task in done:
+                    if not task.cancelled() and task.exception() is None and task.result() is not None:
+                        return task.result()
+                if not is_last:
+                    break  # 当前线路已失败，立即启动下一条
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
+
+def _request_once(method, url, proxy, account, endpoint, kwargs):
+    """在指定线路上发送一次请求，成功返回 resp，失败抛出 RequestException"""
+    kwargs = dict(kwargs)
+    if 'headers' not in kwargs:
+        kwargs['headers'] = get_headers()
+    t0 = time.monotonic()
+    try:
+        resp = transport.request(method, url, proxy=proxy, endpoint=endpoint, account=account, **kwargs)
+        resp.raise_for_status()
+    except requests.exceptions.RequestException:
+        proxy_manager.report(proxy, False)
+        route_memory.failure(account, endpoint, proxy)
+        raise
+    elapsed = time.monotonic() - t0
+    proxy_manager.report(proxy, True, elapsed)
+    route_memory.success(account, endpoint, proxy)
+    latency_tracker.observe(endpoint, elapsed)
+
+    # 请求成功后，进行一次性的连接测试和日志记录
+    proxy_manager.test_and_log_success(proxy)
+    return resp
+
+def robust_request(method, url, account=None, endpoint=None, hedge=False, **kwargs):
+    """
+    使用代理管理器进行健壮的网络请求，按统一重试策略退避重试，每次失败切换到下一条线路。
+    传入 account(BDUSS) 与 endpoint 时，优先使用该账号该接口上次成功的线路。
+    hedge=True（且 HEDGE_ENABLE）时每次尝试都对冲前几条线路，仅用于幂等接口。
+    """
+    proxy_list = route_memory.order(proxy_manager.get_proxy_list(), account, endpoint)
+    # 对冲只用三段式线路的前几条（首选代理 -> 最佳备用代理 -> 直连），不铺开到全部备用代理
+    hedge_routes = _build_route_chain(account, endpoint)[:HEDGE_MAX_ROUTES] if hedge and HEDGE_ENABLE else []
+    default_timeout = kwargs.pop('timeout', 10)
+    state, token = RETRY_POLICY.start(endpoint or url)
+    try:
+        while True:
+            kwargs['timeout'] = state.timeout(default_timeout)
+            try:
+                if len(hedge_routes) > 1:
+                    logger.info(f"对冲请求 {endpoint or url}，线路数 {len(hedge_routes)}")
+                    return hedged_call_sync(
+                        [lambda p=p: _request_once(method, url, p, account, endpoint, kwargs) for p in hedge_routes],
+                        endpoint or url,
+                        state.remaining(),
+                    )
+
+                # 从代理列表中选择一个代理，如果列表耗尽则使用最后一个（应该是None）
+                proxy_index = min(state.attempt, len(proxy_list) - 1)
+                current_proxy = proxy_list[proxy_index]
+                proxy_info_for_log = proxy_manager._sanitize_proxy_url(current_proxy)
+                logger.info(f"请求尝试 ({state.attempt+1}/{RETRY_POLICY.max_attempts}) 使用: {proxy_info_for_log}")
+                return _request_once(method, url, current_proxy, account, endpoint, kwargs)
+            except (requests.exceptions.RequestException, RetryDeadlineExceeded) as e:
+                logger.warning(f"请求失败: {e}")
+                if token is None:
+                    raise  # 嵌套调用：只做一次尝试，由外层统一退避重试
+                if not state.backoff():
+                    logger.error("请求达到最大重试次数或截止时间，彻底失败")
+                    raise
+    finally:
+        RETRY_POLICY.finish(token)
 
 # -----------------------------
 # 风控检测函数
 # -----------------------------
-def check_wind_control(resp_json):
+# 常见需要验证码/被限制的错误码，可根据抓包继续补充
+WIND_CONTROL_CODES = ('110', '221023', '219016', '4', '220034')
+BREAKER_COOLDOWN   = float(ENV.get('BREAKER_COOLDOWN', '300'))   # 熔断后的冷却时间（秒）
+BREAKER_MAX_TRIPS  = int(ENV.get('BREAKER_MAX_TRIPS', '3'))      # 单账号单接口本次运行最多熔断次数，超过后放弃
+BREAKER_PROBE_TIMEOUT = float(ENV.get('BREAKER_PROBE_TIMEOUT', '120'))  # 半开状态等待探测结果的最长时间（秒），超时后重新探测
+
+class CircuitBreaker:
+    """单个 (账号, 接口) 的熔断器：closed -> open（冷却）-> half_open（放行一个探测请求）-> closed/open"""
+    def __init__(self):
+        self.state = 'closed'
+        self.trips = 0
+        self.opened_until = 0.0
+        self.last_code = ''
+        self.probe_owner = None     # 执行探测请求的 asyncio 任务
+        self.probe_started = 0.0
+
+class BreakerBoard:
+    """按账号 + 接口管理熔断器；熔断只暂停对应账号的该类请求，其他账号/贴吧照常进行"""
+    def __init__(self, cooldown=BREAKER_COOLDOWN, max_trips=BREAKER_MAX_TRIPS):
+        self.cooldown = cooldown
+        self.max_trips = max_trips
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, bduss, endpoint):
+        key = (_account_key(bduss), endpoint)
+        with self._lock:
+            if key not in self._breakers:
+                self._breakers[key] = CircuitBreaker()
+            return self._breakers[key]
+
+    def trip(self, bduss, endpoint, code):
+        b = self.get(bduss, endpoint)
+        with self._lock:
+            if b.state == 'open':
+                return  # 已在冷却中（并发请求同时撞上风控），不重复计数
+            b.trips += 1
+            b.state = 'open'
+            b.probe_owner = None
+            b.last_code = code
+            b.opened_until = time.monotonic() + self.cooldown
+        if b.trips > self.max_trips:
+            logger.warning(f"[breaker] {endpoint} 触发风控({code})，本次运行已熔断 {b.trips} 次，放弃该账号的 {endpoint} 请求")
+        else:
+            logger.warning(f"[breaker] {endpoint} 触发风控({code})，熔断 {self.cooldown:.0f} 秒（第 {b.trips} 次），其他账号不受影响")
+
+    def success(self, bduss, endpoint):
+        b = self.get(bduss, endpoint)
+        with self._lock:
+            if b.state != 'closed':
+                logger.info(f"[breaker] {endpoint} 探测请求正常，熔断恢复")
+            b.state = 'closed'
+            b.probe_owner = None
+
+    def release(self, bduss, endpoint):
+        """
+        请求结束后调用：若当前任务是探测请求、且请求没有得到可判定的结果（网络失败/非 JSON，
+        未经 check_wind_control），则重新打开熔断器并立即允许下一个请求探测，不计入熔断次数
+        """
+        b = self.get(bduss, endpoint)
+        with self._lock:
+            if b.state != 'half_open' or b.probe_owner is not asyncio.current_task():
+                return
+            b.state = 'open'
+            b.probe_owner = None
+            b.opened_until = time.monotonic()
+        logger.info(f"[breaker] {endpoint} 探测请求未得到结果，重新探测")
+
+    def gave_up(self, bduss, endpoint) -> bool:
+        return self.get(bduss, endpoint).trips > self.max_trips
+
+    async def wait(self, bduss, endpoint) -> bool:
+        """
+        等待熔断器放行（异步等待，不阻塞其他任务）；返回 False 表示已放弃
+        冷却结束后只放行一个探测请求，其余请求等待探测结果；
+        探测超过 BREAKER_PROBE_TIMEOUT 秒仍无结果时，由下一个等待的请求接替探测。
+        放行后调用方需在请求结束时调用 release
+        """
+        b = self.get(bduss, endpoint)
+        while True:
+            with self._lock:
+                if b.trips > self.max_trips:
+                    return False
+                if b.state == 'closed':
+                    return True
+                now = time.monotonic()
+                if b.state == 'open':
+                    if now >= b.opened_until:
+                        b.state = 'half_open'
+                        b.probe_owner = asyncio.current_task()
+                        b.probe_started = now
+                        return True
+                    delay = b.opened_until - now
+                elif now - b.probe_started >= BREAKER_PROBE_TIMEOUT:
+                    logger.warning(f"[breaker] {endpoint} 探测请求 {BREAKER_PROBE_TIMEOUT:.0f} 秒无结果，重新探测")
+                    b.probe_owner = asyncio.current_task()
+                    b.probe_started = now
+                    return True
+                else:  # half_open：探测进行中
+                    delay = min(1.0, b.probe_started + BREAKER_PROBE_TIMEOUT - now)
+            await profiled_sleep_async(delay, 'breaker')
+
+    def summary(self, bduss=None):
+        """返回熔断统计 [{endpoint, state, trips, last_code}]（只包含触发过的）"""
+        key = _account_key(bduss) if bduss else None
+        with self._lock:
+            return [
+                {'endpoint': ep, 'state': b.state, 'trips': b.trips, 'last_code': b.last_code}
+                for (acct, ep), b in self._breakers.items()
+                if b.trips and (key is None or acct == key)
+            ]
+
+breakers = BreakerBoard()
+
+def check_wind_control(resp_json, bduss=None, endpoint=None):
     """
-    检测是否触发风控，根据常见 error_code 暂停。
-    返回 True 表示触发风控并已退避。
+    检测是否触发风控（不再阻塞等待）。
+    传入账号与接口时打开对应熔断器，由调用方在冷却后重试；返回 True 表示触发风控。
     """
     ec = str(resp_json.get('error_code', ''))
-    # 常见需要验证码/被限制的错误码，可根据抓包继续补充
-    if ec in ('110', '221023', '219016', '4', '220034'):
-        logger.warning(f"触发风控({ec})，暂停5分钟")
-        time.sleep(300)
+    if ec in WIND_CONTROL_CODES:
+        if bduss and endpoint:
+            breakers.trip(bduss, endpoint, ec)
+        else:
+            logger.warning(f"触发风控({ec})")
         return True
+    if bduss and endpoint:
+        breakers.success(bduss, endpoint)
     return False
 
+# -----------------------------
+# 限速引擎（令牌桶，按账号 + 接口）
+# -----------------------------
+# 接口: (每秒令牌数, 桶容量)，可用环境变量 PACING_<接口> 覆盖，例如 PACING_SIGN="1.0,2"
+PACING_DEFAULTS = {
+    'sign':      (1.0, 2),    # 签到
+    'msign':     (0.5, 1),    # 一键批量签到
+    'like':      (5.0, 4),    # 关注列表翻页（突发容量与 FAVORITES_PAGE_CONCURRENCY 默认值一致）
+    'tbs':       (1.0, 2),    # 获取 tbs
+    'reply':     (0.2, 1),    # 回帖
+    'moderator': (0.18, 1),   # 吧务操作之间的间隔（浏览/删除/置顶）
+}
+PACING_JITTER    = float(ENV.get('PACING_JITTER', '0.5'))   # 额外随机等待，按令牌间隔的比例
+THROTTLE_CODES   = ('1102',)                                # “操作过快”类错误码，触发自动降速
+
+def _account_key(bduss: str) -> str:
+    """账号的脱敏标识（BDUSS 摘要），用于限速/持久化等按账号区分的场景"""
+    return hashlib.md5(bduss.encode(UTF8)).hexdigest()[:12] if bduss else '-'
+
+def _parse_pacing(endpoint):
+    rate, burst = PACING_DEFAULTS[endpoint]
+    raw = ENV.get(f'PACING_{endpoint.upper()}', '').strip()
+    if raw:
+        try:
+            parts = raw.split(',')
+            rate = float(parts[0])
+            burst = float(parts[1]) if len(parts) > 1 else burst
+        except ValueError:
+            logger.warning(f"PACING_{endpoint.upper()} 格式错误（应为 \"速率,容量\"），使用默认值")
+    return max(rate, 0.01), max(burst, 1)
+
+class TokenBucket:
+    """令牌桶：按预约方式发放令牌（令牌可为负），并支持乘性降速、加性恢复"""
+    def __init__(self, rate, burst):
+        self.max_rate = rate
+        self.min_rate = rate / 16
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """预约一个令牌，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def slow_down(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            return self.rate
+
+    def speed_up(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+            return self.rate
+
+class Pacer:
+    """统一限速：每个 (账号, 接口) 一个令牌桶，遇到过快错误码自动降速，返回正常后逐步恢复"""
+    def __init__(self, jitter=PACING_JITTER):
+        self.jitter = jitter
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, bduss, endpoint):
+        key = (_account_key(bduss), endpoint)
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(*_parse_pacing(endpoint))
+            return self._buckets[key]
+
+    def _delay(self, bduss, endpoint):
+        b = self.bucket(bduss, endpoint)
+        return b.reserve() + random.uniform(0, self.jitter / b.rate)
+
+    async def acquire(self, bduss, endpoint):
+        """异步等待一个令牌（不阻塞事件循环）"""
+        await profiled_sleep_async(self._delay(bduss, endpoint), 'pacing')
+
+    def acquire_sync(self, bduss, endpoint):
+        """同步等待一个令牌（用于 requests 路径/线程中）"""
+        profiled_sleep(self._delay(bduss, endpoint), 'pacing')
+
+    def feedback(self, bduss, endpoint, resp_json):
+        """根据接口返回调整速率：过快类错误码降速，正常返回逐步恢复"""
+        if not isinstance(resp_json, dict):
+            return
+        b = self.bucket(bduss, endpoint)
+        code = str(resp_json.get('error_code', ''))
+        msg = str(resp_json.get('error_msg') or resp_json.get('msg') or '')
+        if code in THROTTLE_CODES or '太快' in msg or '频繁' in msg:
+            rate = b.slow_down()
+            logger.warning(f"[pacing] {endpoint} 返回过快({code})，降速至 {rate:.2f}/s")
+        elif b.rate < b.max_rate:
+            b.speed_up()
+
+pacer = Pacer()
+
 # -----------------------------
 # 构造随机回复内容（保持原版格式）
 # -----------------------------
@@ -417,35 +1579,115 @@ HITOKOTO_URLS = [
     'https://international.v1.hitokoto.cn/?encode=json',
 ]
 
-def get_hitokoto():
-    """调用一言 API 获取随机句子（备用域名，多轮重试）"""
-    for attempt in range(3):  # 三轮
-        for url in HITOKOTO_URLS:  # 每轮依次尝试两个域名
-            try:
-                resp = robust_request(
-                    'GET',
-                    url,
-                    headers={'User-Agent': random.choice(USER_AGENTS_DESKTOP)},
-                    timeout=5,
-                )
-                if resp.status_code == 200:
-                    data = resp.json()
-                    qt  = (data.get('hitokoto') or '').strip()
-                    frm = (data.get('from') or '').strip()
-                    who = (data.get('from_who') or '').strip()
-                    if qt:
-                        if frm and who:
-                            return f"{qt}\n——{frm} · {who}"
-                        elif frm:
-                            return f"{qt}\n——{frm}"
-                        else:
-                            return qt
-            except Exception:
-                pass
-        # 本轮两域名都失败，若还可重试，就退避 1~2 秒
-        if attempt < 2:
-            time.sleep(random.uniform(1, 2))
-    return ''
+def _format_hitokoto(data):
+    qt  = (data.get('hitokoto') or '').strip()
+    frm = (data.get('from') or '').strip()
+    who = (data.get('from_who') or '').strip()
+    if not qt:
+        return ''
+    if frm and who:
+        return f"{qt}\n——{frm} · {who}"
+    elif frm:
+        return f"{qt}\n——{frm}"
+    return qt
+
+HITOKOTO_CACHE_FILE      = ENV.get('HITOKOTO_CACHE_FILE', 'hitokoto_cache.json')
+HITOKOTO_CACHE_TTL_HOURS = float(ENV.get('HITOKOTO_CACHE_TTL_HOURS', '168'))  # 句子缓存有效期（小时）
+HITOKOTO_POOL_SIZE       = int(ENV.get('HITOKOTO_POOL_SIZE', '30'))          # 句子池容量上限
+HITOKOTO_PREFETCH        = int(ENV.get('HITOKOTO_PREFETCH', '6'))            # 每次运行最多补充的句子数
+
+class HitokotoPool:
+    """
+    一言句子池：启动时在后台并发补充、落盘缓存（有效期 + 容量上限），
+    回帖时直接取用，取不到就不带一言，生成回复内容时从不等待网络
+    结构：{"quotes": [{"text": 句子, "ts": 获取时间}]}
+    """
+    def __init__(self, filename, ttl_hours, size, prefetch):
+        self.filename = filename
+        self.ttl = ttl_hours * 3600
+        self.size = max(0, size)
+        self.prefetch_count = max(0, prefetch)
+        self.quotes = []
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            now = time.time()
+            quotes = [q for q in data.get('quotes', [])
+                      if q.get('text') and now - float(q.get('ts', 0)) < self.ttl]
+            self.quotes = quotes[-self.size:] if self.size else []
+            # 过期剔除或超出容量截断后标记为需保存，避免每次运行都重复截断磁盘上的旧文件
+            self._dirty = len(self.quotes) != len(data.get('quotes', []))
+        except FileNotFoundError:
+            self.quotes = []
+        except Exception as e:
+            logger.warning(f"读取一言缓存失败，将重新获取: {e}")
+            self.quotes = []
+
+    def __len__(self):
+        return len(self.quotes)
+
+    def add(self, text):
+        with self._lock:
+            if not text or any(q['text'] == text for q in self.quotes):
+                return False
+            self.quotes.append({'text': text, 'ts': int(time.time())})
+            del self.quotes[:-self.size or None]
+            self._dirty = True
+            return True
+
+    def take(self):
+        """随机取出一句（取出即移出池，避免重复回帖）；池为空时返回空串"""
+        with self._lock:
+            if not self.quotes:
+                return ''
+            self._dirty = True
+            return self.quotes.pop(random.randrange(len(self.quotes)))['text']
+
+    async def _fetch_one(self, session, i):
+        """单次请求一个句子（两个域名交替），失败返回空串，不重试"""
+        url = HITOKOTO_URLS[i % len(HITOKOTO_URLS)]
+        try:
+            async with session.get(url, headers={'User-Agent': random.choice(USER_AGENTS_DESKTOP)}) as resp:
+                if resp.status == 200:
+                    return _format_hitokoto(await resp.json(content_type=None))
+        except Exception as e:
+            logger.debug(f"一言获取失败({url}): {e}")
+        return ''
+
+    async def prefetch(self):
+        """把句子池并发补充到上限（每次运行最多 prefetch_count 个）；池已满时不发请求"""
+        need = min(self.prefetch_count, self.size - len(self.quotes))
+        if need <= 0:
+            logger.info(f"一言句子池已有 {len(self.quotes)} 句，无需补充")
+            return
+        timeout = aiohttp.ClientTimeout(total=5)
+        async with aiohttp.ClientSession(timeout=timeout,
+                                         trace_configs=[aio_metrics_trace(endpoint='hitokoto')]) as session:
+            results = await asyncio.gather(*(self._fetch_one(session, i) for i in range(need)))
+        added = sum(self.add(text) for text in results)
+        logger.info(f"一言句子池补充 {added} 句，当前共 {len(self.quotes)} 句")
+
+    def save(self):
+        """原子写入缓存文件（无变化时跳过）"""
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = json.dumps({'quotes': self.quotes}, ensure_ascii=False, indent=1)
+            self._dirty = False
+        tmp = f"{self.filename}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(tmp, self.filename)
+        except Exception as e:
+            logger.warning(f"保存一言缓存失败: {e}")
+
+hitokoto_pool = HitokotoPool(HITOKOTO_CACHE_FILE, HITOKOTO_CACHE_TTL_HOURS, HITOKOTO_POOL_SIZE, HITOKOTO_PREFETCH)
 
 def build_reply_content():
     """生成随机化回复内容，含北京时间、零宽符、短句、一言"""
@@ -458,7 +1700,7 @@ def build_reply_content():
     rand_token = uuid.uuid4().hex[:6]
     second_line = f"{noise}{sci_phrase}-{rand_token}"
 
-    quote = get_hitokoto()
+    quote = hitokoto_pool.take()  # 只取缓存，不等网络
     if quote:
         # 使用 `/>` 为分隔，避免双换行被折叠
         quote_block = f"\n/>\n{quote}"
@@ -469,45 +1711,52 @@ def build_reply_content():
 
 # ====== 异步版一言与内容生成（避免阻塞事件循环） ======
 import asyncio
-import aiohttp
-
-async def get_hitokoto_async():
-    """异步调用一言 API（与同步版同逻辑，不阻塞事件循环）"""
-    timeout = aiohttp.ClientTimeout(total=5)
-    headers = {'User-Agent': random.choice(USER_AGENTS_DESKTOP)}
-    for attempt in range(3):
-        for url in HITOKOTO_URLS:
-            try:
-                async with aiohttp.ClientSession(timeout=timeout) as session:
-                    async with session.get(url, headers=headers) as resp:
-                        if resp.status == 200:
-                            data = await resp.json(content_type=None)
-                            qt  = (data.get('hitokoto') or '').strip()
-                            frm = (data.get('from') or '').strip()
-                            who = (data.get('from_who') or '').strip()
-                            if qt:
-                                if frm and who:
-                                    return f"{qt}\n——{frm} · {who}"
-                                elif frm:
-                                    return f"{qt}\n——{frm}"
-                                else:
-                                    return qt
-            except Exception:
-                pass
-        if attempt < 2:
-            await asyncio.sleep(random.uniform(1, 2))
-    return ''
 
-async def build_reply_content_async():
-    """异步生成随机化回复内容（结构与同步版保持一致）"""
-    now_str = datetime.now(CN_TZ).strftime('%Y年%m月%d日 %H时%M分%S秒')
+def aio_metrics_trace(proxy=None, endpoint=None):
+    """
+    aiohttp 请求指标钩子：接口/账号取自请求的 trace_request_ctx（{'endpoint', 'account'}），
+    未传时使用 endpoint；延迟计到收到响应头为止，流量按实际收发的数据块累计
+    """
+    trace = aiohttp.TraceConfig()
+
+    async def _on_start(session, ctx, params):
+        info = ctx.trace_request_ctx or {}
+        ctx.endpoint = info.get('endpoint', endpoint)
+        ctx.account = info.get('account')
+        ctx.t0 = time.monotonic()
+
+    async def _on_end(session, ctx, params):
+        status = params.response.status
+        metrics.observe(ctx.endpoint, proxy, ctx.account, time.monotonic() - ctx.t0,
+                        outcome='ok' if status < 400 else f'http_{status}')
+
+    async def _on_exception(session, ctx, params):
+        metrics.observe(ctx.endpoint, proxy, ctx.account, time.monotonic() - ctx.t0,
+                        outcome=type(params.exception).__name__)
+
+    async def _on_sent(session, ctx, params):
+        metrics.add_bytes(getattr(ctx, 'endpoint', endpoint), 'sent', len(params.chunk))
+
+    async def _on_received(session, ctx, params):
+        metrics.add_bytes(getattr(ctx, 'endpoint', endpoint), 'received', len(params.chunk))
+
+    trace.on_request_start.append(_on_start)
+    trace.on_request_end.append(_on_end)
+    trace.on_request_exception.append(_on_exception)
+    trace.on_request_chunk_sent.append(_on_sent)
+    trace.on_response_chunk_received.append(_on_received)
+    return trace
+
+async def build_reply_content_async():
+    """异步生成随机化回复内容（结构与同步版保持一致）"""
+    now_str = datetime.now(CN_TZ).strftime('%Y年%m月%d日 %H时%M分%S秒')
     first_line = f"世界线 - {now_str} #(滑稽)"
     # noise = ''.join(random.choice(NOISE_CHARS) for _ in range(random.randint(1,3)))
     noise = ''
     sci_phrase = random.choice(SCI_FI_PHRASES)
     rand_token = uuid.uuid4().hex[:6]
     second_line = f"{noise}{sci_phrase}-{rand_token}"
-    quote = await get_hitokoto_async()
+    quote = hitokoto_pool.take()  # 只取缓存，不等网络
     quote_block = f"\n/>\n{quote}" if quote else ''
     return f"{first_line}\n{second_line}{quote_block}"
 # ====== 新增结束 ======
@@ -525,22 +1774,101 @@ def encodeData(data):
     data['sign'] = sign
     return data
 
+# -----------------------------
+# 预编译请求构造器（静态设备字段只排序/序列化一次）
+# -----------------------------
+class SignedRequestBuilder:
+    """
+    layout_fn 返回 [(key, 静态值或 None)]，None 表示每次调用时传入的动态字段；
+    排序与静态片段的拼接在首次使用时预编译，每次只代入动态值并计算 MD5，
+    输出（字段顺序、取值与 sign）与 encodeData(dict(...)) 完全一致
+    """
+    def __init__(self, layout_fn):
+        self._layout_fn = layout_fn
+        self._layout = None
+        self._dynamic_keys = ()
+        self._compiled = {}
+
+    def _ensure_layout(self):
+        if self._layout is None:
+            self._layout = list(self._layout_fn())
+            self._dynamic_keys = tuple(k for k, v in self._layout if v is None)
+        return self._layout
+
+    def _compile(self, present):
+        items = [(k, v) for k, v in self._ensure_layout() if v is not None or k in present]
+        lits, slots, cur = [], [], ''
+        for k, v in sorted(items, key=lambda kv: kv[0]):
+            if v is None:
+                lits.append(cur + f"{k}=")
+                slots.append(k)
+                cur = ''
+            else:
+                cur += f"{k}={v}"
+        lits.append(cur + SIGN_KEY)
+        order = tuple(k for k, _ in items)
+        static = {k: v for k, v in items if v is not None}
+        return lits, tuple(slots), order, static
+
+    def build(self, **values):
+        """values 为动态字段；值为 None 的可选字段不参与请求"""
+        self._ensure_layout()
+        present = tuple(k for k in self._dynamic_keys if values.get(k) is not None)
+        compiled = self._compiled.get(present)
+        if compiled is None:
+            compiled = self._compiled[present] = self._compile(present)
+        lits, slots, order, static = compiled
+        buf = [lits[0]]
+        for i, k in enumerate(slots, start=1):
+            buf.append(f"{values[k]}")
+            buf.append(lits[i])
+        out = {k: static[k] if k in static else values[k] for k in order}
+        out['sign'] = hashlib.md5(''.join(buf).encode(UTF8)).hexdigest().upper()
+        return out
+
+def _sign_data_layout(*dynamic):
+    return lambda: [*SIGN_DATA.items(), *((k, None) for k in dynamic)]
+
+LIKE_PAGE_SIZE = 200  # 关注列表每页贴吧数
+
+def _like_layout():
+    return [
+        ('BDUSS', None),
+        ('_client_type', '2'),
+        ('_client_id', DEVICE['client_id']),
+        ('_client_version', SIGN_DATA['_client_version']),
+        ('_phone_imei', DEVICE['imei']),
+        ('cuid', DEVICE['cuid']),
+        ('from', '1008621y'),
+        ('page_no', None),
+        ('page_size', str(LIKE_PAGE_SIZE)),
+        ('model', DEVICE['model']),
+        ('net_type', '1'),
+        ('timestamp', None),
+        ('vcode_tag', '11'),
+    ]
+
+SIGN_BUILDER  = SignedRequestBuilder(_sign_data_layout('BDUSS', 'fid', 'kw', 'tbs', 'timestamp'))
+MSIGN_BUILDER = SignedRequestBuilder(_sign_data_layout('BDUSS', 'forum_ids', 'tbs', 'timestamp'))
+REPLY_BUILDER = SignedRequestBuilder(_sign_data_layout('BDUSS', 'fid', 'kw', 'tid', 'content', 'timestamp', 'tbs'))
+LIKE_BUILDER  = SignedRequestBuilder(_like_layout)
+
 # =============================
 #  Tieba 交互全面切到 aio（aiotieba）
 # =============================
-# 额外引入 aiohttp 用于异步预检与 PushPlus
-#（已在上方导入）
-
-# 修复导入：新版在 aiotieba.config 下；旧版保留回退 
-try:
-    import aiotieba
+# aiotieba 仅吧主任务使用，延迟到创建客户端时才导入（见上方 _LazyModule）
+def _aiotieba_proxy_config_cls():
+    """修复导入：新版在 aiotieba.config 下；旧版保留回退"""
     try:
-        from aiotieba.config import ProxyConfig, TimeoutConfig  # aiotieba 4.x
-    except ImportError:
-        from aiotieba import ProxyConfig, TimeoutConfig         # 旧版兼容
-except Exception as _e:
-    logger.error("未安装/版本不匹配的 aiotieba，请先 `pip install -U aiotieba`，错误: %s", _e)
-    raise
+        aiotieba._load()  # 记录导入耗时
+        try:
+            from aiotieba.config import ProxyConfig  # aiotieba 4.x
+        except ImportError:
+            from aiotieba import ProxyConfig         # 旧版兼容
+    except Exception as _e:
+        logger.error("未安装/版本不匹配的 aiotieba，请先 `pip install -U aiotieba`，错误: %s", _e)
+        raise
+    return ProxyConfig
 
 # -----------------------------
 # PushPlus 告警
@@ -580,14 +1908,21 @@ def notify_bduss_invalid_via_pushplus(index: int, masked_id: str, reason: str, d
 
     urls = ["https://www.pushplus.plus/send", "https://pushplus.plus/send"]
     ok = False
-    for u in urls:
-        try:
-            r = requests.post(u, json=payload, timeout=10)
-            if r.status_code == 200:
-                ok = True
+    state, token = RETRY_POLICY.start('pushplus')
+    try:
+        while True:
+            u = urls[state.attempt % len(urls)]  # 两个域名轮换
+            try:
+                r = transport.request('POST', u, endpoint='pushplus', json=payload, timeout=state.timeout(10))
+                if r.status_code == 200:
+                    ok = True
+                    break
+            except Exception as e:
+                logger.warning(f"PushPlus 发送失败({u}): {e}")
+            if not state.backoff():
                 break
-        except Exception as e:
-            logger.warning(f"PushPlus 发送失败({u}): {e}")
+    finally:
+        RETRY_POLICY.finish(token)
     if ok:
         logger.info(f"已通过 PushPlus 发送 BDUSS 失效告警：账号#{index}")
     else:
@@ -596,13 +1931,18 @@ def notify_bduss_invalid_via_pushplus(index: int, masked_id: str, reason: str, d
 # -----------------------------
 # 登录态预检（仅依赖 BDUSS，STOKEN 可为空）
 # -----------------------------
-async def check_bduss_login_state(bduss: str, stoken: str = ""):
+async def check_bduss_login_state(bduss: str, stoken: str = "", session=None):
     """
     返回 (True/False/None, detail)
       True  -> 已登录
       False -> 未登录（可视为 BDUSS 失效）
       None  -> 网络异常/不确定
+    session 为 precheck_accounts 提供的共享会话；未传时临时创建一个
     """
+    if session is None:
+        async with _precheck_session() as session:
+            return await check_bduss_login_state(bduss, stoken, session)
+
     url = TBS_URL  # http://tieba.baidu.com/dc/common/tbs
     cookies = f"BDUSS={bduss}"
     if stoken:
@@ -614,49 +1954,176 @@ async def check_bduss_login_state(bduss: str, stoken: str = ""):
         "Cookie": cookies
     }
 
+    state, token = RETRY_POLICY.start('precheck')
     try:
-        timeout = aiohttp.ClientTimeout(total=8)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(url, headers=headers) as resp:
-                if resp.status != 200:
-                    return None, f"http {resp.status}"
-                data = await resp.json(content_type=None)
-                # 典型返回：{"is_login":1,"tbs":"xxx"}
-                is_login = int(data.get("is_login", 0))
-                if is_login == 1:
-                    return True, "is_login=1"
-                return False, f"is_login={is_login}"
-    except Exception as e:
-        return None, f"network:{e}"
+        while True:
+            try:
+                timeout = aiohttp.ClientTimeout(total=state.timeout(8))
+                async with session.get(url, headers=headers, timeout=timeout,
+                                       trace_request_ctx={'endpoint': 'precheck', 'account': bduss}) as resp:
+                    if resp.status != 200:
+                        detail = f"http {resp.status}"
+                    else:
+                        data = await resp.json(content_type=None)
+                        # 典型返回：{"is_login":1,"tbs":"xxx"}
+                        is_login = int(data.get("is_login", 0))
+                        if is_login == 1:
+                            tbs_cache.put(bduss, data.get("tbs"))  # 顺带缓存 tbs，后续签到无需再请求
+                            return True, "is_login=1"
+                        return False, f"is_login={is_login}"
+            except Exception as e:
+                detail = f"network:{type(e).__name__}: {e}"
+            # 网络异常/非 200 时按统一策略重试，仍失败则返回“不确定”
+            if not await state.backoff_async():
+                return None, detail
+    finally:
+        RETRY_POLICY.finish(token)
+
+def _precheck_session():
+    """
+    预检共享会话：连接数上限 PRECHECK_CONCURRENCY；
+    各账号的 Cookie 通过请求头单独传递，禁用 Cookie Jar，避免响应里的 Set-Cookie 串到其他账号
+    """
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=PRECHECK_CONCURRENCY),
+        cookie_jar=aiohttp.DummyCookieJar(),
+        trace_configs=[aio_metrics_trace()],
+    )
+
+async def precheck_accounts(accounts):
+    """
+    启动时通过同一个会话并发预检所有账号的登录态
+    accounts 为 [(idx, bduss, stoken)]，返回 {idx: (True/False/None, detail)}
+    """
+    async def _one(idx, bduss, stoken):
+        with profiler.phase('precheck', account=idx):
+            try:
+                return await check_bduss_login_state(bduss, stoken, session)
+            except Exception as e:
+                return None, f"{type(e).__name__}: {e}"
+
+    async with _precheck_session() as session:
+        results = await asyncio.gather(*(_one(*acc) for acc in accounts))
+    return {acc[0]: res for acc, res in zip(accounts, results)}
 
 # -----------------------------
-# 1. 获取 tbs（由 aiotieba 内部维护，保持壳与日志）
+# 1. 获取 tbs（按账号缓存：预检时顺带写入，签到/回帖/aiotieba 共用，只在确认过期时重新获取）
 # -----------------------------
+TBS_CACHE_TTL_MINUTES = float(ENV.get('TBS_CACHE_TTL_MINUTES', '30'))
+
+class TbsCache:
+    """
+    内存中的 tbs 缓存：{账号标识: (tbs, 写入时间)}；tbs 与登录会话绑定，不落盘
+    同一账号同时只会有一个线程去请求 tbs，其余等待并直接使用其结果
+    """
+    def __init__(self, ttl_minutes):
+        self.ttl = ttl_minutes * 60
+        self._data = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.fetches = 0
+        self.refreshes = 0
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def put(self, bduss, tbs):
+        if tbs:
+            with self._lock:
+                self._data[_account_key(bduss)] = (tbs, time.monotonic())
+
+    def peek(self, bduss):
+        """未过期时返回缓存的 tbs，否则返回 None（不发请求）"""
+        with self._lock:
+            item = self._data.get(_account_key(bduss))
+        if item and time.monotonic() - item[1] < self.ttl:
+            return item[0]
+        return None
+
+    def get(self, bduss):
+        """取 tbs：缓存有效时直接返回，否则请求一次并写入缓存（失败抛 RuntimeError）"""
+        tbs = self.peek(bduss)
+        if tbs:
+            self.hits += 1
+            return tbs
+        with self._key_lock(_account_key(bduss)):
+            tbs = self.peek(bduss)  # 等锁期间可能已被其他线程取到
+            if tbs:
+                self.hits += 1
+                return tbs
+            tbs = _fetch_tbs_sync(bduss)
+            self.fetches += 1
+            self.put(bduss, tbs)
+            return tbs
+
+    def refresh(self, bduss, stale):
+        """
+        调用方确认 stale 已失效时使用：缓存仍是 stale 才重新获取，
+        已被其他请求刷新过则直接返回新值，避免并发签到时重复获取
+        """
+        with self._key_lock(_account_key(bduss)):
+            current = self.peek(bduss)
+            if current and current != stale:
+                return current
+            logger.info("tbs 已失效，重新获取")
+            with self._lock:
+                self._data.pop(_account_key(bduss), None)
+            tbs = _fetch_tbs_sync(bduss)
+            self.fetches += 1
+            self.refreshes += 1
+            self.put(bduss, tbs)
+            return tbs
+
+    def log_stats(self):
+        logger.info(f"tbs 缓存：命中 {self.hits} 次，请求 {self.fetches} 次（其中失效刷新 {self.refreshes} 次）")
+
+tbs_cache = TbsCache(TBS_CACHE_TTL_MINUTES)
+
+def _refresh_tbs(bduss, stale):
+    """确认 tbs 失效后刷新；刷新失败返回 None，由调用方按原结果处理"""
+    try:
+        return tbs_cache.refresh(bduss, stale)
+    except RuntimeError:
+        return None
+
+def _is_tbs_stale(jr) -> bool:
+    """接口因 tbs 失效/校验失败而拒绝（按返回信息中的关键字判断）"""
+    if not isinstance(jr, dict):
+        return False
+    err = jr.get('error') if isinstance(jr.get('error'), dict) else {}
+    s = f"{jr.get('error_msg') or ''} {jr.get('msg') or ''} {err.get('errmsg') or ''}".lower()
+    return 'tbs' in s
+
 async def get_tbs(bduss: str):
-    """获取图形验证码 tbs，用于各种签名接口（AIO：由 aiotieba 维护，保留占位）"""
-    logger.info("获取 tbs 开始")
-    # aiotieba 内部会在需要时自动获取/更新 tbs，这里返回占位并保持日志格式
-    tbs = "aiotieba_managed"
-    logger.info(f"获取 tbs 完成: {tbs}")
-    return tbs
+    """获取 tbs（异步）：优先使用缓存，未命中时在线程中请求"""
+    tbs = tbs_cache.peek(bduss)
+    if tbs:
+        tbs_cache.hits += 1
+        return tbs
+    return await asyncio.to_thread(tbs_cache.get, bduss)
 
 def get_tbs_sync(bduss: str):
-    """同步获取 tbs（用于老版 requests 签到路径）"""
+    """同步获取 tbs（用于老版 requests 签到路径）：优先使用缓存，未命中时请求"""
+    return tbs_cache.get(bduss)
+
+def _fetch_tbs_sync(bduss: str):
+    """请求 tbs 接口；重试由 robust_request 的统一策略负责"""
     logger.info("获取 tbs 开始")
     headers = get_headers()
     headers.update({COOKIE: f"{BDUSS}={bduss}"})
-    for attempt in range(3):
-        try:
-            resp = robust_request('GET', TBS_URL, headers=headers, timeout=5)
-            resp.raise_for_status()
-            tbs = resp.json().get('tbs')
-            logger.info(f"获取 tbs 完成: {tbs}")
-            return tbs
-        except Exception as e:
-            logger.warning(f"获取 tbs 第{attempt+1}次失败: {e}")
-            time.sleep(2)
-    logger.error("获取 tbs 失败，签到中止")
-    raise RuntimeError("TBS 获取失败")
+    try:
+        pacer.acquire_sync(bduss, 'tbs')
+        resp = robust_request('GET', TBS_URL, account=bduss, endpoint='tbs', hedge=True, headers=headers, timeout=5)
+        tbs = resp.json().get('tbs')
+        if not tbs:
+            raise ValueError("返回中没有 tbs")
+        logger.info(f"获取 tbs 完成: {tbs}")
+        return tbs
+    except Exception as e:
+        logger.error(f"获取 tbs 失败，签到中止: {e}")
+        raise RuntimeError("TBS 获取失败")
 
 # -----------------------------
 # 错误语义判别（最小关键字法，避免把权限问题误判未登录）
@@ -678,267 +2145,1052 @@ def _is_permission_or_stoken_issue(err_obj) -> bool:
 # -----------------------------
 # 2. 获取关注的贴吧
 # -----------------------------
-def get_favorite_fast(bduss: str):
-    """获取用户关注的贴吧列表（稳健分页 + 扁平化 + 去重 + 字段规范化）"""
+FAVORITE_FIELDS = ('slogan', 'level_id', 'cur_score')   # 关注列表中保留的附加字段（其余原始字段丢弃）
+
+def _normalize_forum(item: dict):
+    """把关注接口返回的单个贴吧规范化为精简字典 {id, name, slogan, level_id, cur_score}"""
+    if not isinstance(item, dict):
+        return None
+    fid = str(item.get('id') or item.get('fid') or item.get('forum_id') or '').strip()
+    name = item.get('name') or item.get('fname') or item.get('forum_name')
+    if not fid or not name:
+        return None
+    obj = {'id': fid, 'name': str(name)}
+    for k in FAVORITE_FIELDS:
+        if item.get(k) is not None:
+            obj[k] = item[k]
+    return obj
+
+def _iter_forum_items(res: dict):
+    """扁平化关注接口返回的 forum_list（兼容嵌套列表/单个字典）"""
+    flist = res.get('forum_list', {})
+    if not isinstance(flist, dict):
+        flist = {}
+    for section in ('non-gconforum', 'gconforum'):
+        v = flist.get(section, [])
+        if isinstance(v, list):
+            for item in v:
+                if isinstance(item, list):
+                    yield from item
+                else:
+                    yield item
+        elif isinstance(v, dict):
+            yield v
+
+def _fetch_favorite_page(bduss: str, page_no: int):
+    """请求关注列表的一页，返回解析后的 JSON（失败时抛异常）"""
+    data = LIKE_BUILDER.build(BDUSS=bduss, page_no=str(page_no), timestamp=str(int(time.time())))
+    pacer.acquire_sync(bduss, 'like')
+    resp = robust_request('POST', LIKIE_URL, account=bduss, endpoint='like', hedge=True, data=data, timeout=10)
+    resp.raise_for_status()
+    return resp.json()
+
+def _favorites_fingerprint(res: dict) -> str:
+    """首页指纹：首页 fid 集合 + has_more，用于廉价判断关注列表是否变化"""
+    fids = sorted(str(obj['id']) for obj in filter(None, map(_normalize_forum, _iter_forum_items(res))))
+    raw = f"{','.join(fids)}|{res.get('has_more', '0')}"
+    return hashlib.md5(raw.encode(UTF8)).hexdigest()
+
+FAVORITES_PAGE_CONCURRENCY = max(1, int(ENV.get('FAVORITES_PAGE_CONCURRENCY', '4') or 1))  # 同时请求的关注列表页数
+
+def get_favorite_fast(bduss: str, on_forum=None):
+    """
+    获取用户关注的贴吧列表（窗口并发分页 + 扁平化 + 去重 + 字段规范化）
+    同时在途的页数不超过 FAVORITES_PAGE_CONCURRENCY；任一页返回 has_more=0 后不再请求其后的页，
+    也不等待已发出的多余页。有缓存时按缓存的贴吧数预估页数，首轮即并发请求到预估页；
+    超出预估（或无缓存）时，每确认一页 has_more=1 就向后打开一个窗口
+    on_forum：每凑齐连续的一页，就按顺序对其中新出现的贴吧逐个回调（供边拉取边签到）
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
     logger.info("获取关注的贴吧开始")
+    entry = favorites_cache.get(bduss)
+    expected_pages = max(1, -(-len(entry.get('forums') or []) // LIKE_PAGE_SIZE)) if entry else 1
+
+    pages = {}      # page_no -> 响应
+    last = None     # 最后一页（首个 has_more=0 的页码）
+    failed = None   # 首个失败的页码
+    max_more = 0    # 已确认 has_more=1 的最大页码
+    next_page = 1
+    running = {}
     collected = []
     seen = set()
-    page_no = 1
+    merged = 0      # 已按顺序合并到 collected 的页数
 
-    def _normalize(item: dict):
-        if not isinstance(item, dict):
-            return None
-        fid = str(item.get('id') or item.get('fid') or item.get('forum_id') or '').strip()
-        name = item.get('name') or item.get('fname') or item.get('forum_name')
-        if not fid or not name:
-            return None
-        obj = dict(item)
-        obj['id'] = fid
-        obj['name'] = str(name)
-        return obj
-
-    def _add(item):
-        obj = _normalize(item)
-        if not obj:
-            return
-        fid = obj['id']
-        if fid in seen:
-            return
-        seen.add(fid)
-        collected.append(obj)
+    def _merge_ready():
+        # 按页码顺序合并，只取到最后一页/首个失败页之前，保持与逐页请求相同的结果与顺序
+        nonlocal merged
+        while merged + 1 in pages and (last is None or merged + 1 <= last):
+            merged += 1
+            for item in _iter_forum_items(pages[merged]):
+                obj = _normalize_forum(item)
+                if not obj or obj['id'] in seen:
+                    continue
+                seen.add(obj['id'])
+                collected.append(obj)
+                if on_forum:
+                    on_forum(obj)
 
-    while True:
-        data = {
-            'BDUSS': bduss,
-            '_client_type': '2',
-            '_client_id': DEVICE['client_id'],
-            '_client_version': SIGN_DATA['_client_version'],
-            '_phone_imei': DEVICE['imei'],
-            'cuid': DEVICE['cuid'],
-            'from': '1008621y',
-            'page_no': str(page_no),
-            'page_size': '200',
-            'model': DEVICE['model'],
-            'net_type': '1',
-            'timestamp': str(int(time.time())),
-            'vcode_tag': '11',
-        }
-        data = encodeData(data)
-        try:
-            resp = robust_request('POST', LIKIE_URL, data=data, timeout=10)
-            resp.raise_for_status()
-            res = resp.json()
-        except Exception as e:
-            logger.error("获取关注的贴吧出错: %s", e)
-            break
+    def _limit():
+        # 可请求的最大页码：预估范围内直接请求，超出后只在已确认的页之后预取一个窗口
+        limit = expected_pages if max_more < expected_pages else max_more + FAVORITES_PAGE_CONCURRENCY
+        if last is not None:
+            limit = min(limit, last)
+        if failed is not None:
+            limit = min(limit, failed - 1)
+        return limit
 
-        flist = res.get('forum_list', {})
-        if not isinstance(flist, dict):
-            flist = {}
-        for section in ('non-gconforum', 'gconforum'):
-            v = flist.get(section, [])
-            if isinstance(v, list):
-                for item in v:
-                    if isinstance(item, list):
-                        for sub in item:
-                            _add(sub)
-                    else:
-                        _add(item)
-            elif isinstance(v, dict):
-                _add(v)
+    def _complete():
+        return last is not None and all(p in pages for p in range(1, last + 1))
 
-        logger.info(f"第{page_no}页累计收集 {len(collected)} 个")
-        has_more = (str(res.get('has_more', '0')) == '1')
-        if not has_more:
-            break
-        page_no += 1
-        time.sleep(0.2)
+    def _done():
+        # 最后一页及之前的页都已返回，或失败页之前的页都已结束；多余的页不再等待
+        return _complete() or (failed is not None and all(p > failed for p in running.values()))
+
+    pool = ThreadPoolExecutor(max_workers=FAVORITES_PAGE_CONCURRENCY)
+    try:
+        while True:
+            while len(running) < FAVORITES_PAGE_CONCURRENCY and next_page <= _limit():
+                # 复制上下文，让各页请求仍计入当前剖析阶段
+                ctx = contextvars.copy_context()
+                running[pool.submit(ctx.run, _fetch_favorite_page, bduss, next_page)] = next_page
+                next_page += 1
+            if not running or _done():
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                page_no = running.pop(fut)
+                try:
+                    res = fut.result()
+                except Exception as e:
+                    logger.error("获取关注的贴吧出错(第%d页): %s", page_no, e)
+                    failed = page_no if failed is None else min(failed, page_no)
+                    continue
+                pages[page_no] = res
+                if str(res.get('has_more', '0')) == '1':
+                    max_more = max(max_more, page_no)
+                else:
+                    last = page_no if last is None else min(last, page_no)
+            _merge_ready()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
 
+    complete = _complete()
+    logger.info(f"关注列表共获取 {len(pages)} 页（最多同时 {FAVORITES_PAGE_CONCURRENCY} 页）")
+
+    # 只缓存完整拉取的结果，避免把中途失败的残缺列表当作缓存
+    if complete:
+        favorites_cache.put(bduss, collected, _favorites_fingerprint(pages[1]))
     logger.info("获取关注的贴吧结束，共 %d 个", len(collected))
     return collected
 
 # -----------------------------
-# 3. 客户端签到
+# 2.1 关注列表缓存（TTL + 首页指纹校验）
 # -----------------------------
-def client_sign(bduss, tbs, fid, kw):
-    """执行签到操作 + 代理降级；每条线路最多重试3次"""
-    logger.info(f"签到贴吧: {kw}")
+FAVORITES_CACHE_ENABLE = ENV.get('FAVORITES_CACHE_ENABLE', 'true').lower() == 'true'
+FAVORITES_CACHE_FILE   = ENV.get('FAVORITES_CACHE_FILE', 'favorites_cache.json')
+FAVORITES_CACHE_TTL    = float(ENV.get('FAVORITES_CACHE_TTL_HOURS', '72')) * 3600
 
-    # 构造参数（保持原有字段/签名）
-    data = {**SIGN_DATA, 'BDUSS': bduss, 'fid': fid, 'kw': kw, 'tbs': tbs, 'timestamp': str(int(time.time()))}
-    encoded_data = encodeData(dict(data))  # 避免被重用时 sign 字段残留
-    headers = get_headers()  # 不强制 is_mobile
-    cookies = {BDUSS: bduss}
+class FavoritesCache:
+    """
+    缓存结构：{账号标识: {"ts": 保存时间, "fingerprint": 首页指纹, "forums": [精简贴吧字典]}}
+    """
+    def __init__(self, filename, ttl, enable=True):
+        self.filename = filename
+        self.ttl = ttl
+        self.enable = enable
+        self.entries = {}
+        self._lock = threading.Lock()
+        if enable:
+            try:
+                with open(filename, 'r') as f:
+                    data = json.load(f)
+                if isinstance(data, dict):
+                    self.entries = data
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+            except Exception as e:
+                logger.warning(f"读取关注列表缓存失败: {e}")
 
-    # 三段式线路：首选代理 -> 第一条免费代理 -> 直连
+    def get(self, bduss):
+        if not self.enable:
+            return None
+        with self._lock:
+            return self.entries.get(_account_key(bduss))
+
+    def put(self, bduss, forums, fingerprint):
+        if not self.enable:
+            return
+        with self._lock:
+            self.entries[_account_key(bduss)] = {
+                'ts': int(time.time()),
+                'fingerprint': fingerprint,
+                'forums': forums,
+            }
+            payload = json.dumps(self.entries, ensure_ascii=False, separators=(',', ':'))
+        tmp = f"{self.filename}.tmp"
+        try:
+            with open(tmp, 'w', encoding=UTF8) as f:
+                f.write(payload)
+            os.replace(tmp, self.filename)
+        except Exception as e:
+            logger.warning(f"保存关注列表缓存失败: {e}")
+
+favorites_cache = FavoritesCache(FAVORITES_CACHE_FILE, FAVORITES_CACHE_TTL, FAVORITES_CACHE_ENABLE)
+
+def _refresh_forum_fields(forums, res):
+    """
+    用校验时拉取的首页更新缓存中对应贴吧的等级/经验等字段（指纹不含这些字段），返回更新的贴吧数；
+    首页之外的贴吧仍沿用缓存中的值，直到缓存过期或指纹变化后完整刷新
+    """
+    fresh = {obj['id']: obj for obj in filter(None, map(_normalize_forum, _iter_forum_items(res)))}
+    updated = 0
+    for forum in forums:
+        obj = fresh.get(forum['id'])
+        if obj is None:
+            continue
+        changed = {k: obj[k] for k in FAVORITE_FIELDS if k in obj and forum.get(k) != obj[k]}
+        if changed:
+            forum.update(changed)
+            updated += 1
+    return updated
+
+def get_favorites_cached(bduss: str, fetch=True):
+    """
+    优先使用缓存的关注列表，返回 (favorites, need_refresh)：
+      - 无缓存：完整拉取，need_refresh=False；fetch=False 时返回 (None, False)，由调用方边拉取边签到
+      - 缓存未过期且首页指纹一致：直接使用缓存（首页贴吧的等级/经验按本次拉取的首页更新），need_refresh=False
+      - 否则：先返回缓存用于签到，need_refresh=True 由调用方在后台刷新
+    """
+    entry = favorites_cache.get(bduss)
+    if not entry or not entry.get('forums'):
+        return (get_favorite_fast(bduss) if fetch else None), False
+
+    forums = entry['forums']
+    age = time.time() - entry.get('ts', 0)
+    if age >= favorites_cache.ttl:
+        logger.info(f"关注列表缓存已过期（{age / 3600:.1f} 小时），先使用缓存签到并在后台刷新")
+        return forums, True
+    try:
+        first_page = _fetch_favorite_page(bduss, 1)
+        fingerprint = _favorites_fingerprint(first_page)
+    except Exception as e:
+        logger.warning(f"校验关注列表缓存失败: {e}，先使用缓存签到并在后台刷新")
+        return forums, True
+    if fingerprint != entry.get('fingerprint'):
+        logger.info("关注列表首页指纹已变化，先使用缓存签到并在后台刷新")
+        return forums, True
+    updated = _refresh_forum_fields(forums, first_page)
+    if updated:
+        logger.info(f"按首页更新了 {updated} 个贴吧的等级/经验")
+    logger.info(f"关注列表缓存有效，跳过完整分页，共 {len(forums)} 个")
+    return forums, False
+
+# -----------------------------
+# 3. 客户端签到
+# -----------------------------
+def _build_route_chain(bduss=None, endpoint=None, fetch=True):
+    """
+    三段式线路：首选代理 -> 评分最高的免费代理 -> 直连（None）；有线路记忆时上次成功的线路优先
+    在事件循环中调用时传 fetch=False，不阻塞等待备用代理列表的获取
+    """
     chain = []
     # 1.自定义代理
     if PROXY_ENABLE and SOCKS_PROXY:
         chain.append(SOCKS_PROXY)
-    # 2.第一条免费代理
-    backup_proxy = None
+    # 2.评分最高的免费代理
     try:
-        proxy_list_full = proxy_manager.get_proxy_list()  # [user_proxy?, backup..., None]
-        for p in proxy_list_full:
-            if p and p != SOCKS_PROXY:
-                backup_proxy = p
-                break
+        backup_proxy = proxy_manager.best_backup(exclude=SOCKS_PROXY, fetch=fetch)
     except Exception:
         backup_proxy = None
     if backup_proxy:
         chain.append(backup_proxy)
     # 3.直连
     chain.append(None)
+    return route_memory.order(chain, bduss, endpoint)
 
-    total_paths = len(chain)
+def _is_sign_ok(jr) -> bool:
+    """三种成功判定：有 user_info；error_code 为 0；或“已签到”视作软成功"""
+    code = str(jr.get('error_code', ''))
+    has_ui = isinstance(jr.get('user_info'), dict)
+    already = code in ('160002', '1101')  # 客户端/网页两种
+    return has_ui or code in ('0', 0) or already
 
-    for path_idx, p in enumerate(chain, start=1):
-        proxy_info_for_log = proxy_manager._sanitize_proxy_url(p)
-        logger.info(f"请求尝试 ({path_idx}/{total_paths}) 使用: {proxy_info_for_log}")
-        proxies = {'http': p, 'https': p} if p else None
+def _handle_sign_result(jr, kw, bduss=None):
+    """统一处理签到接口的 JSON 返回（同步/异步签到共用），返回原始 jr"""
+    # 统一状态判定 + 关键字段
+    code = str(jr.get('error_code', ''))
+    msg = jr.get('error_msg') or jr.get('msg') or ''
+    has_ui = isinstance(jr.get('user_info'), dict)
+    ok = _is_sign_ok(jr)
+
+    # 补充 user_info 里的关键信息
+    ui = jr.get('user_info') or {}
+    rank = ui.get('user_sign_rank') or ui.get('sign_rank')
+    cont = ui.get('cont_sign_num')
+    cont_total = ui.get('cont_total_sign_num')
+    sign_time = ui.get('sign_time')
 
-        # 每条线路内部重试 3 次
-        for inner_try in range(1, 4):
+    status = "Succeeded" if ok else "Failed" 
+    logger.info(f"[sign_forum] {status}. args=({kw!r},) kwargs={{}} code={code} msg={msg}")
+
+    # 进一步给出成功细节
+    if has_ui:
+        logger.info(
+            f"[sign_forum] Details: rank={rank}, cont={cont}, total_cont={cont_total}, time={sign_time}"
+        )
+
+    # 常见错误码的可读提示
+    if not ok and code in ('1102', '1107', '340006'):
+        tips = {
+            '1102': '未开通签到或过快',
+            '1107': '今日已签到数量达上限(100)',
+            '340006': '贴吧目录异常'
+        }
+        logger.warning(f"[sign_forum] Hint: {tips.get(code, '')}")
+
+    # 原始返回：仅在开关开启时打印
+    if LOG_SIGN_RAW:
+        logger.info(
+            f"[sign_forum] Raw: {json.dumps(jr, ensure_ascii=False, separators=(',', ':'))}"
+        )
+
+    check_wind_control(jr, bduss, 'sign')
+    return jr
+
+def _handle_sign_non_json(kw, text):
+    """签到接口返回非 JSON 时视为成功"""
+    # 非 JSON 返回时：是否打印 raw 由开关控制
+    if LOG_SIGN_RAW:
+        logger.info(
+            f"[sign_forum] 非JSON返回，视为成功。args=({kw!r},) kwargs={{}} raw={text[:200]!r}"
+        )
+    else:
+        logger.info(
+            f"[sign_forum] 非JSON返回，视为成功。args=({kw!r},) kwargs={{}}"
+        )
+    return {'error_code': 0}
+
+def client_sign(bduss, tbs, fid, kw, retry_stale=True):
+    """执行签到操作 + 代理降级；按统一重试策略退避，每次失败切换到下一条线路；tbs 失效时刷新后重签一次"""
+    logger.info(f"签到贴吧: {kw}")
+
+    # 构造参数（保持原有字段/签名）
+    encoded_data = SIGN_BUILDER.build(BDUSS=bduss, fid=fid, kw=kw, tbs=tbs, timestamp=str(int(time.time())))
+    headers = get_headers()  # 不强制 is_mobile
+    cookies = {BDUSS: bduss}
+
+    chain = _build_route_chain(bduss, 'sign')
+    total_paths = len(chain)
+    stale_jr = None
+    state, token = RETRY_POLICY.start('sign')
+    try:
+        while True:
+            path_idx = min(state.attempt, total_paths - 1)
+            p = chain[path_idx]
+            proxy_info_for_log = proxy_manager._sanitize_proxy_url(p)
+            logger.info(f"请求尝试 ({path_idx+1}/{total_paths}) 使用: {proxy_info_for_log}")
+            t0 = time.monotonic()
             try:
-                resp = s.post(SIGN_URL, headers=headers, cookies=cookies, data=encoded_data, proxies=proxies, timeout=10)
+                resp = transport.request('POST', SIGN_URL, proxy=p, endpoint='sign', account=bduss,
+                                         headers=headers, cookies=cookies,
+                                         data=encoded_data, timeout=state.timeout(10))
                 resp.raise_for_status()
+                proxy_manager.report(p, True, time.monotonic() - t0)
+                route_memory.success(bduss, 'sign', p)
+                latency_tracker.observe('sign', time.monotonic() - t0)
                 # 记录一次连通成功（仅首成功打印出口IP）
                 proxy_manager.test_and_log_success(p)
                 try:
                     jr = resp.json()
+                except JSONDecodeError:
+                    return _handle_sign_non_json(kw, resp.text)
+                pacer.feedback(bduss, 'sign', jr)
+                metrics.code('sign', jr)
+                if retry_stale and _is_tbs_stale(jr):
+                    stale_jr = jr
+                    break
+                return _handle_sign_result(jr, kw, bduss)
 
-                    # 统一状态判定 + 关键字段
-                    code = str(jr.get('error_code', ''))
-                    msg = jr.get('error_msg') or jr.get('msg') or ''
-
-                    # 三种成功判定：有 user_info；error_code 为 0；或“已签到”视作软成功
-                    has_ui = isinstance(jr.get('user_info'), dict)
-                    already = code in ('160002', '1101')  # 客户端/网页两种
-                    ok = has_ui or code in ('0', 0) or already
-
-                    # 补充 user_info 里的关键信息
-                    ui = jr.get('user_info') or {}
-                    rank = ui.get('user_sign_rank') or ui.get('sign_rank')
-                    cont = ui.get('cont_sign_num')
-                    cont_total = ui.get('cont_total_sign_num')
-                    sign_time = ui.get('sign_time')
-
-                    status = "Succeeded" if ok else "Failed" 
-                    logger.info(f"[sign_forum] {status}. args=({kw!r},) kwargs={{}} code={code} msg={msg}")
-
-                    # 进一步给出成功细节
-                    if has_ui:
-                        logger.info(
-                            f"[sign_forum] Details: rank={rank}, cont={cont}, total_cont={cont_total}, time={sign_time}"
-                        )
-
-                    # 常见错误码的可读提示
-                    if not ok and code in ('1102', '1107', '340006'):
-                        tips = {
-                            '1102': '未开通签到或过快',
-                            '1107': '今日已签到数量达上限(100)',
-                            '340006': '贴吧目录异常'
-                        }
-                        logger.warning(f"[sign_forum] Hint: {tips.get(code, '')}")
-
-                    # 原始返回：仅在开关开启时打印
-                    if LOG_SIGN_RAW:
-                        logger.info(
-                            f"[sign_forum] Raw: {json.dumps(jr, ensure_ascii=False, separators=(',', ':'))}"
-                        )
+            except requests.exceptions.RequestException as e:
+                proxy_manager.report(p, False)
+                route_memory.failure(bduss, 'sign', p)
+                logger.warning(f"签到请求失败(第{state.attempt+1}次): {e}")
+                if not state.backoff():
+                    break
+    finally:
+        RETRY_POLICY.finish(token)
 
-                except JSONDecodeError:
-                    # 非 JSON 返回时：是否打印 raw 由开关控制
-                    if LOG_SIGN_RAW:
-                        logger.info(
-                            f"[sign_forum] 非JSON返回，视为成功。args=({kw!r},) kwargs={{}} raw={resp.text[:200]!r}"
-                        )
-                    else:
-                        logger.info(
-                            f"[sign_forum] 非JSON返回，视为成功。args=({kw!r},) kwargs={{}}"
-                        )
-                    return {'error_code': 0}
+    if stale_jr is not None:
+        fresh = _refresh_tbs(bduss, tbs)
+        if fresh:
+            return client_sign(bduss, fresh, fid, kw, retry_stale=False)
+        return _handle_sign_result(stale_jr, kw, bduss)
 
-                if check_wind_control(jr):
-                    return jr
-                return jr
+    # 所有尝试均失败
+    return {'error_code': -1, 'msg': 'sign failed after retries'}
 
-            except requests.exceptions.RequestException as e:
-                logger.warning(f"签到请求失败(第{inner_try}/3): {e}")
-                if inner_try < 3:
-                    time.sleep(random.uniform(3.0, 5.0))  # 间隔后再试
-                else:
-                    logger.warning("该线路3次均失败，切换下一线路")
+# -----------------------------
+# 签到台账（按北京时间记录当天结果，重跑时跳过已签到的贴吧）
+# -----------------------------
+SIGN_LEDGER_ENABLE = ENV.get('SIGN_LEDGER_ENABLE', 'true').lower() == 'true'
+SIGN_LEDGER_FILE   = ENV.get('SIGN_LEDGER_FILE', 'sign_ledger.json')
+
+class SignLedger:
+    """
+    台账结构：{"date": "YYYY-MM-DD", "accounts": {账号标识: {fid: error_code}}, "capped": [已达每日上限的账号标识]}
+    只保留北京时间当天的记录，跨天自动清空
+    """
+    FLUSH_EVERY = 20
+
+    def __init__(self, filename, enable=True):
+        self.filename = filename
+        self.enable = enable
+        self.date = self._today()
+        self.accounts = {}
+        self.capped = set()
+        self._dirty = 0
+        self._lock = threading.Lock()
+        if enable:
+            self._load()
+
+    @staticmethod
+    def _today():
+        return datetime.now(CN_TZ).strftime('%Y-%m-%d')
+
+    def _load(self):
+        try:
+            with open(self.filename, 'r') as f:
+                data = json.load(f)
+            if data.get('date') == self.date and isinstance(data.get('accounts'), dict):
+                self.accounts = data['accounts']
+                self.capped = set(data.get('capped') or [])
+                total = sum(len(v) for v in self.accounts.values())
+                logger.info(f"从 {self.filename} 加载今日签到台账，共 {total} 条记录")
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        except Exception as e:
+            logger.warning(f"读取签到台账失败: {e}")
+
+    def _roll_date(self):
+        today = self._today()
+        if today != self.date:
+            self.date = today
+            self.accounts = {}
+            self.capped = set()
+
+    def is_signed(self, bduss, fid) -> bool:
+        if not self.enable:
+            return False
+        with self._lock:
+            self._roll_date()
+            return str(fid) in self.accounts.get(_account_key(bduss), {})
+
+    def count(self, bduss) -> int:
+        """今日已记录的签到成功/已签到贴吧数"""
+        if not self.enable:
+            return 0
+        with self._lock:
+            self._roll_date()
+            return len(self.accounts.get(_account_key(bduss), {}))
+
+    def is_capped(self, bduss) -> bool:
+        if not self.enable:
+            return False
+        with self._lock:
+            self._roll_date()
+            return _account_key(bduss) in self.capped
+
+    def mark_capped(self, bduss):
+        """记录该账号今日已达签到上限，同一天重跑时不再发出签到请求"""
+        if not self.enable:
+            return
+        with self._lock:
+            self._roll_date()
+            self.capped.add(_account_key(bduss))
+            self._dirty += 1
+
+    def record(self, bduss, fid, jr):
+        """仅记录签到成功/已签到的结果"""
+        if not self.enable or not isinstance(jr, dict) or not _is_sign_ok(jr):
+            return
+        with self._lock:
+            self._roll_date()
+            self.accounts.setdefault(_account_key(bduss), {})[str(fid)] = str(jr.get('error_code', '0'))
+            self._dirty += 1
+            need_flush = self._dirty >= self.FLUSH_EVERY
+        if need_flush:
+            self.flush()
+
+    def flush(self):
+        """原子写入台账文件"""
+        if not self.enable:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = json.dumps({'date': self.date, 'accounts': self.accounts, 'capped': sorted(self.capped)},
+                                 separators=(',', ':'))
+            self._dirty = 0
+        tmp = f"{self.filename}.tmp"
+        try:
+            with open(tmp, 'w') as f:
+                f.write(payload)
+            os.replace(tmp, self.filename)
+        except Exception as e:
+            logger.warning(f"保存签到台账失败: {e}")
+
+sign_ledger = SignLedger(SIGN_LEDGER_FILE, SIGN_LEDGER_ENABLE)
+
+# -----------------------------
+# 签到调度（每日上限 + 优先级）
+# -----------------------------
+SIGN_PRIORITY  = ENV.get('SIGN_PRIORITY', 'level').strip().lower()   # level：等级优先 / exp：经验优先 / none：原顺序
+SIGN_DAILY_CAP = int(ENV.get('SIGN_DAILY_CAP', '0') or 0)            # 本地每日上限，0 表示只依据 1107 判定
+DAILY_CAP_CODE = '1107'                                               # 今日已签到数量达上限
+
+def _forum_int(forum, key):
+    try:
+        return int(forum.get(key) or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def sign_priority(forum):
+    """签到优先级排序键（越小越先签）：按 SIGN_PRIORITY 取等级/经验的相反数"""
+    if SIGN_PRIORITY == 'exp':
+        return (-_forum_int(forum, 'cur_score'),)
+    if SIGN_PRIORITY == 'level':
+        return (-_forum_int(forum, 'level_id'), -_forum_int(forum, 'cur_score'))
+    return ()
+
+class SignScheduler:
+    """
+    按账号跟踪每日签到上限：收到 1107（或本地计数达到 SIGN_DAILY_CAP）后，
+    该账号不再发出签到请求，剩余贴吧记为跳过
+    """
+    def __init__(self, daily_cap=0):
+        self.daily_cap = daily_cap
+        self._accounts = {}   # 账号标识 -> {'capped', 'signed', 'skipped'}
+        self._lock = threading.Lock()
+
+    def _state(self, bduss):
+        key = _account_key(bduss)
+        st = self._accounts.get(key)
+        if st is None:
+            st = self._accounts[key] = {'capped': sign_ledger.is_capped(bduss),
+                                        'signed': sign_ledger.count(bduss), 'skipped': []}
+            if st['capped']:
+                logger.info("台账显示该账号今日已达签到上限，本次不再签到")
+        return st
+
+    def order(self, forums):
+        """按优先级排序（稳定排序，同优先级保持关注列表顺序）"""
+        return forums if SIGN_PRIORITY == 'none' else sorted(forums, key=sign_priority)
+
+    def allow(self, bduss, forum) -> bool:
+        """发请求前调用：已达上限时记录跳过并返回 False"""
+        with self._lock:
+            st = self._state(bduss)
+            if st['capped']:
+                st['skipped'].append(forum['name'])
+                return False
+            return True
+
+    def record(self, bduss, jr):
+        """根据签到结果更新计数；达到上限时标记并写入台账"""
+        code = str(jr.get('error_code', '')) if isinstance(jr, dict) else ''
+        with self._lock:
+            st = self._state(bduss)
+            if code == DAILY_CAP_CODE:
+                hit = not st['capped']
+                st['capped'] = True
+            elif _is_sign_ok(jr):
+                st['signed'] += 1
+                hit = bool(self.daily_cap) and st['signed'] >= self.daily_cap and not st['capped']
+                st['capped'] = st['capped'] or hit
+            else:
+                hit = False
+        if hit:
+            logger.warning(f"今日签到数量已达上限（已签 {st['signed']} 个），停止该账号的签到请求")
+            sign_ledger.mark_capped(bduss)
+
+    def is_capped(self, bduss) -> bool:
+        with self._lock:
+            return self._state(bduss)['capped']
+
+    @staticmethod
+    def skipped_result():
+        return {'error_code': DAILY_CAP_CODE, 'msg': 'daily cap reached, skipped'}
+
+    def skipped(self, bduss):
+        with self._lock:
+            return list(self._state(bduss)['skipped'])
+
+sign_scheduler = SignScheduler(SIGN_DAILY_CAP)
+
+# -----------------------------
+# 3.0 异步签到（aiohttp，按账号限制并发）
+# -----------------------------
+class AioSessionPool:
+    """按 (线路, 主机) 复用 aiohttp.ClientSession；SOCKS 代理依赖可选的 aiohttp_socks"""
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._sessions = {}
+        self._socks_warning_logged = False
+        self.hits = 0
+        self.misses = 0
+        self.conn_created = 0
+        self.conn_reused = 0
+
+    def _trace_config(self):
+        trace = aiohttp.TraceConfig()
+
+        async def _on_create(session, ctx, params):
+            self.conn_created += 1
+
+        async def _on_reuse(session, ctx, params):
+            self.conn_reused += 1
+
+        trace.on_connection_create_end.append(_on_create)
+        trace.on_connection_reuseconn.append(_on_reuse)
+        return trace
+
+    def get(self, proxy, url):
+        """返回 (session, 请求级 proxy 参数)；线路不可用时返回 (None, None)"""
+        from urllib.parse import urlsplit
+        key = (proxy, urlsplit(url).netloc)
+        if key in self._sessions:
+            self.hits += 1
+            return self._sessions[key]
+        req_proxy = None
+        if proxy and proxy.startswith('socks'):
+            try:
+                from aiohttp_socks import ProxyConnector
+            except ImportError:
+                if not self._socks_warning_logged:
+                    logger.warning("未安装 aiohttp_socks 库 (pip install aiohttp_socks)，异步签到将跳过 SOCKS 代理线路")
+                    self._socks_warning_logged = True
+                return None, None
+            # aiohttp_socks 不识别 socks5h，改用 rdns 实现远端解析
+            rdns = proxy.startswith('socks5h://')
+            connector = ProxyConnector.from_url(proxy.replace('socks5h://', 'socks5://', 1), rdns=rdns,
+                                                limit=self.maxsize)
+        else:
+            connector = aiohttp.TCPConnector(limit=self.maxsize)
+            req_proxy = proxy
+        session = aiohttp.ClientSession(
+            connector=connector,
+            cookie_jar=aiohttp.DummyCookieJar(),  # 不在会话间共享 Cookie，避免账号串号
+            timeout=aiohttp.ClientTimeout(total=10),
+            trace_configs=[self._trace_config(), aio_metrics_trace(proxy)],
+        )
+        self.misses += 1
+        self._sessions[key] = (session, req_proxy)
+        return session, req_proxy
+
+    def log_stats(self):
+        logger.info(
+            f"[transport] aiohttp 连接池：命中 {self.hits} 次，新建 {self.misses} 个；"
+            f"新建连接 {self.conn_created} 个，复用 {self.conn_reused} 次"
+        )
+
+    async def close(self):
+        for session, _ in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+
+aio_sessions = AioSessionPool(POOL_MAXSIZE)
+
+_aio_route_errors_cache = None
+
+def aio_route_errors():
+    """
+    视为线路失败的异常类型：SOCKS 握手失败时 aiohttp_socks 抛出的是 python_socks 异常或
+    IncompleteReadError（不属于 ClientError），同样按线路失败处理（首次调用时才导入 aiohttp）
+    """
+    global _aio_route_errors_cache
+    if _aio_route_errors_cache is None:
+        errors = (aiohttp.ClientError, asyncio.TimeoutError, OSError, EOFError)
+        try:
+            from python_socks import ProxyError as _SocksProxyError
+            errors += (_SocksProxyError,)
+        except ImportError:
+            pass
+        _aio_route_errors_cache = errors
+    return _aio_route_errors_cache
+
+async def _aio_post_with_routes(bduss, endpoint, url, encoded_data, headers):
+    """
+    按线路链 + 统一重试策略发送异步 POST（开启 HEDGE_ENABLE 时跨线路对冲），
+    返回响应文本；全部失败返回 None。仅用于幂等接口（签到/批量签到）
+    """
+    chain = _build_route_chain(bduss, endpoint, fetch=False)
+    total_paths = len(chain)
+    state, token = RETRY_POLICY.start(endpoint)
+
+    async def _on_route(path_idx, p):
+        """在一条线路上尝试一次，失败返回 None"""
+        proxy_info_for_log = proxy_manager._sanitize_proxy_url(p)
+        session, req_proxy = aio_sessions.get(p, url)
+        if session is None:
+            logger.warning(f"线路 ({path_idx}/{total_paths}) 不可用: {proxy_info_for_log}，切换下一线路")
+            return None
+        logger.info(f"请求尝试 ({path_idx}/{total_paths}) 使用: {proxy_info_for_log}")
+        t0 = time.monotonic()
+        try:
+            async with session.post(url, headers=headers, data=encoded_data, proxy=req_proxy,
+                                    timeout=aiohttp.ClientTimeout(total=state.timeout(10)),
+                                    trace_request_ctx={'endpoint': endpoint, 'account': bduss}) as resp:
+                resp.raise_for_status()
+                text = await resp.text()
+        except aio_route_errors() as e:
+            proxy_manager.report(p, False)
+            route_memory.failure(bduss, endpoint, p)
+            logger.warning(f"{endpoint} 请求失败(第{state.attempt+1}次): {type(e).__name__}: {e}")  # 不用 repr，避免把请求头中的 Cookie 打进日志
+            return None
+        elapsed = time.monotonic() - t0
+        proxy_manager.report(p, True, elapsed)
+        route_memory.success(bduss, endpoint, p)
+        latency_tracker.observe(endpoint, elapsed)
+        return text
+
+    try:
+        while True:
+            if HEDGE_ENABLE and total_paths > 1:
+                # 签到是幂等的（重复签到返回 160002），可安全地跨线路对冲
+                text = await hedged_race(
+                    [lambda i=i, p=p: _on_route(i, p) for i, p in enumerate(chain, start=1)], endpoint
+                )
+            else:
+                path_idx = min(state.attempt, total_paths - 1)
+                text = await _on_route(path_idx + 1, chain[path_idx])
+            if text is not None:
+                return text
+            if not await state.backoff_async():
+                return None
+    finally:
+        RETRY_POLICY.finish(token)
+
+async def client_sign_async(bduss, tbs, fid, kw, retry_stale=True):
+    """client_sign 的异步版本：相同参数/签名、线路与重试策略，结果判定与同步版一致；可选跨线路对冲"""
+    logger.info(f"签到贴吧: {kw}")
+
+    encoded_data = SIGN_BUILDER.build(BDUSS=bduss, fid=fid, kw=kw, tbs=tbs, timestamp=str(int(time.time())))
+    headers = get_headers()
+    headers[COOKIE] = f"{BDUSS}={bduss}"
+
+    text = await _aio_post_with_routes(bduss, 'sign', SIGN_URL, encoded_data, headers)
+    if text is None:
+        # 所有尝试均失败
+        return {'error_code': -1, 'msg': 'sign failed after retries'}
+    try:
+        jr = json.loads(text)
+    except JSONDecodeError:
+        return _handle_sign_non_json(kw, text)
+    pacer.feedback(bduss, 'sign', jr)
+    metrics.code('sign', jr)
+    if retry_stale and _is_tbs_stale(jr):
+        fresh = await asyncio.to_thread(_refresh_tbs, bduss, tbs)
+        if fresh:
+            return await client_sign_async(bduss, fresh, fid, kw, retry_stale=False)
+    return _handle_sign_result(jr, kw, bduss)
+
+# -----------------------------
+# 3.0.1 一键批量签到（msign，一次请求签到多个贴吧）
+# -----------------------------
+MSIGN_URL        = "http://c.tieba.baidu.com/c/c/forum/msign"        # 一键签到接口
+MSIGN_ENABLE     = ENV.get('MSIGN_ENABLE', 'false').lower() == 'true'
+MSIGN_BATCH_SIZE = max(1, int(ENV.get('MSIGN_BATCH_SIZE', '50')))
+MSIGN_MIN_LEVEL  = int(ENV.get('MSIGN_MIN_LEVEL', '7'))             # 客户端一键签到通常只对该等级以上的吧生效
+
+def _msign_eligible(forum) -> bool:
+    try:
+        return int(forum.get('level_id') or 0) >= MSIGN_MIN_LEVEL
+    except (TypeError, ValueError):
+        return False
+
+def _parse_msign_response(jr):
+    """
+    把批量签到返回拆成与单吧签到相同结构的结果：{fid: {'error_code', 'error_msg', 'user_info'?}}
+    典型返回：{"info": [{"forum_id", "forum_name", "signed", "cur_score", "sign_day_count",
+                         "error": {"err_no", "usermsg"}}], "error": {"errno", "usermsg"}, "error_code"}
+    """
+    results = {}
+    info = jr.get('info') if isinstance(jr, dict) else None
+    if not isinstance(info, list):
+        return results
+    for item in info:
+        if not isinstance(item, dict):
+            continue
+        fid = str(item.get('forum_id') or '').strip()
+        if not fid:
+            continue
+        err = item.get('error') if isinstance(item.get('error'), dict) else {}
+        code = str(err.get('err_no', '0') or '0')
+        rec = {'error_code': code, 'error_msg': err.get('usermsg') or err.get('errmsg') or ''}
+        if code == '0' and str(item.get('signed', '1')) == '1':
+            rec['user_info'] = {
+                'cont_sign_num': item.get('sign_day_count'),
+                'sign_bonus_point': item.get('cur_score'),
+            }
+        results[fid] = rec
+    return results
+
+async def sign_forums_batch_async(bduss, tbs, forums):
+    """
+    对满足条件的贴吧分批调用一键签到，返回 {fid: 结果}；
+    只包含批量接口明确处理过的贴吧，其余由调用方回退到单吧签到
+    """
+    eligible = [f for f in forums if _msign_eligible(f)]
+    if not eligible:
+        return {}
+    logger.info(f"一键批量签到：{len(eligible)} 个贴吧，每批 {MSIGN_BATCH_SIZE} 个")
+    headers = get_headers()
+    headers[COOKIE] = f"{BDUSS}={bduss}"
+    names = {f['id']: f['name'] for f in eligible}
+    handled = {}
+    for i in range(0, len(eligible), MSIGN_BATCH_SIZE):
+        batch = eligible[i:i + MSIGN_BATCH_SIZE]
+        if sign_scheduler.is_capped(bduss) or not await breakers.wait(bduss, 'sign'):
+            break
+        try:
+            await pacer.acquire(bduss, 'msign')
+            data = MSIGN_BUILDER.build(
+                BDUSS=bduss,
+                forum_ids=','.join(str(f['id']) for f in batch),
+                tbs=tbs,
+                timestamp=str(int(time.time())),
+            )
+            text = await _aio_post_with_routes(bduss, 'msign', MSIGN_URL, data, headers)
+            if text is None:
+                logger.warning(f"批量签到第 {i // MSIGN_BATCH_SIZE + 1} 批请求失败，回退单吧签到")
+                continue
+            try:
+                jr = json.loads(text)
+            except JSONDecodeError:
+                logger.warning("批量签到返回非 JSON，回退单吧签到")
+                continue
+            pacer.feedback(bduss, 'msign', jr)
+            metrics.code('msign', jr)
+            if check_wind_control(jr, bduss, 'sign'):
+                break
+            if _is_tbs_stale(jr):
+                # 本批回退单吧签到，后续批次使用刷新后的 tbs
+                tbs = await asyncio.to_thread(_refresh_tbs, bduss, tbs) or tbs
+                continue
+            results = _parse_msign_response(jr)
+            for fid, rec in results.items():
+                if fid in names:
+                    handled[fid] = _handle_sign_result(rec, names[fid], bduss)
+                    sign_scheduler.record(bduss, rec)
+            if not results:
+                top = jr.get('error') if isinstance(jr.get('error'), dict) else {}
+                logger.warning(f"批量签到未返回逐吧结果：code={jr.get('error_code')} msg={top.get('usermsg') or jr.get('error_msg') or ''}")
+        finally:
+            # 探测批次请求失败/非 JSON 时交给下一批重新探测
+            breakers.release(bduss, 'sign')
+    ok_count = sum(1 for r in handled.values() if _is_sign_ok(r))
+    logger.info(f"一键批量签到完成：成功 {ok_count} 个，其余 {len(forums) - ok_count} 个走单吧签到")
+    return handled
+
+async def _sign_one_async(bduss, tbs, f, sem):
+    """签到单个贴吧并把结果写入签到报告，返回签到结果；意外异常记为该贴吧失败，不影响其他贴吧"""
+    try:
+        res, seconds = await _sign_one_attempts(bduss, tbs, f, sem)
+    except Exception as e:
+        logger.error(f"签到贴吧 {f['name']} 异常：{type(e).__name__}: {e}")
+        res, seconds = {'error_code': -1, 'msg': f'{type(e).__name__}: {e}'}, None
+    sign_report.record(bduss, f, res, seconds)
+    return res
+
+async def _sign_one_attempts(bduss, tbs, f, sem):
+    """
+    熔断时挂起等待、限速后签到、写台账；触发风控的结果在冷却后重签；已达每日上限时直接跳过
+    返回 (结果, 最后一次签到请求耗时秒数)，未发请求时耗时为 None
+    """
+    seconds = None
+    while True:
+        if not sign_scheduler.allow(bduss, f):
+            return sign_scheduler.skipped_result(), seconds
+        # 熔断时在此挂起（仅影响本账号），冷却后重试该贴吧
+        if not await breakers.wait(bduss, 'sign'):
+            logger.warning(f"签到熔断次数过多，跳过贴吧: {f['name']}")
+            return {'error_code': breakers.get(bduss, 'sign').last_code, 'msg': 'circuit open'}, seconds
+        try:
+            async with sem:
+                # 排队等并发名额/限速期间可能已达上限，限速前和发请求前各确认一次
+                if not sign_scheduler.allow(bduss, f):
+                    return sign_scheduler.skipped_result(), seconds
+                await pacer.acquire(bduss, 'sign')
+                if not sign_scheduler.allow(bduss, f):
+                    return sign_scheduler.skipped_result(), seconds
+                # 其他贴吧刷新过 tbs 时直接使用新值
+                t0 = time.monotonic()
+                res = await client_sign_async(bduss, tbs_cache.peek(bduss) or tbs, f['id'], f['name'])
+                seconds = time.monotonic() - t0
+        finally:
+            # 作为探测请求却没有得到可判定的返回（-1/非 JSON/跳过）时，交给下一个请求重新探测
+            breakers.release(bduss, 'sign')
+        if str(res.get('error_code', '')) in WIND_CONTROL_CODES:
+            continue
+        sign_scheduler.record(bduss, res)
+        sign_ledger.record(bduss, f['id'], res)
+        return res, seconds
 
-    # 所有线路均失败
-    return {'error_code': -1, 'msg': 'sign failed after per-path retries'}
+async def sign_forums_async(bduss, tbs, favorites):
+    """并发签到一个账号的全部贴吧，同时进行的请求数由 SIGN_CONCURRENCY 限制"""
+    sem = asyncio.Semaphore(SIGN_CONCURRENCY)
+
+    pending = []
+    for f in favorites:
+        if sign_ledger.is_signed(bduss, f['id']):
+            sign_report.record(bduss, f, None)
+        else:
+            pending.append(f)
+    pending = sign_scheduler.order(pending)
+    if len(pending) < len(favorites):
+        logger.info(f"台账显示今日已签到 {len(favorites) - len(pending)} 个贴吧，本次跳过，剩余 {len(pending)} 个")
+
+    async def _one(f):
+        return await _sign_one_async(bduss, tbs, f, sem)
+
+    try:
+        batch_results = {}
+        if MSIGN_ENABLE and pending:
+            batch_results = await sign_forums_batch_async(bduss, tbs, pending)
+            for fid, res in batch_results.items():
+                sign_ledger.record(bduss, fid, res)
+
+        async def _dispatch(f):
+            # 批量签到已成功的直接采用，其余（未处理/失败）回退单吧签到
+            res = batch_results.get(f['id'])
+            if res is not None and _is_sign_ok(res):
+                sign_report.record(bduss, f, res)
+                return res
+            return await _one(f)
+
+        return await asyncio.gather(*(_dispatch(f) for f in pending))
+    finally:
+        sign_ledger.flush()
+
+# -----------------------------
+# 3.0.2 边拉取关注列表边签到（流水线）
+# -----------------------------
+FAVORITES_QUEUE_SIZE = max(1, int(ENV.get('FAVORITES_QUEUE_SIZE', str(LIKE_PAGE_SIZE)) or 1))  # 待签到队列容量
+_STREAM_END = object()
+
+async def produce_favorites(bduss, queue, consumers):
+    """
+    生产者：在线程中分页拉取关注列表（get_favorite_fast），每凑齐一页就把其中的贴吧放入有界优先队列
+    （条目为 (0, 签到优先级, 序号, 贴吧)，队列中已有的贴吧按 SIGN_PRIORITY 先后取出）；
+    队列满时拉取线程等待（背压）。结束（含失败）时放入 consumers 个排在最后的结束标记，返回完整列表
+    """
+    loop = asyncio.get_running_loop()
+    closed = threading.Event()
+    seq = itertools.count()
+
+    def _emit(obj):
+        if not closed.is_set():  # 已取消时只把剩余页拉完，不再入队
+            item = (0, sign_priority(obj), next(seq), obj)
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    try:
+        return await asyncio.to_thread(get_favorite_fast, bduss, _emit)
+    finally:
+        closed.set()
+        for _ in range(consumers):
+            await queue.put((1, (), next(seq), _STREAM_END))
+
+async def sign_forums_streaming(bduss, tbs):
+    """
+    无关注列表缓存时使用：拉取与签到重叠进行，首页返回即开始签到；
+    SIGN_CONCURRENCY 个签到协程从有界优先队列取贴吧，台账已签到的跳过。返回 (favorites, results)
+    """
+    queue = asyncio.PriorityQueue(FAVORITES_QUEUE_SIZE)
+    sem = asyncio.Semaphore(SIGN_CONCURRENCY)
+    producer = asyncio.create_task(produce_favorites(bduss, queue, SIGN_CONCURRENCY))
+    results = []
+    skipped = 0
+
+    async def _worker():
+        nonlocal skipped
+        while (f := (await queue.get())[-1]) is not _STREAM_END:
+            if sign_ledger.is_signed(bduss, f['id']):
+                sign_report.record(bduss, f, None)
+                skipped += 1
+                continue
+            results.append(await _sign_one_async(bduss, tbs, f, sem))
+
+    try:
+        await asyncio.gather(*(_worker() for _ in range(SIGN_CONCURRENCY)))
+        favorites = await producer
+    finally:
+        if not producer.done():
+            # 被取消时停止入队并取走队列中剩余的贴吧，让拉取线程尽快结束
+            producer.cancel()
+            while not producer.done():
+                try:
+                    await asyncio.wait_for(queue.get(), 0.1)
+                except asyncio.TimeoutError:
+                    pass
+        sign_ledger.flush()
+    if skipped:
+        logger.info(f"台账显示今日已签到 {skipped} 个贴吧，本次跳过")
+    return favorites, results
 
 # -----------------------------
 # 3.1 客户端回帖 (HTTP 版)
 # -----------------------------
-def client_reply(bduss: str, fid: str, kw: str, tid: int, content: str, tbs: str = None):
+def client_reply(bduss: str, fid: str, kw: str, tid: int, content: str, tbs: str = None, retry_stale=True):
     """
     使用 Tieba 手机 HTTP 接口回帖：
       POST https://c.tieba.baidu.com/c/c/post/add
     复用现有 SIGN_DATA / encodeData / ProxyManager，绕过 aiotieba.add_post。
-    每条线路最多重试3次，最终会退到直连重试。
+    按统一重试策略退避，每次失败切换到下一条线路，最终会退到直连重试。
+    tbs 失效时刷新后重发一次。
     """
     logger.info(f"HTTP 回帖开始: kw={kw}, tid={tid}")
 
     # 构造参数（与客户端风格保持一致）
-    data = {
-        **SIGN_DATA,
-        "BDUSS": bduss,
-        "fid": str(fid),
-        "kw": kw,
-        "tid": str(tid),
-        "content": content,
-        "timestamp": str(int(time.time())),
-    }
-    if tbs:
-        data["tbs"] = tbs
-
-    encoded_data = encodeData(dict(data))
+    encoded_data = REPLY_BUILDER.build(
+        BDUSS=bduss,
+        fid=str(fid),
+        kw=kw,
+        tid=str(tid),
+        content=content,
+        timestamp=str(int(time.time())),
+        tbs=tbs or None,
+    )
     headers = get_headers(is_mobile=True)
     cookies = {BDUSS: bduss}
 
-    # 三段式线路：首选代理 -> 第一条免费代理 -> 直连
-    chain = []
-    if PROXY_ENABLE and SOCKS_PROXY:
-        chain.append(SOCKS_PROXY)
-
-    backup_proxy = None
-    try:
-        proxy_list_full = proxy_manager.get_proxy_list()  # [user_proxy?, backup..., None]
-        for p in proxy_list_full:
-            if p and p != SOCKS_PROXY:
-                backup_proxy = p
-                break
-    except Exception:
-        backup_proxy = None
-    if backup_proxy:
-        chain.append(backup_proxy)
-
-    chain.append(None)  # 直连
+    chain = _build_route_chain(bduss, 'reply')
     total_paths = len(chain)
-
-    for path_idx, p in enumerate(chain, start=1):
-        proxy_info_for_log = proxy_manager._sanitize_proxy_url(p)
-        logger.info(f"回复请求尝试 ({path_idx}/{total_paths}) 使用: {proxy_info_for_log}")
-        proxies = {'http': p, 'https': p} if p else None
-
-        # 每条线路内部重试 3 次
-        for inner_try in range(1, 4):
+    stale = False
+    # 限速令牌只在首次发送前获取一次，重试之间只按重试策略退避
+    pacer.acquire_sync(bduss, 'reply')
+    state, token = RETRY_POLICY.start('reply')
+    try:
+        while True:
+            path_idx = min(state.attempt, total_paths - 1)
+            p = chain[path_idx]
+            proxy_info_for_log = proxy_manager._sanitize_proxy_url(p)
+            logger.info(f"回复请求尝试 ({path_idx+1}/{total_paths}) 使用: {proxy_info_for_log}")
             try:
-                resp = s.post(
-                    REPLY_URL.replace("http://", "https://"),
+                t0 = time.monotonic()
+                resp = transport.request(
+                    'POST',
+                    REPLY_URL,
+                    proxy=p,
+                    endpoint='reply',
+                    account=bduss,
                     headers=headers,
                     cookies=cookies,
                     data=encoded_data,
-                    proxies=proxies,
-                    timeout=10
+                    timeout=state.timeout(10)
                 )
                 resp.raise_for_status()
+                proxy_manager.report(p, True, time.monotonic() - t0)
+                route_memory.success(bduss, 'reply', p)
                 proxy_manager.test_and_log_success(p)
 
                 try:
@@ -947,13 +3199,21 @@ def client_reply(bduss: str, fid: str, kw: str, tid: int, content: str, tbs: str
                     logger.warning(
                         f"[reply_forum] 非JSON返回，视为失败。raw={resp.text[:200]!r}"
                     )
-                    break  # 当前线路的本次尝试失败，继续 inner 重试
+                    if not state.backoff():
+                        break
+                    continue
 
                 code = str(jr.get("error_code", ""))
                 msg = jr.get("error_msg") or jr.get("msg") or ""
                 logger.info(f"[reply_forum] code={code} msg={msg}")
+                pacer.feedback(bduss, 'reply', jr)
+                metrics.code('reply', jr)
+
+                if retry_stale and tbs and _is_tbs_stale(jr):
+                    stale = True
+                    break
 
-                if check_wind_control(jr):
+                if check_wind_control(jr, bduss, 'reply'):
                     return False, None
 
                 # 视 0 / 160002 / 1101 为成功（已回复之类也不算失败）
@@ -972,11 +3232,20 @@ def client_reply(bduss: str, fid: str, kw: str, tid: int, content: str, tbs: str
                 return False, None
 
             except requests.exceptions.RequestException as e:
-                logger.warning(f"回帖请求失败(第{inner_try}/3): {e}")
-                if inner_try < 3:
-                    time.sleep(random.uniform(3.0, 5.0))
-                else:
-                    logger.warning("该线路3次均失败，切换下一线路")
+                proxy_manager.report(p, False)
+                route_memory.failure(bduss, 'reply', p)
+                logger.warning(f"回帖请求失败(第{state.attempt+1}次): {e}")
+                if not state.backoff():
+                    break
+    finally:
+        RETRY_POLICY.finish(token)
+
+    if stale:
+        fresh = _refresh_tbs(bduss, tbs)
+        if fresh:
+            return client_reply(bduss, fid, kw, tid, content, fresh, retry_stale=False)
+        logger.warning("HTTP 回帖 tbs 失效且刷新失败")
+        return False, None
 
     logger.error("HTTP 回帖所有线路均失败")
     return False, None
@@ -984,11 +3253,28 @@ def client_reply(bduss: str, fid: str, kw: str, tid: int, content: str, tbs: str
 # -----------------------------
 # 4. 吧主任务：回复+删除 & 置顶/取消置顶（AIO）
 # -----------------------------
+async def aiotieba_call(client: "aiotieba.Client", endpoint, coro):
+    """
+    等待一次 aiotieba 调用并记录请求指标（aiotieba 自带网络层，无法挂 TraceConfig）；
+    线路按 aiotieba 的代理配置（SOCKS_PROXY）计，返回值带 err 时按失败计
+    """
+    proxy = SOCKS_PROXY if PROXY_ENABLE and SOCKS_PROXY else None
+    account = getattr(getattr(client, 'account', None), 'BDUSS', None)
+    t0 = time.monotonic()
+    try:
+        res = await coro
+    except Exception as e:
+        metrics.observe(endpoint, proxy, account, time.monotonic() - t0, outcome=type(e).__name__)
+        raise
+    err = getattr(res, 'err', None)
+    metrics.observe(endpoint, proxy, account, time.monotonic() - t0, outcome=type(err).__name__ if err else 'ok')
+    return res
+
 async def simulate_view_post(client: "aiotieba.Client", fid, tid):
     """模拟浏览帖子，为后续操作预热（AIO）"""
     logger.info(f"模拟浏览帖子: tid={tid}")
     try:
-        _ = await client.get_posts(tid, pn=1)
+        _ = await aiotieba_call(client, 'aiotieba.get_posts', client.get_posts(tid, pn=1))
         logger.info("模拟浏览完成")
         return True
     except Exception as e:
@@ -1009,7 +3295,7 @@ async def moderator_task(client: "aiotieba.Client", bar_name, post_id, bduss, st
         return success
 
     async def rnd_sleep():
-        await asyncio.sleep(random.uniform(3, 8))
+        await pacer.acquire(bduss, 'moderator')
     
     # 1. 模拟浏览 (预热)
     await simulate_view_post(client, fid, int(post_id))
@@ -1021,7 +3307,21 @@ async def moderator_task(client: "aiotieba.Client", bar_name, post_id, bduss, st
         logger.info(f"回复内容: {content}")
         try:
             kw = bar_name.rstrip("吧")
-            ok, pid = client_reply(bduss, fid, kw, int(post_id), content, tbs)
+            ok, pid = False, None
+            # 触发风控时回帖熔断，冷却结束后重新回帖，直到成功、非风控失败或熔断次数过多
+            while True:
+                if not await breakers.wait(bduss, 'reply'):
+                    logger.warning("回帖熔断次数过多，跳过回帖")
+                    success['reply_skipped'] = True
+                    break
+                try:
+                    ok, pid = await asyncio.to_thread(client_reply, bduss, fid, kw, int(post_id), content,
+                                                      tbs_cache.peek(bduss) or tbs)
+                finally:
+                    breakers.release(bduss, 'reply')
+                if ok or breakers.get(bduss, 'reply').state != 'open':
+                    break
+                logger.info("回帖触发风控，冷却结束后重新回帖")
 
             if ok:
                 success['reply'] = True
@@ -1030,7 +3330,8 @@ async def moderator_task(client: "aiotieba.Client", bar_name, post_id, bduss, st
                 if DO_MODERATOR_DELETE and pid:
                     await rnd_sleep()
                     try:
-                        del_res = await client.del_post(int(fid), int(post_id), int(pid))
+                        del_res = await aiotieba_call(client, 'aiotieba.del_post',
+                                                      client.del_post(int(fid), int(post_id), int(pid)))
                         if del_res.err:
                             logger.info(f"删除回复失败: {del_res.err}")
                         else:
@@ -1042,7 +3343,7 @@ async def moderator_task(client: "aiotieba.Client", bar_name, post_id, bduss, st
                         logger.info("回帖成功，但接口未返回 pid 或 pid 无效，无法删除")
                     else:
                         logger.info("删除操作已关闭")
-            else:
+            elif not success.get('reply_skipped'):
                 logger.error("HTTP 回帖最终失败")
 
         except Exception as e:
@@ -1055,7 +3356,7 @@ async def moderator_task(client: "aiotieba.Client", bar_name, post_id, bduss, st
         try:
             await rnd_sleep()
             # aiotieba 的 top / untop，一般需要 STOKEN；无 STOKEN 时返回权限相关错误
-            top_res = await client.top(bar_name.rstrip("吧"), int(post_id))
+            top_res = await aiotieba_call(client, 'aiotieba.top', client.top(bar_name.rstrip("吧"), int(post_id)))
             if top_res.err:
                 if _is_permission_or_stoken_issue(top_res.err):
                     logger.warning(f"置顶失败（权限/STOKEN 可能不足）：{top_res.err}")
@@ -1065,7 +3366,7 @@ async def moderator_task(client: "aiotieba.Client", bar_name, post_id, bduss, st
                 success['top'] = True
                 logger.info("置顶成功")
             await rnd_sleep()
-            untop_res = await client.untop(bar_name.rstrip("吧"), int(post_id))
+            untop_res = await aiotieba_call(client, 'aiotieba.untop', client.untop(bar_name.rstrip("吧"), int(post_id)))
             if untop_res.err:
                 if _is_permission_or_stoken_issue(untop_res.err):
                     logger.warning(f"取消置顶失败（权限/STOKEN 可能不足）：{untop_res.err}")
@@ -1082,11 +3383,163 @@ async def moderator_task(client: "aiotieba.Client", bar_name, post_id, bduss, st
 # -----------------------------
 # 5. 邮件汇报函数
 # -----------------------------
-def send_email(sign_list, total_sign_time, task_status):
+REPORT_SLOWEST      = int(ENV.get('REPORT_SLOWEST', '10'))         # 邮件中列出的最慢贴吧数
+REPORT_MAX_FAILURES = int(ENV.get('REPORT_MAX_FAILURES', '50'))    # 邮件中逐条列出的失败贴吧上限
+REPORT_ATTACH       = ENV.get('REPORT_ATTACH', 'true').lower() == 'true'  # 是否附带完整签到清单（csv.gz）
+
+class SignReport:
     """
-    发送日报邮件，包含签到报告和吧主任务状态
+    流式签到报告：每个贴吧的结果只保留精简字段，逐行写入临时文件中的 gzip CSV（完整清单附件），
+    内存中只保留按账号的计数、最多 REPORT_MAX_FAILURES 条失败和 REPORT_SLOWEST 个最慢贴吧，
+    贴吧数量再多，内存占用和邮件正文大小也基本不变
+    """
+    STATUS_TEXT = {'signed': '签到成功', 'already': '已签到', 'ledger': '台账已签',
+                   'capped': '达上限跳过', 'failed': '失败'}
+
+    def __init__(self, slowest=10, max_failures=50):
+        self.slowest = slowest
+        self.max_failures = max_failures
+        self.accounts = {}      # BDUSS -> 序号（按原值查找，记录时无需再算摘要）
+        self.counts = {}        # 序号 -> {状态: 数量}
+        self.failures = []      # [(序号, 贴吧, 错误码, 信息)]
+        self.failure_total = 0
+        self._slow = []         # 小根堆 [(耗时, 序号, 贴吧)]
+        self.sign_seconds = 0.0
+        self._lock = threading.Lock()
+        self._file = None
+        self._text = None
+        self._csv = None
+
+    def account(self, idx, bduss):
+        with self._lock:
+            self.accounts[bduss] = idx
+            self.counts.setdefault(idx, {})
+
+    @staticmethod
+    def classify(res):
+        if res is None:
+            return 'ledger'
+        code = str(res.get('error_code', ''))
+        if code == DAILY_CAP_CODE:
+            return 'capped'
+        if not _is_sign_ok(res):
+            return 'failed'
+        return 'already' if code in ('160002', '1101') else 'signed'
+
+    def _writer(self):
+        if self._csv is None:
+            import csv, gzip, io, tempfile
+            self._file = tempfile.TemporaryFile()
+            gz = gzip.GzipFile(fileobj=self._file, mode='wb', compresslevel=6)
+            self._text = io.TextIOWrapper(gz, encoding='utf-8-sig', newline='')
+            self._csv = csv.writer(self._text)
+            self._csv.writerow(['账号', 'fid', '贴吧', '状态', '错误码', '耗时(秒)', '信息'])
+        return self._csv
+
+    def record(self, bduss, forum, res, seconds=None):
+        """记录一个贴吧的最终结果；res 为 None 表示台账显示今日已签到、本次未请求"""
+        status = self.classify(res)
+        code = '' if res is None else str(res.get('error_code', ''))
+        msg = '' if res is None else str(res.get('error_msg') or res.get('msg') or '')
+        with self._lock:
+            idx = self.accounts.get(bduss, 0)
+            counts = self.counts.setdefault(idx, {})
+            counts[status] = counts.get(status, 0) + 1
+            if status == 'failed':
+                self.failure_total += 1
+                if len(self.failures) < self.max_failures:
+                    self.failures.append((idx, forum['name'], code, msg))
+            if seconds is not None:
+                self.sign_seconds += seconds
+                item = (seconds, idx, forum['name'])
+                if len(self._slow) < self.slowest:
+                    heapq.heappush(self._slow, item)
+                elif self.slowest and item > self._slow[0]:
+                    heapq.heapreplace(self._slow, item)
+            if REPORT_ATTACH:
+                self._writer().writerow([idx, forum['id'], forum['name'], self.STATUS_TEXT[status], code,
+                                         '' if seconds is None else f"{seconds:.3f}", msg])
+
+    def total(self, idx=None):
+        rows = [self.counts.get(idx, {})] if idx is not None else self.counts.values()
+        return sum(sum(c.values()) for c in rows)
+
+    def slowest_forums(self):
+        return sorted(self._slow, reverse=True)
+
+    def attachment(self):
+        """结束写入并返回完整清单的 gzip 字节；未记录任何贴吧或未开启附件时返回 None"""
+        with self._lock:
+            if self._csv is None:
+                return None
+            self._csv = None
+            self._text.close()   # 写出缓冲并关闭 GzipFile（写入 gzip 尾部，不关闭底层临时文件）
+            self._file.seek(0)
+            data = self._file.read()
+            self._file.close()
+            return data
+
+    def state(self):
+        """可 JSON 序列化的汇总状态（分片结果文件使用，不含完整清单）"""
+        with self._lock:
+            return {'counts': {str(k): v for k, v in self.counts.items()}, 'failures': self.failures,
+                    'failure_total': self.failure_total, 'slow': self._slow, 'sign_seconds': self.sign_seconds}
+
+    def absorb(self, state, attachment=None):
+        """合并另一个分片的汇总状态和完整清单（csv.gz 字节）"""
+        import csv, gzip, io
+        with self._lock:
+            for k, c in state.get('counts', {}).items():
+                counts = self.counts.setdefault(int(k), {})
+                for status, n in c.items():
+                    counts[status] = counts.get(status, 0) + n
+            self.failure_total += state.get('failure_total', 0)
+            room = self.max_failures - len(self.failures)
+            self.failures.extend(tuple(f) for f in state.get('failures', [])[:max(0, room)])
+            self.sign_seconds += state.get('sign_seconds', 0.0)
+            for item in state.get('slow', []):
+                item = tuple(item)
+                if len(self._slow) < self.slowest:
+                    heapq.heappush(self._slow, item)
+                elif self.slowest and item > self._slow[0]:
+                    heapq.heapreplace(self._slow, item)
+            if attachment and REPORT_ATTACH:
+                with io.TextIOWrapper(gzip.GzipFile(fileobj=io.BytesIO(attachment)), encoding='utf-8-sig',
+                                      newline='') as f:
+                    rows = csv.reader(f)
+                    next(rows, None)  # 表头
+                    writer = self._writer()
+                    for row in rows:
+                        writer.writerow(row)
+
+    def render_summary(self, out):
+        """把汇总视图（按账号计数、失败、最慢贴吧）写入 out（文本流）"""
+        w = out.write
+        w("<h3>签到汇总：</h3>")
+        for idx in sorted(self.counts):
+            c = self.counts[idx]
+            parts = '，'.join(f"{self.STATUS_TEXT[k]} {c[k]}" for k in self.STATUS_TEXT if c.get(k))
+            w(f"<div class=\"child\">账号{idx}：共 {self.total(idx)} 个贴吧；{parts or '无'}</div>")
+        if self.failure_total:
+            w(f"<h3>签到失败（共 {self.failure_total} 个）：</h3>")
+            for idx, name, code, msg in self.failures:
+                w(f"<div class=\"child\">账号{idx} · {html.escape(name)}：错误码 {html.escape(code)} "
+                  f"{html.escape(msg)}</div>")
+            if self.failure_total > len(self.failures):
+                w(f"<div class=\"child\">其余 {self.failure_total - len(self.failures)} 个见附件</div>")
+        slow = self.slowest_forums()
+        if slow:
+            w("<h3>耗时最长的贴吧：</h3>")
+            for seconds, idx, name in slow:
+                w(f"<div class=\"child\">账号{idx} · {html.escape(name)}：{seconds:.2f}s</div>")
+
+sign_report = SignReport(REPORT_SLOWEST, REPORT_MAX_FAILURES)
+
+def send_email(account_count, total_sign_time, task_status, breaker_report=None, metrics_summary=None,
+               cap_report=None, report=None):
+    """
+    发送日报邮件，包含签到汇总、吧主任务状态、风控熔断情况、签到上限和请求统计，完整签到清单作为附件
     """
-    moderated_bars = ENV.get('MODERATED_BARS', '').split(',') if 'MODERATED_BARS' in ENV else []
     if ('HOST' not in ENV or 'FROM' not in ENV or 'TO' not in ENV or 'AUTH' not in ENV):
         logger.error("未配置邮箱")
         return
@@ -1094,12 +3547,41 @@ def send_email(sign_list, total_sign_time, task_status):
     FROM = ENV['FROM']
     TO = ENV['TO'].split('#')
     AUTH = ENV['AUTH']
-    length = len(sign_list)
-    subject = f"{time.strftime('%Y-%m-%d')} 签到{length}个贴吧账号"
 
-    body = f"<h2 style='color: #66ccff;'>签到报告 - {time.strftime('%Y年%m月%d日')}</h2>"
-    body += f"<h3>共有{length}个账号签到，总签到时间：{format_time(total_sign_time)}</h3>"
-    body += f"""
+    import smtplib  # 仅在配置了邮箱时才导入
+    try:
+        msg = build_report_message(account_count, total_sign_time, task_status, breaker_report,
+                                   metrics_summary, cap_report, report)
+        smtp = smtplib.SMTP()
+        smtp.connect(HOST)
+        smtp.login(FROM, AUTH)
+        smtp.sendmail(FROM, TO, msg.as_string())
+        smtp.quit()
+        logger.info("邮件发送成功")
+    except smtplib.SMTPException as e:
+        logger.error("邮件发送失败：%s", e)
+    except Exception as e:
+        logger.error("邮件发送时发生错误：%s", e)
+
+def build_report_message(account_count, total_sign_time, task_status, breaker_report=None,
+                         metrics_summary=None, cap_report=None, report=None):
+    """
+    生成日报邮件：正文为汇总视图（签到计数、失败、最慢贴吧等），完整签到清单作为 csv.gz 附件；
+    正文写入 StringIO，避免逐段拼接字符串
+    """
+    import io
+    from email.mime.application import MIMEApplication
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    report = report or sign_report
+    moderated_bars = ENV.get('MODERATED_BARS', '').split(',') if 'MODERATED_BARS' in ENV else []
+    subject = f"{time.strftime('%Y-%m-%d')} 签到{account_count}个贴吧账号"
+    out = io.StringIO()
+    w = out.write
+    w(f"<h2 style='color: #66ccff;'>签到报告 - {time.strftime('%Y年%m月%d日')}</h2>")
+    w(f"<h3>共有{account_count}个账号签到，{report.total()} 个贴吧，总签到时间：{format_time(total_sign_time)}</h3>")
+    w(f"""
     <div style='background-color: #f0f8ff; padding: 10px; margin: 10px 0; border-left: 4px solid #4a90e2;'>
         <h4>设备信息</h4>
         <ul>
@@ -1110,15 +3592,18 @@ def send_email(sign_list, total_sign_time, task_status):
             <li>代理状态: {proxy_manager.current_proxy_info}</li>
         </ul>
     </div>
-    """
+    """)
+    report.render_summary(out)
     if moderated_bars:
-        body += "<h3>吧主考核任务执行情况：</h3>"
+        w("<h3>吧主考核任务执行情况：</h3>")
         for bar_name, status in zip(moderated_bars, task_status):
             # 发帖状态判断
             if not DO_MODERATOR_TASK or not DO_MODERATOR_POST:
                 post_text = '取消'
             elif status['reply']:
                 post_text = '成功'
+            elif status.get('reply_skipped'):
+                post_text = '风控跳过'
             else:
                 post_text = '失败'
             # 置顶状态判断
@@ -1129,14 +3614,43 @@ def send_email(sign_list, total_sign_time, task_status):
             else:
                 top_text = '失败'
             icon = '✅' if status['reply'] or status['top'] else '❌'
-            body += (
+            w(
                 f"<div class=\"child\">"
                 f"{bar_name}：{icon}<br>"
                 f"发帖操作：{post_text}<br>"
                 f"置顶操作：{top_text}"
                 f"</div>"
             )
-    body += """
+    if breaker_report:
+        w("<h3>风控熔断情况：</h3>")
+        for st in breaker_report:
+            w(
+                f"<div class=\"child\">"
+                f"账号{st['account']} · {st['endpoint']}：熔断 {st['trips']} 次，"
+                f"最近错误码 {st['last_code']}，当前状态 {st['state']}"
+                f"</div>"
+            )
+    if cap_report:
+        w("<h3>签到上限：</h3>")
+        for row in cap_report:
+            names = '、'.join(html.escape(n) for n in row['skipped'][:20])
+            more = " 等（完整列表见附件）" if len(row['skipped']) > 20 else ''
+            w(
+                f"<div class=\"child\">"
+                f"账号{row['account']}：今日签到已达上限，跳过 {len(row['skipped'])} 个贴吧<br>"
+                f"{names}{more}"
+                f"</div>"
+            )
+    if metrics_summary:
+        w("<h3>请求统计：</h3>")
+        for row in metrics_summary:
+            w(
+                f"<div class=\"child\">"
+                f"{row['endpoint']}：请求 {row['count']} 次，失败 {row['failures']} 次，重试 {row['retries']} 次，"
+                f"p50≤{row['p50']}s，p90≤{row['p90']}s，流量 {row['kb']} KB"
+                f"</div>"
+            )
+    w("""
     <style>
     .child {
       background-color: rgba(173, 216, 230, 0.19);
@@ -1147,29 +3661,17 @@ def send_email(sign_list, total_sign_time, task_status):
       margin: 5px;
     }
     </style>
-    """
-    for idx, user_favorites in enumerate(sign_list, start=1):
-        body += f"<br><b>账号{idx}的签到信息：</b><br><br>"
-        for i in user_favorites:
-            body += (
-                f"<div class=\"child\">"
-                f"<div class=\"name\">贴吧名称: {i['name']}</div>"
-                f"<div class=\"slogan\">贴吧简介: {i.get('slogan','无')}</div>"
-                f"</div><hr>"
-            )
-    try:
-        msg = MIMEText(body, 'html', 'utf-8')
-        msg['subject'] = subject
-        smtp = smtplib.SMTP()
-        smtp.connect(HOST)
-        smtp.login(FROM, AUTH)
-        smtp.sendmail(FROM, TO, msg.as_string())
-        smtp.quit()
-        logger.info("邮件发送成功")
-    except smtplib.SMTPException as e:
-        logger.error("邮件发送失败：%s", e)
-    except Exception as e:
-        logger.error("邮件发送时发生错误：%s", e)
+    """)
+    msg = MIMEMultipart()
+    msg.attach(MIMEText(out.getvalue(), 'html', 'utf-8'))
+    attachment = report.attachment()
+    if attachment:
+        part = MIMEApplication(attachment, 'gzip')
+        part.add_header('Content-Disposition', 'attachment',
+                        filename=f"sign_report_{time.strftime('%Y-%m-%d')}.csv.gz")
+        msg.attach(part)
+    msg['subject'] = subject
+    return msg
 
 # -----------------------------
 # 工具函数: 时间格式化
@@ -1193,7 +3695,7 @@ async def get_fid_by_name(client: "aiotieba.Client", kw):
     """
     name = kw.rstrip("吧")
     try:
-        fid = await client.get_fid(name)
+        fid = await aiotieba_call(client, 'aiotieba.get_fid', client.get_fid(name))
         if not fid:
             raise ValueError(f"未获取到 fid：{name}")
         return str(fid)
@@ -1212,13 +3714,251 @@ def _build_aiotieba_proxy():
         return False
     if SOCKS_PROXY:
         # 直接指定代理URL（支持 socks5 / http 等）
-        return ProxyConfig(url=SOCKS_PROXY)
+        return _aiotieba_proxy_config_cls()(url=SOCKS_PROXY)
     # 启用环境变量代理
     return True
 
-async def async_main():
+async def _refresh_favorites(bduss):
+    """后台刷新关注列表；在独立的 favorites_refresh 阶段中运行，网络/休眠耗时不计入已结束的 favorites 阶段"""
+    with profiler.phase('favorites_refresh'):
+        return await asyncio.to_thread(get_favorite_fast, bduss)
+
+async def run_account(idx, bduss, stoken, proxy_cfg, can_run_moderator, bduss_alerted, precheck=(None, "")):
+    """
+    单账号流水线：tbs -> 关注列表 -> 签到 -> 吧务任务（precheck 为启动时的预检结果）
+    返回 {'forum_count', 'sign_time', 'task_status', 'breakers', 'skipped'}；账号被跳过时返回 None
+    各贴吧的签到结果逐个写入 sign_report，不在内存中保留完整关注列表
+    """
+    # 代理信息脱敏展示
+    safe_stoken = "****" if stoken else "(空)"
+    if PROXY_ENABLE:
+        safe_proxy_str = proxy_manager._sanitize_proxy_url(SOCKS_PROXY) if SOCKS_PROXY else "环境变量代理"
+    else:
+        safe_proxy_str = "未启用"
+    logger.info(f"启动账号 {idx}: BDUSS=****, STOKEN={safe_stoken}, proxy={safe_proxy_str}")
+    sign_report.account(idx, bduss)
+
+    # -------- 预检结果（启动时已由 precheck_accounts 并发完成，未登录的账号不会进入这里） --------
+    ok, detail = precheck
+    if ok is None:
+        logger.warning(f"账号#{idx} 预检网络异常：{detail}（继续尝试执行任务）")
+    else:
+        logger.info(f"账号#{idx} 预检登录正常：{detail}")
+
+    start_time = time.time()
+    task_status = []
+
+    # tbs：预检时已写入缓存，未命中（如预检网络异常）时才在线程中请求
+    try:
+        with profiler.phase('tbs'):
+            tbs = await get_tbs(bduss)
+    except Exception:
+        # 获取 tbs 失败直接跳过该账号
+        return None
+
+    # 关注列表（优先使用缓存，缓存失效时后台刷新）；无缓存时边拉取边签到
+    # 一键签到需要完整列表分批提交，开启时仍先拉完再签
+    refresh_task = None
+    streamed = False
+    try:
+        with profiler.phase('favorites'):
+            favorites, need_refresh = await asyncio.to_thread(get_favorites_cached, bduss, MSIGN_ENABLE)
+        if need_refresh:
+            refresh_task = asyncio.create_task(_refresh_favorites(bduss))
+        if favorites is None:
+            streamed = True
+            with profiler.phase('sign'):
+                favorites, _ = await sign_forums_streaming(bduss, tbs)
+    except RuntimeError as e:
+        if idx not in bduss_alerted:
+            bduss_alerted.add(idx)
+            await asyncio.to_thread(
+                notify_bduss_invalid_via_pushplus,
+                index=idx,
+                masked_id="****",
+                reason="运行中检测到未登录（疑似 BDUSS 失效）",
+                detail=str(e)
+            )
+        logger.warning(f"账号#{idx} 运行中未登录，跳过该账号")
+        return None
+    except Exception as e:
+        logger.error(f"账号#{idx} 获取关注吧单异常：{e}")
+        favorites = []
+
+    logger.info("账号%d关注贴吧数量: %d", idx, len(favorites))
+
+    # 签到
+    if not streamed:
+        with profiler.phase('sign'):
+            await sign_forums_async(bduss, tbs, favorites)
+
+    # 后台刷新完成后，补签缓存中没有的新关注贴吧
+    if refresh_task:
+        try:
+            with profiler.phase('favorites_refresh_wait'):
+                fresh = await refresh_task
+            known = {f['id'] for f in favorites}
+            added = [f for f in fresh if f['id'] not in known]
+            if added:
+                logger.info(f"账号#{idx} 刷新后新增关注 {len(added)} 个，继续签到")
+                with profiler.phase('sign_added'):
+                    await sign_forums_async(bduss, tbs, added)
+            if fresh:
+                favorites = fresh
+        except Exception as e:
+            logger.warning(f"账号#{idx} 后台刷新关注列表失败：{e}")
+
+    sign_time = int(time.time() - start_time)
+    skipped = sign_scheduler.skipped(bduss)
+    if skipped:
+        logger.warning(f"账号#{idx} 今日签到已达上限，跳过 {len(skipped)} 个贴吧：{'、'.join(skipped[:20])}"
+                       f"{' 等' if len(skipped) > 20 else ''}")
+
+    # 吧务任务：aiotieba 客户端只在确实要执行吧主任务时才创建（开关关闭时 moderator_task 直接返回）
+    if can_run_moderator and str(idx-1) == MODERATOR_BDUSS_INDEX and MODERATED_BARS and TARGET_POST_IDS:
+        bars = [b.strip() for b in MODERATED_BARS.split(',') if b.strip()]
+        posts = [p.strip() for p in TARGET_POST_IDS.split(',') if p.strip()]
+        client_ctx = (aiotieba.Client(BDUSS=bduss, STOKEN=stoken, proxy=proxy_cfg)
+                      if DO_MODERATOR_TASK else contextlib.nullcontext())
+        async with client_ctx as client:
+            if client is not None and tbs:
+                client.account.tbs = tbs  # 共用已缓存的 tbs，aiotieba 不再单独登录获取
+            seen = set()
+            for bar, pid in zip(bars, posts):
+                if bar in seen: 
+                    continue
+                seen.add(bar)
+                logger.info(f"执行吧主任务:{bar}")
+                with profiler.phase('moderator'):
+                    status = await moderator_task(client, bar, pid, bduss, stoken, proxy_cfg, tbs)
+                task_status.append(status)
+                await pacer.acquire(bduss, 'moderator')
+
+    breaker_stats = breakers.summary(bduss)
+    for st in breaker_stats:
+        logger.info(f"账号#{idx} 熔断统计：{st['endpoint']} 状态={st['state']} 次数={st['trips']} 最近错误码={st['last_code']}")
+    return {'forum_count': len(favorites), 'sign_time': sign_time, 'task_status': task_status,
+            'breakers': breaker_stats, 'skipped': skipped}
+
+# -----------------------------
+# 6. 分片运行（多个进程/矩阵任务各签一部分账号，最后合并发一封邮件）
+# -----------------------------
+SHARD     = ENV.get('SHARD', '').strip()                  # 形如 "0/4"：共 4 片中的第 0 片
+SHARD_DIR = ENV.get('SHARD_DIR', 'shard_results')        # 分片结果目录
+
+def parse_shard(spec):
+    """解析 "i/n"（i 从 0 开始），空串返回 None；格式错误抛 ValueError"""
+    if not spec:
+        return None
+    try:
+        i, n = (int(x) for x in spec.split('/'))
+    except ValueError:
+        raise ValueError(f"分片格式应为 i/n（如 0/4），实际为 {spec!r}")
+    if n < 1 or not 0 <= i < n:
+        raise ValueError(f"分片序号超出范围：{spec!r}（要求 0 <= i < n）")
+    return i, n
+
+def shard_owns(idx, shard):
+    """账号（从 1 开始的全局序号）是否属于该分片：按序号取模，与 BDUSS 顺序一一对应、结果固定"""
+    return shard is None or (idx - 1) % shard[1] == shard[0]
+
+def _shard_path(shard, suffix):
+    return os.path.join(SHARD_DIR, f"shard-{shard[0]}-of-{shard[1]}{suffix}")
+
+def _save_moderator_run(today_str):
+    try:
+        from pathlib import Path as _Path
+        import json as _json2
+        _Path('last_moderator_run.json').write_text(_json2.dumps({'last_run': today_str}))
+        logger.info(f"更新吧主任务上次运行时间: {today_str}")
+    except Exception as e:
+        logger.warning(f"更新 last_run 失败: {e}")
+
+def write_shard_result(shard, summary, report):
+    """
+    写出分片结果：shard-i-of-n.json（汇总、吧主任务状态、熔断/上限/请求统计）
+    和 shard-i-of-n.csv.gz（该分片的完整签到清单），由 merge_shards 合并
+    """
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    attachment = report.attachment()
+    if attachment:
+        with open(_shard_path(shard, '.csv.gz'), 'wb') as f:
+            f.write(attachment)
+    payload = dict(summary, shard=list(shard), report=report.state(), attachment=bool(attachment))
+    tmp = _shard_path(shard, '.json.tmp')
+    with open(tmp, 'w', encoding=UTF8) as f:
+        json.dump(payload, f, ensure_ascii=False)
+    os.replace(tmp, _shard_path(shard, '.json'))
+    logger.info(f"分片 {shard[0]}/{shard[1]} 结果已写入 {_shard_path(shard, '.json')}")
+
+def _merge_metrics(rows_list):
+    """合并各分片的请求统计：次数/失败/重试/流量相加，延迟分位取各分片最大值"""
+    merged = {}
+    for rows in rows_list:
+        for row in rows or []:
+            m = merged.setdefault(row['endpoint'], dict(row, count=0, failures=0, retries=0, kb=0.0, p50=0, p90=0))
+            for k in ('count', 'failures', 'retries', 'kb'):
+                m[k] += row[k]
+            for k in ('p50', 'p90'):
+                m[k] = max(m[k], row[k])
+    return [dict(m, kb=round(m['kb'], 1)) for _, m in sorted(merged.items())]
+
+def merge_shards():
+    """
+    合并 SHARD_DIR 下的全部分片结果：发送一封汇总邮件，有分片执行过吧主任务时更新 last_moderator_run.json
+    分片缺失时照常合并，并在日志中提示
+    """
+    import glob
+    files = sorted(glob.glob(os.path.join(SHARD_DIR, 'shard-*-of-*.json')))
+    if not files:
+        logger.error(f"{SHARD_DIR} 中没有分片结果，无法合并")
+        return
+    parts = []
+    for path in files:
+        try:
+            with open(path, 'r', encoding=UTF8) as f:
+                parts.append(json.load(f))
+        except Exception as e:
+            logger.warning(f"读取分片结果失败 {path}: {e}")
+    totals = {p['shard'][1] for p in parts}
+    seen = {p['shard'][0] for p in parts}
+    for n in totals:
+        missing = sorted(set(range(n)) - seen)
+        if missing:
+            logger.warning(f"共 {n} 个分片，缺少第 {missing} 片的结果")
+    if len(totals) > 1:
+        logger.warning(f"分片结果的总片数不一致：{sorted(totals)}")
+
+    parts.sort(key=lambda p: p['shard'][0])
+    report = SignReport(REPORT_SLOWEST, REPORT_MAX_FAILURES)
+    for p in parts:
+        attachment = None
+        if p.get('attachment'):
+            try:
+                with open(_shard_path(p['shard'], '.csv.gz'), 'rb') as f:
+                    attachment = f.read()
+            except FileNotFoundError:
+                logger.warning(f"分片 {p['shard'][0]}/{p['shard'][1]} 的签到清单缺失")
+        report.absorb(p.get('report', {}), attachment)
+
+    account_count = sum(p['account_count'] for p in parts)
+    total_sign_time = sum(p['total_sign_time'] for p in parts)
+    task_status = [st for p in parts for st in p['task_status']]
+    breaker_report = sorted((st for p in parts for st in p['breaker_report']), key=lambda st: st['account'])
+    cap_report = sorted((row for p in parts for row in p['cap_report']), key=lambda row: row['account'])
+    metrics_summary = _merge_metrics([p.get('metrics') for p in parts]) if METRICS_ENABLE else None
+    logger.info(f"已合并 {len(parts)} 个分片：{account_count} 个账号，{report.total()} 个贴吧")
+
+    moderator_runs = [p['moderator_run'] for p in parts if p.get('moderator_run')]
+    if moderator_runs:
+        _save_moderator_run(max(moderator_runs))
+    send_email(account_count, total_sign_time, task_status, breaker_report, metrics_summary, cap_report, report)
+
+async def async_main(shard=None):
     """
     主函数：签到所有账号，条件触发吧主任务后进行回复/置顶（aio 版）
+    shard=(i, n) 时只处理属于该分片的账号，不发邮件、不更新 last_moderator_run.json，
+    而是写出分片结果，由 merge_shards 合并
     """
     if 'BDUSS' not in ENV:
         logger.error("未配置 BDUSS，停止执行")
@@ -1249,109 +3989,164 @@ async def async_main():
             logger.warning(f"读取上次运行时间失败: {e}")
 
     bds_list = ENV['BDUSS'].split('#')
-    all_favorites = []
+    # 账号序号始终按完整 BDUSS 列表计算，STOKEN 与 MODERATOR_BDUSS_INDEX 的对应关系不受分片影响
+    accounts = [(idx, bduss, stokens_list[idx-1] if idx-1 < len(stokens_list) else '')
+                for idx, bduss in enumerate(bds_list, start=1) if shard_owns(idx, shard)]
+    if shard:
+        logger.info(f"分片 {shard[0]}/{shard[1]}：处理账号 {[acc[0] for acc in accounts]}")
+    # 吧主账号不在本分片时，本分片不执行吧主任务
+    owns_moderator = (MODERATOR_BDUSS_INDEX.strip().isdigit()
+                      and shard_owns(int(MODERATOR_BDUSS_INDEX) + 1, shard))
+    can_run_moderator = can_run_moderator and owns_moderator
+    account_count = 0
     total_sign_time = 0
     task_status = []
 
-    proxy_cfg = _build_aiotieba_proxy()
+    # aiotieba 的代理配置只有吧主任务会用到，未启用时不导入 aiotieba
+    proxy_cfg = _build_aiotieba_proxy() if DO_MODERATOR_TASK and can_run_moderator else False
+    # 后台获取并探测备用代理，签到开始时优先使用已验证可用的线路
+    proxy_manager.start_background_probe()
+    # 需要回帖时，后台并发补充一言句子池（回帖时只取缓存，不等网络）
+    hitokoto_task = None
+    if can_run_moderator and DO_MODERATOR_TASK and DO_MODERATOR_POST and MODERATED_BARS:
+        hitokoto_task = asyncio.create_task(hitokoto_pool.prefetch())
     # 本次运行已告警的账号，避免重复推送
     bduss_alerted = set()
 
-    for idx, bduss in enumerate(bds_list, start=1):
-        stoken = stokens_list[idx-1] if idx-1 < len(stokens_list) else ''
-        # 代理信息脱敏展示
-        safe_stoken = "****" if stoken else "(空)"
-        if PROXY_ENABLE:
-            safe_proxy_str = proxy_manager._sanitize_proxy_url(SOCKS_PROXY) if SOCKS_PROXY else "环境变量代理"
-        else:
-            safe_proxy_str = "未启用"
-        logger.info(f"启动账号 {idx}: BDUSS=****, STOKEN={safe_stoken}, proxy={safe_proxy_str}")
-
-        # -------- 预检登录态（仅依赖 BDUSS，STOKEN 可为空） --------
-        ok, detail = await check_bduss_login_state(bduss, stoken)
-        if ok is False:
-            if idx not in bduss_alerted:
-                notify_bduss_invalid_via_pushplus(
-                    index=idx,
-                    masked_id="****",
-                    reason="预检未登录（疑似 BDUSS 失效）",
-                    detail=detail
-                )
-                bduss_alerted.add(idx)
-            logger.warning(f"账号#{idx} 预检未登录，跳过该账号")
-            continue
-        elif ok is None:
-            logger.warning(f"账号#{idx} 预检网络异常：{detail}（继续尝试执行任务）")
-        else:
-            logger.info(f"账号#{idx} 预检登录正常：{detail}")
+    # 启动时通过共享会话并发预检全部账号；失效告警在签到开始前发出，未登录的账号不进入签到流程
+    prechecks = await precheck_accounts(accounts)
+    invalid = [(idx, detail) for idx, (ok, detail) in prechecks.items() if ok is False]
+    for idx, _ in invalid:
+        bduss_alerted.add(idx)
+        logger.warning(f"账号#{idx} 预检未登录，跳过该账号")
+    if invalid:
+        await asyncio.gather(*(asyncio.to_thread(
+            notify_bduss_invalid_via_pushplus,
+            index=idx,
+            masked_id="****",
+            reason="预检未登录（疑似 BDUSS 失效）",
+            detail=detail
+        ) for idx, detail in invalid))
 
-        start_time = time.time()
+    # 多账号并发：同时运行的账号数由 ACCOUNT_CONCURRENCY 限制
+    account_sem = asyncio.Semaphore(ACCOUNT_CONCURRENCY)
+    if ACCOUNT_CONCURRENCY > 1:
+        logger.info(f"多账号并发模式：共 {len(accounts)} 个账号，最多同时运行 {ACCOUNT_CONCURRENCY} 个")
 
-        # 使用异步上下文管理器管理连接
-        async with aiotieba.Client(BDUSS=bduss, STOKEN=stoken, proxy=proxy_cfg) as client:
-            # 同步获取 tbs 给旧版签到使用
-            try:
-                tbs = get_tbs_sync(bduss)
-            except Exception:
-                # 获取 tbs 失败直接跳过该账号
-                continue
-
-            # 关注列表
+    async def _guarded(idx, bduss, stoken):
+        if prechecks[idx][0] is False:
+            return None
+        async with account_sem:
             try:
-                favorites = get_favorite_fast(bduss)
-            except RuntimeError as e:
-                if idx not in bduss_alerted:
-                    notify_bduss_invalid_via_pushplus(
-                        index=idx,
-                        masked_id="****",
-                        reason="运行中检测到未登录（疑似 BDUSS 失效）",
-                        detail=str(e)
-                    )
-                    bduss_alerted.add(idx)
-                logger.warning(f"账号#{idx} 运行中未登录，跳过该账号")
-                continue
+                with profiler.phase('account', account=idx):
+                    return await run_account(idx, bduss, stoken, proxy_cfg, can_run_moderator, bduss_alerted,
+                                             prechecks[idx])
             except Exception as e:
-                logger.error(f"账号#{idx} 获取关注吧单异常：{e}")
-                favorites = []
-
-            logger.info("账号%d关注贴吧数量: %d", idx, len(favorites))
-            all_favorites.append(favorites)
-
-            # 签到
-            for f in favorites:
-                await asyncio.sleep(random.uniform(1, 3))
-                client_sign(bduss, tbs, f['id'], f['name'])
-
-            total_sign_time += int(time.time() - start_time)
-
-            # 吧务任务
-            if can_run_moderator and str(idx-1) == MODERATOR_BDUSS_INDEX and MODERATED_BARS and TARGET_POST_IDS:
-                bars = [b.strip() for b in MODERATED_BARS.split(',') if b.strip()]
-                posts = [p.strip() for p in TARGET_POST_IDS.split(',') if p.strip()]
-                seen = set()
-                for bar, pid in zip(bars, posts):
-                    if bar in seen: 
-                        continue
-                    seen.add(bar)
-                    logger.info(f"执行吧主任务:{bar}")
-                    status = await moderator_task(client, bar, pid, bduss, stoken, proxy_cfg, tbs)
-                    task_status.append(status)
-                    await asyncio.sleep(random.uniform(6, 12))
+                logger.error(f"账号#{idx} 执行异常：{e}")
+                return None
 
-    if can_run_moderator and task_status:
+    results = await asyncio.gather(*(_guarded(*acc) for acc in accounts))
+
+    # 按原账号顺序汇总，保证邮件中的账号顺序不变
+    breaker_report = []
+    cap_report = []
+    for (idx, _, _), res in zip(accounts, results):
+        if res is None:
+            continue
+        account_count += 1
+        total_sign_time += res['sign_time']
+        task_status.extend(res['task_status'])
+        breaker_report.extend(dict(st, account=idx) for st in res['breakers'])
+        if res['skipped']:
+            cap_report.append({'account': idx, 'skipped': res['skipped']})
+
+    moderator_ran = can_run_moderator and bool(task_status)
+    if moderator_ran and not shard:
+        _save_moderator_run(today_str)
+
+    aio_sessions.log_stats()
+    transport.log_stats()
+    tbs_cache.log_stats()
+    await aio_sessions.close()
+    transport.close()
+    route_memory.save()
+    if hitokoto_task:
         try:
-            from pathlib import Path as _Path
-            import json as _json2
-            _Path('last_moderator_run.json').write_text(_json2.dumps({'last_run': today_str}))
-            logger.info(f"更新吧主任务上次运行时间: {today_str}")
+            await hitokoto_task
         except Exception as e:
-            logger.warning(f"更新 last_run 失败: {e}")
+            logger.warning(f"一言句子池补充失败: {e}")
+        hitokoto_pool.save()
+    metrics.write()
 
-    send_email(all_favorites, total_sign_time, task_status)
+    metrics_summary = metrics.summary() if METRICS_ENABLE else None
+    if shard:
+        write_shard_result(shard, {
+            'account_count': account_count,
+            'total_sign_time': total_sign_time,
+            'task_status': task_status,
+            'breaker_report': breaker_report,
+            'cap_report': cap_report,
+            'metrics': metrics_summary,
+            'moderator_run': today_str if moderator_ran else None,
+        }, sign_report)
+    else:
+        with profiler.phase('send_email'):
+            send_email(account_count, total_sign_time, task_status, breaker_report, metrics_summary, cap_report)
+    log_import_times()
+    profiler.write()
     logger.info("所有用户签到结束")
 
+def log_import_times():
+    """启动耗时报告（-X importtime 风格）：main.py 模块加载时间及各延迟导入依赖的实际导入耗时"""
+    logger.info(f"[startup] main.py 模块加载 {_MODULE_LOAD_SECONDS * 1000:.1f} ms")
+    for name, seconds in sorted(LAZY_IMPORT_TIMES.items(), key=lambda kv: -kv[1]):
+        logger.info(f"[startup]   延迟导入 {name}: {seconds * 1000:.1f} ms")
+
+def run_with_cprofile(hotspots_file=PROFILE_HOTSPOTS_FILE, top=40, shard=None):
+    """用 cProfile 包裹整次运行，按累计耗时与自身耗时各输出前 top 个热点函数"""
+    import cProfile
+    import io
+    import pstats
+    prof = cProfile.Profile()
+    try:
+        prof.runcall(asyncio.run, async_main(shard))
+    finally:
+        out = io.StringIO()
+        stats = pstats.Stats(prof, stream=out).strip_dirs()
+        out.write("==== 按累计耗时 (cumulative) ====\n")
+        stats.sort_stats('cumulative').print_stats(top)
+        out.write("==== 按自身耗时 (tottime) ====\n")
+        stats.sort_stats('tottime').print_stats(top)
+        with open(hotspots_file, 'w', encoding='utf-8') as f:
+            f.write(out.getvalue())
+        logger.info(f"[profile] cProfile 热点已写入 {hotspots_file}")
+
 def main():
-    asyncio.run(async_main())
+    import argparse
+    parser = argparse.ArgumentParser(description="贴吧自动签到")
+    parser.add_argument('--profile', action='store_true', help="记录各账号各阶段耗时并输出 Chrome trace（同 PROFILE=true）")
+    parser.add_argument('--cprofile', action='store_true', help="额外用 cProfile 统计热点函数（同 PROFILE_CPROFILE=true）")
+    parser.add_argument('--shard', default=SHARD, metavar='I/N',
+                        help="只处理第 I 片账号（共 N 片，I 从 0 开始），结果写入 SHARD_DIR，不发邮件（同 SHARD=I/N）")
+    parser.add_argument('--merge', action='store_true', help="合并 SHARD_DIR 中的分片结果，发送一封汇总邮件")
+    args = parser.parse_args()
+
+    if args.merge:
+        merge_shards()
+        return
+    try:
+        shard = parse_shard(args.shard)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.profile or args.cprofile or PROFILE_CPROFILE:
+        profiler.enable = True
+    if args.cprofile or PROFILE_CPROFILE:
+        run_with_cprofile(shard=shard)
+    else:
+        asyncio.run(async_main(shard))
+
+_MODULE_LOAD_SECONDS = time.perf_counter() - _MODULE_T0
 
 if __name__ == '__main__':
     main()
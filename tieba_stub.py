@@ -0,0 +1,336 @@
+# -*- coding:utf-8 -*-
+"""
+本地贴吧接口桩 + 假 SOCKS5 代理，用于在不访问百度的情况下测量重试/线路切换的开销。
+
+桩服务器按真实路径提供 SIGN_URL / MSIGN_URL / TBS_URL / LIKIE_URL / REPLY_URL，
+每个接口可单独注入：固定/随机延迟、超时（挂起不回包）、断开连接、HTTP 5xx、
+贴吧错误码（110 / 1102 / 1107 / 160002 等），以及“签到 N 个后返回 1107”的日上限。
+假 SOCKS5 代理把连接转发到请求的目标地址，可注入握手延迟、拒绝连接、挂起握手。
+
+用法：
+    stub = TiebaStub(forums=30).start()
+    stub.set_fault('sign', Fault(latency=0.1, error_5xx=0.2, codes={'110': 0.05}))
+    proxy = FakeSocksProxy().start()          # proxy.url -> socks5h://127.0.0.1:端口
+    ...
+    stub.stop(); proxy.stop()
+"""
+import json
+import random
+import select
+import socket
+import socketserver
+import struct
+import sys
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlsplit
+
+# 真实接口路径 -> 桩内部的接口名
+ENDPOINT_PATHS = {
+    '/c/c/forum/sign': 'sign',
+    '/c/c/forum/msign': 'msign',
+    '/dc/common/tbs': 'tbs',
+    '/c/f/forum/like': 'like',
+    '/c/c/post/add': 'reply',
+}
+
+# main.py 中的地址常量 -> 接口路径（供基准脚本把请求改指向桩）
+URL_CONSTANTS = {
+    'SIGN_URL': '/c/c/forum/sign',
+    'MSIGN_URL': '/c/c/forum/msign',
+    'TBS_URL': '/dc/common/tbs',
+    'LIKIE_URL': '/c/f/forum/like',
+    'REPLY_URL': '/c/c/post/add',
+}
+
+
+class Fault:
+    """单个接口的故障注入配置；各项概率按顺序独立判定：断连 -> 超时 -> 5xx -> 错误码"""
+    def __init__(self, latency=0.0, jitter=0.0, timeout=0.0, hang=15.0, drop=0.0,
+                 error_5xx=0.0, codes=None, daily_cap=None):
+        self.latency = latency        # 固定延迟（秒）
+        self.jitter = jitter          # 额外随机延迟上限（秒）
+        self.timeout = timeout        # 挂起不回包的概率（客户端超时）
+        self.hang = hang              # 挂起时长（秒），应大于客户端超时
+        self.drop = drop              # 直接断开连接的概率
+        self.error_5xx = error_5xx    # 返回 HTTP 503 的概率
+        self.codes = dict(codes or {})  # {错误码: 概率}，如 {'110': 0.05, '1102': 0.2}
+        self.daily_cap = daily_cap    # 签到成功达到该数量后一律返回 1107
+
+    def __repr__(self):
+        return f"Fault({', '.join(f'{k}={v!r}' for k, v in vars(self).items())})"
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, form):
+        stub = self.server.stub
+        endpoint = ENDPOINT_PATHS.get(urlsplit(self.path).path)
+        if endpoint is None:
+            return self._send_json({'error_code': '404', 'error_msg': 'unknown path'}, status=404)
+        stub.record(endpoint)
+        fault = stub.fault(endpoint)
+        rng = stub.rng
+
+        delay = fault.latency + (rng.uniform(0, fault.jitter) if fault.jitter else 0)
+        if delay and stub.stopping.wait(delay):
+            return
+        if rng.random() < fault.drop:
+            # 不回包直接断开：客户端看到连接被重置
+            stub.record(endpoint, 'drop')
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        if rng.random() < fault.timeout:
+            stub.record(endpoint, 'timeout')
+            stub.stopping.wait(fault.hang)
+            self.close_connection = True
+            return
+        if rng.random() < fault.error_5xx:
+            stub.record(endpoint, '5xx')
+            return self._send_json({'error': 'service unavailable'}, status=503)
+        code = stub.pick_code(endpoint, fault)
+        if code is not None:
+            stub.record(endpoint, code)
+            return self._send_json({'error_code': code, 'error_msg': f'injected {code}'})
+        return self._send_json(stub.ok_response(endpoint, form))
+
+    def do_GET(self):
+        self._handle({})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        raw = self.rfile.read(length).decode('utf-8', 'replace') if length else ''
+        form = {k: v[0] for k, v in parse_qs(raw).items()}
+        self._handle(form)
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端/代理主动断开 keep-alive 连接属于正常情况，不打印堆栈
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class TiebaStub:
+    """本地贴吧接口桩：统计各接口命中次数与注入的故障次数"""
+    def __init__(self, forums=20, host='127.0.0.1', port=0, seed=0):
+        self.forums = forums
+        self.host = host
+        self.port = port
+        self.rng = random.Random(seed)
+        self.hits = Counter()       # {接口: 次数} 与 {(接口, 故障): 次数}
+        self.faults = {}
+        self.default_fault = Fault()
+        self.stopping = threading.Event()
+        self._signed = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    # ---------- 配置 ----------
+    def set_fault(self, endpoint, fault):
+        self.faults[endpoint] = fault
+
+    def fault(self, endpoint):
+        return self.faults.get(endpoint, self.default_fault)
+
+    def reset(self, seed=0):
+        """清空故障配置与计数，开始新一轮场景"""
+        with self._lock:
+            self.faults.clear()
+            self.hits.clear()
+            self._signed = 0
+            self.rng.seed(seed)
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def urls(self):
+        """返回 {main.py 常量名: 桩地址}"""
+        return {name: self.base_url + path for name, path in URL_CONSTANTS.items()}
+
+    # ---------- 请求处理 ----------
+    def record(self, endpoint, outcome=None):
+        with self._lock:
+            self.hits[endpoint if outcome is None else (endpoint, outcome)] += 1
+
+    def pick_code(self, endpoint, fault):
+        with self._lock:
+            if endpoint in ('sign', 'msign') and fault.daily_cap is not None and self._signed >= fault.daily_cap:
+                return '1107'
+        for code, prob in fault.codes.items():
+            if self.rng.random() < prob:
+                return str(code)
+        return None
+
+    def forum_list(self):
+        return [
+            {'id': str(1000 + i), 'name': f'stub{i}', 'level_id': str(1 + i % 15), 'cur_score': str(i * 37)}
+            for i in range(self.forums)
+        ]
+
+    def ok_response(self, endpoint, form):
+        if endpoint == 'tbs':
+            return {'is_login': 1, 'tbs': 'stubtbs'}
+        if endpoint == 'like':
+            page_no = int(form.get('page_no', 1))
+            page_size = int(form.get('page_size', 200))
+            items = self.forum_list()[(page_no - 1) * page_size:page_no * page_size]
+            return {
+                'forum_list': {'non-gconforum': items},
+                'has_more': '1' if page_no * page_size < self.forums else '0',
+                'error_code': '0',
+            }
+        if endpoint == 'sign':
+            with self._lock:
+                self._signed += 1
+            return {'error_code': '0', 'user_info': {'sign_time': 1, 'cont_sign_num': 1, 'user_sign_rank': 1}}
+        if endpoint == 'msign':
+            fids = [f for f in form.get('forum_ids', '').split(',') if f]
+            with self._lock:
+                self._signed += len(fids)
+            info = [{'forum_id': f, 'forum_name': f, 'signed': '1', 'sign_day_count': '1', 'cur_score': '8',
+                     'error': {'err_no': '0', 'usermsg': ''}} for f in fids]
+            return {'info': info, 'error': {'errno': '0'}, 'error_code': '0'}
+        if endpoint == 'reply':
+            return {'error_code': '0', 'post_id': str(self.rng.randint(10 ** 9, 10 ** 10))}
+        return {'error_code': '0'}
+
+    # ---------- 生命周期 ----------
+    def start(self):
+        self.stopping.clear()
+        self._server = _QuietHTTPServer((self.host, self.port), _StubHandler)
+        self._server.stub = self
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name='tieba-stub', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+# -----------------------------
+# 假 SOCKS5 代理（仅支持无认证 CONNECT）
+# -----------------------------
+class _SocksHandler(socketserver.BaseRequestHandler):
+    def _recv_exact(self, n):
+        buf = b''
+        while len(buf) < n:
+            chunk = self.request.recv(n - len(buf))
+            if not chunk:
+                raise ConnectionError("client closed")
+            buf += chunk
+        return buf
+
+    def handle(self):
+        proxy = self.server.proxy
+        proxy.connections += 1
+        mode = proxy.mode
+        if mode == 'refuse':
+            return  # 直接关闭，客户端握手失败
+        if mode == 'stall':
+            proxy.stopping.wait(proxy.stall)
+            return
+        if proxy.delay and proxy.stopping.wait(proxy.delay):
+            return
+        try:
+            ver, nmethods = self._recv_exact(2)
+            self._recv_exact(nmethods)
+            self.request.sendall(b'\x05\x00')
+            ver, cmd, _, atyp = self._recv_exact(4)
+            if atyp == 1:
+                host = socket.inet_ntoa(self._recv_exact(4))
+            elif atyp == 3:
+                host = self._recv_exact(self._recv_exact(1)[0]).decode()
+            elif atyp == 4:
+                host = socket.inet_ntop(socket.AF_INET6, self._recv_exact(16))
+            else:
+                return
+            port = struct.unpack('>H', self._recv_exact(2))[0]
+            if cmd != 1:
+                self.request.sendall(b'\x05\x07\x00\x01' + b'\x00' * 6)
+                return
+            try:
+                upstream = socket.create_connection((host, port), timeout=5)
+            except OSError:
+                self.request.sendall(b'\x05\x05\x00\x01' + b'\x00' * 6)
+                return
+            self.request.sendall(b'\x05\x00\x00\x01' + b'\x00' * 6)
+        except (ConnectionError, OSError, ValueError):
+            return
+        self._relay(upstream)
+
+    def _relay(self, upstream):
+        sockets = [self.request, upstream]
+        try:
+            while not self.server.proxy.stopping.is_set():
+                readable, _, _ = select.select(sockets, [], [], 0.5)
+                for s in readable:
+                    data = s.recv(65536)
+                    if not data:
+                        return
+                    (upstream if s is self.request else self.request).sendall(data)
+        except OSError:
+            pass
+        finally:
+            upstream.close()
+
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeSocksProxy:
+    """
+    假 SOCKS5 代理：mode='ok' 正常转发；'refuse' 接受后立即断开；'stall' 挂起握手 stall 秒。
+    delay 为每个新连接的握手延迟（秒）
+    """
+    def __init__(self, mode='ok', delay=0.0, stall=15.0, host='127.0.0.1', port=0):
+        self.mode = mode
+        self.delay = delay
+        self.stall = stall
+        self.host = host
+        self.port = port
+        self.connections = 0
+        self.stopping = threading.Event()
+        self._server = None
+
+    @property
+    def url(self):
+        return f"socks5h://{self.host}:{self.port}"
+
+    def start(self):
+        self.stopping.clear()
+        self._server = _ThreadingTCPServer((self.host, self.port), _SocksHandler)
+        self._server.proxy = self
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name='fake-socks', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None